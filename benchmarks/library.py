@@ -0,0 +1,224 @@
+"""Generate synthetic music libraries to benchmark earworm with.
+
+The audio files are small stubs, with just enough structure for the metadata
+(tags, duration and embedded cover) to be read from them: MP3 files with an
+ID3v2 tag and a single frame with a Xing header, Ogg Vorbis files with the
+Vorbis header packets, and FLAC files with metadata blocks. None of them have
+any actual audio. Songs are grouped into albums that share a cover, with
+covers of varying sizes, and some albums have no cover at all. File names
+include a date matching the default date_regex, and a metadata CSV for the
+library is also written.
+
+"""
+
+import argparse
+import base64
+import csv
+import datetime
+import io
+import os
+import struct
+from typing import Dict, List
+
+from PIL import Image  # type: ignore
+
+FORMATS = ("mp3", "ogg", "flac")
+SONGS_PER_ALBUM = 10
+COVER_SIZES = (200, 600, 1200)
+SAMPLE_RATE = 44100
+CSV_FILE = "metadata.csv"
+
+
+def make_cover(index: int) -> bytes:
+    """Return a JPEG cover, of one of the COVER_SIZES, for the index-th album."""
+    size = COVER_SIZES[index % len(COVER_SIZES)]
+    color = ((index * 67) % 256, (index * 131) % 256, (index * 29) % 256)
+    image = Image.new("RGB", (size, size), color)
+    f = io.BytesIO()
+    image.save(f, format="JPEG", quality=85)
+    return f.getvalue()
+
+
+def _syncsafe(size: int) -> bytes:
+    return bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def _id3_text_frame(frame_id: str, text: str) -> bytes:
+    body = b"\x03" + text.encode("utf8")
+    return frame_id.encode("ascii") + struct.pack(">I", len(body)) + b"\x00\x00" + body
+
+
+def mp3_stub(tags: Dict[str, str], duration: int, cover: bytes = b"") -> bytes:
+    frames = [
+        _id3_text_frame("TIT2", tags["title"]),
+        _id3_text_frame("TPE1", tags["artist"]),
+        _id3_text_frame("TALB", tags["album"]),
+    ]
+    if cover:
+        body = b"\x00image/jpeg\x00\x03\x00" + cover
+        frames.append(b"APIC" + struct.pack(">I", len(body)) + b"\x00\x00" + body)
+    id3 = b"".join(frames)
+
+    # A single 128 kbps, 44.1 kHz MPEG-1 Layer III frame, with a Xing header
+    # giving the number of frames of the (missing) audio stream
+    n_frames = duration * SAMPLE_RATE // 1152
+    frame = b"\xff\xfb\x90\x64" + b"\x00" * 32
+    frame += b"Xing" + struct.pack(">III", 3, n_frames, n_frames * 417)
+    frame += b"\x00" * (417 - len(frame))
+    return b"ID3\x03\x00\x00" + _syncsafe(len(id3)) + id3 + frame
+
+
+def _vorbis_comments(tags: Dict[str, str], cover: bytes) -> bytes:
+    comments = [f"{key.upper()}={value}".encode("utf8") for key, value in tags.items()]
+    if cover:
+        picture = flac_picture(cover)
+        comments.append(b"METADATA_BLOCK_PICTURE=" + base64.b64encode(picture))
+    vendor = b"earworm benchmarks"
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    return data + b"".join(struct.pack("<I", len(comment)) + comment for comment in comments)
+
+
+def flac_picture(image: bytes) -> bytes:
+    mime = b"image/jpeg"
+    data = struct.pack(">II", 3, len(mime)) + mime + struct.pack(">I", 0)
+    return data + struct.pack(">5I", 0, 0, 24, 0, len(image)) + image
+
+
+def _crc_table() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def _ogg_crc(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def _ogg_pages(packet: bytes, sequence: int, granule: int = 0, flags: int = 0) -> List[bytes]:
+    """Return the Ogg pages for a packet, split across pages if it is large."""
+    lacing = [255] * (len(packet) // 255) + [len(packet) % 255]
+    pages = []
+    offset = 0
+    for start in range(0, len(lacing), 255):
+        segments = lacing[start : start + 255]
+        size = sum(segments)
+        page_flags = flags | (1 if start else 0)
+        header = struct.pack(
+            "<4sBBqIIIB",
+            b"OggS",
+            0,
+            page_flags,
+            granule,
+            1,
+            sequence + len(pages),
+            0,
+            len(segments),
+        )
+        page = header + bytes(segments) + packet[offset : offset + size]
+        crc = _ogg_crc(page)
+        pages.append(page[:22] + struct.pack("<I", crc) + page[26:])
+        offset += size
+    return pages
+
+
+def ogg_stub(tags: Dict[str, str], duration: int, cover: bytes = b"") -> bytes:
+    identification = b"\x01vorbis" + struct.pack(
+        "<IBIiiiBB", 0, 2, SAMPLE_RATE, 0, 128000, 0, 0xB8, 1
+    )
+    comments = b"\x03vorbis" + _vorbis_comments(tags, cover) + b"\x01"
+    setup = b"\x05vorbis"
+    pages = _ogg_pages(identification, 0, flags=2)
+    pages += _ogg_pages(comments, len(pages))
+    pages += _ogg_pages(setup, len(pages))
+    pages += _ogg_pages(b"\x00" * 64, len(pages), granule=duration * SAMPLE_RATE, flags=4)
+    return b"".join(pages)
+
+
+def _flac_block(block_type: int, data: bytes, last: bool = False) -> bytes:
+    return bytes([block_type | (0x80 if last else 0)]) + len(data).to_bytes(3, "big") + data
+
+
+def flac_stub(tags: Dict[str, str], duration: int, cover: bytes = b"") -> bytes:
+    samples = duration * SAMPLE_RATE
+    # 20 bits sample rate, 3 bits channels - 1, 5 bits bits per sample - 1, 36 bits samples
+    info = (SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | samples
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6 + info.to_bytes(8, "big")
+    streaminfo += b"\x00" * 16
+    blocks = [_flac_block(0, streaminfo), _flac_block(4, _vorbis_comments(tags, b""))]
+    if cover:
+        blocks.append(_flac_block(6, flac_picture(cover)))
+    blocks.append(_flac_block(1, b"\x00" * 16, last=True))
+    return b"fLaC" + b"".join(blocks)
+
+
+STUBS = {"mp3": mp3_stub, "ogg": ogg_stub, "flac": flac_stub}
+
+
+def generate_library(
+    music_dir: str,
+    n_songs: int,
+    formats: tuple = FORMATS,
+    cover_every: int = 4,
+    padding: int = 0,
+) -> List[Dict[str, str]]:
+    """Write a library of n_songs to music_dir, with a metadata CSV, and return its rows.
+
+    Every cover_every-th album has no cover, and padding bytes are appended to
+    each file to make the library larger on disk.
+
+    """
+    os.makedirs(music_dir, exist_ok=True)
+    start = datetime.date(2000, 1, 1)
+    covers: Dict[int, bytes] = {}
+    rows = []
+    for i in range(n_songs):
+        album = i // SONGS_PER_ALBUM
+        ext = formats[i % len(formats)]
+        date = start + datetime.timedelta(days=i % 9000)
+        filename = f"track{i:06d}_{date:%Y_%m_%d}.{ext}"
+        tags = {
+            "title": f"Song {i}",
+            "artist": f"Artist {album % 97}",
+            "album": f"Album {album}",
+        }
+        duration = 60 + (i * 7) % 300
+        cover = b""
+        if cover_every and album % cover_every:
+            if album not in covers:
+                covers = {album: make_cover(album)}
+            cover = covers[album]
+        data = STUBS[ext](tags, duration, cover)
+        with open(os.path.join(music_dir, filename), "wb") as f:
+            f.write(data)
+            if padding:
+                f.write(b"\x00" * padding)
+        rows.append(dict(filename=filename, date=date.isoformat(), duration=str(duration), **tags))
+
+    with open(os.path.join(os.path.dirname(music_dir), CSV_FILE), "w", newline="") as f:
+        writer = csv.DictWriter(f, ["filename", "title", "artist", "album", "date", "duration"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("music_dir")
+    parser.add_argument("-n", "--songs", type=int, default=1000, help="Number of songs")
+    parser.add_argument("--padding", type=int, default=0, help="Bytes of padding per file")
+    options = parser.parse_args()
+    generate_library(options.music_dir, options.songs, padding=options.padding)
+
+
+if __name__ == "__main__":
+    main()
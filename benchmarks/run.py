@@ -0,0 +1,208 @@
+"""Benchmark the stages of generate_site on synthetic libraries.
+
+Libraries of each size are generated once in the work directory, and reused
+by later runs. For each size, each stage is timed on its own, followed by
+cold (empty caches and out_dir) and no-op (nothing changed) runs of the whole
+pipeline. The results are written as JSON, with the wall time and the peak
+RSS of each benchmark, so that the results for two commits can be compared
+with --compare.
+
+Peak RSS is measured by resetting the peak before each benchmark (Linux
+only). Elsewhere, it is the peak of the process so far. The peak RSS of the
+worker processes used to read metadata and resize covers is reported
+separately, and is the peak of all of them so far.
+
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import warnings
+from typing import Any, Callable, Dict, List
+
+from earworm.covers import create_covers, set_covers
+from earworm.feed import generate_feed
+from earworm.generate import generate_index, generate_site
+from earworm.media import copy_media
+from earworm.metadata import Config, get_metadata
+
+from .library import CSV_FILE, generate_library
+
+SIZES = (1000, 10000, 100000)
+
+
+def reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+def children_peak_rss_kb() -> int:
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+def measure(name: str, size: int, func: Callable[[], Any]) -> Dict[str, Any]:
+    reset_peak_rss()
+    start = time.perf_counter()
+    # Hide the progress messages and warnings printed by the stages
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        func()
+    seconds = time.perf_counter() - start
+    result = {
+        "benchmark": name,
+        "songs": size,
+        "seconds": round(seconds, 4),
+        "peak_rss_kb": peak_rss_kb(),
+        "children_peak_rss_kb": children_peak_rss_kb(),
+    }
+    print(f"{size:>8} {name:<18} {seconds:>9.3f}s {result['peak_rss_kb'] / 1024:>9.1f} MiB")
+    return result
+
+
+def library_dir(work_dir: str, size: int) -> str:
+    path = os.path.join(work_dir, f"library-{size}")
+    music_dir = os.path.join(path, "music")
+    if not os.path.exists(os.path.join(path, CSV_FILE)):
+        print(f"Generating a library of {size} songs in {path} ...")
+        shutil.rmtree(path, ignore_errors=True)
+        generate_library(music_dir, size)
+    return path
+
+
+def benchmark_size(work_dir: str, size: int, jobs: int) -> List[Dict[str, Any]]:
+    path = library_dir(work_dir, size)
+    out_dir = os.path.join(path, "public")
+    cache_path = os.path.join(path, "cache.sqlite3")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(cache_path)
+
+    config = Config(
+        music_dir=os.path.join(path, "music"),
+        out_dir=out_dir,
+        base_url="https://example.com/",
+        use_ffprobe=False,
+        _config_path=os.path.join(path, "config.yml"),
+        _cache_path=cache_path,
+        _jobs=jobs,
+    )
+    csv_config = Config(
+        music_dir=config.music_dir,
+        metadata_csv=os.path.join(path, CSV_FILE),
+        out_dir=out_dir,
+        use_ffprobe=False,
+    )
+    os.makedirs(out_dir)
+    songs: List = []
+
+    def read_metadata() -> None:
+        songs[:] = get_metadata(config)
+
+    results = [
+        measure("metadata-cold", size, read_metadata),
+        measure("metadata-warm", size, read_metadata),
+        measure("metadata-csv", size, lambda: get_metadata(csv_config)),
+        measure("media", size, lambda: copy_media(config, songs)),
+        measure("covers", size, lambda: create_covers(config, songs)),
+    ]
+    songs[:] = set_covers(songs)
+    results += [
+        measure("feed", size, lambda: generate_feed(config, songs)),
+        measure("index", size, lambda: generate_index(config, songs)),
+    ]
+
+    shutil.rmtree(out_dir)
+    os.unlink(cache_path)
+    results += [
+        measure("pipeline-cold", size, lambda: generate_site(config)),
+        measure("pipeline-noop", size, lambda: generate_site(config)),
+    ]
+    return results
+
+
+def git_revision() -> str:
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return output.decode().strip()
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = {(r["songs"], r["benchmark"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+
+    print(f"{'songs':>8} {'benchmark':<18} {'old':>9} {'new':>9} {'change':>8}")
+    for result in new:
+        before = old.get((result["songs"], result["benchmark"]))
+        if before is None:
+            continue
+        change = (result["seconds"] - before["seconds"]) / (before["seconds"] or 1) * 100
+        print(
+            f"{result['songs']:>8} {result['benchmark']:<18} {before['seconds']:>8.3f}s "
+            f"{result['seconds']:>8.3f}s {change:>+7.1f}%"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--work-dir", default=".benchmarks", help="Where libraries are generated")
+    parser.add_argument("-o", "--output", default="benchmarks.json", help="JSON file for results")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--compare", metavar="OLD_RESULTS", help="Compare the results with earlier results"
+    )
+    options = parser.parse_args()
+
+    results = []
+    for size in options.sizes:
+        results += benchmark_size(options.work_dir, size, options.jobs)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "jobs": options.jobs,
+        "results": results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote results to {options.output}")
+    if options.compare:
+        compare(options.compare, options.output)
+
+
+if __name__ == "__main__":
+    main()
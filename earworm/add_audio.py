@@ -0,0 +1,216 @@
+"""Add audio files to the music_dir, tagged with their metadata.
+
+Many files can be added at once, with their metadata given in a sheet (CSV or
+YAML, with a row for each file), or with command line flags that apply to all
+the files. Without either, the metadata is asked for interactively. The
+library is read only once, to suggest artists and albums, and to reuse the
+cover of the album of a song when no cover image is given.
+
+Files are tagged with ffmpeg, in a pool of --jobs workers. Each file is written
+to a temporary file in the music_dir and renamed, so that a partially written
+file is never picked up by a build.
+
+"""
+
+import csv
+import datetime
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import yaml
+
+from . import profiling
+from .metadata import Config, ImageRef, Song, get_metadata
+from .utils import print_errors
+
+# Tags written to the files, and read from the metadata sheet
+TAG_FIELDS = ("title", "artist", "album", "composer")
+
+
+@dataclass
+class LibraryIndex:
+    """Artists, albums and album covers of the songs in the library."""
+
+    artists: List[str] = field(default_factory=list)
+    albums: List[str] = field(default_factory=list)
+    covers: Dict[str, Union[ImageRef, str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_songs(cls, songs: List[Song]) -> "LibraryIndex":
+        covers = {song.album: song.image for song in reversed(songs) if song.album and song.image}
+        return cls(
+            artists=sorted({song.artist for song in songs if song.artist}),
+            albums=sorted({song.album for song in songs if song.album}),
+            covers=covers,
+        )
+
+
+@dataclass
+class AudioJob:
+    src: Path
+    dst: Path
+    tags: Dict[str, str]
+    cover_image: Optional[Path] = None
+
+
+def read_metadata_sheet(path: Path) -> Dict[str, Dict[str, str]]:
+    """Return the metadata for each file name in a CSV or YAML sheet.
+
+    YAML sheets are either a list of mappings with a filename key, like the
+    rows of a CSV, or a mapping from file names to their metadata. Paths to
+    cover images are relative to the sheet.
+
+    """
+    with open(path, newline="") as f:
+        if path.suffix.lower() in (".yml", ".yaml"):
+            data = yaml.safe_load(f) or []
+            if isinstance(data, dict):
+                data = [dict(value or {}, filename=key) for key, value in data.items()]
+        else:
+            data = list(csv.DictReader(f))
+
+    sheet = {}
+    for row in data:
+        row = {str(key).strip().lower(): str(value or "").strip() for key, value in row.items()}
+        if not row.get("filename"):
+            raise ValueError(f"{path}: every row needs a filename")
+        if row.get("cover_image"):
+            row["cover_image"] = str(path.parent.joinpath(os.path.expanduser(row["cover_image"])))
+        sheet[os.path.basename(row.pop("filename"))] = row
+    return sheet
+
+
+def target_name(config: Config, audio_path: Path) -> str:
+    """Return the name of the file in the music_dir, with today's date if it has no date."""
+    if re.search(config.date_regex, audio_path.name):
+        return audio_path.name
+    today = datetime.date.today().strftime(config.date_format)
+    return f"{audio_path.stem}_{today}{audio_path.suffix}"
+
+
+def ask_tags(index: LibraryIndex, audio_path: Path) -> Dict[str, str]:
+    print(f"Enter the metadata for {audio_path.name}")
+    tags = {"title": input("Enter Title: ").strip()}
+    if index.artists:
+        print(f"Artists for other songs in the music dir: {' | '.join(index.artists)}")
+    tags["artist"] = input("Enter Artist: ").strip()
+    if index.albums:
+        print(f"Albums for other songs in the music dir: {' | '.join(index.albums)}")
+    tags["album"] = input("Enter Album: ").strip()
+    return tags
+
+
+def ffmpeg_command(job: AudioJob, output: Path) -> List[str]:
+    command = ["ffmpeg", "-v", "error", "-y", "-i", str(job.src)]
+    if job.cover_image:
+        command += ["-i", str(job.cover_image), "-c", "copy", "-map", "0", "-map", "1"]
+    else:
+        command += ["-c", "copy"]
+    for key, value in job.tags.items():
+        if value:
+            command += ["-metadata", f"{key}={value}"]
+    return command + [str(output)]
+
+
+def tag_file(job: AudioJob) -> Optional[str]:
+    """Write the tagged file to its path in the music_dir, and return an error if it fails."""
+    # Keep the extension, which ffmpeg uses to pick the output format
+    tmp_path = job.dst.with_name(f".{job.dst.stem}.tmp{job.dst.suffix}")
+    profiling.count("subprocesses")
+    try:
+        with profiling.span("tag audio", path=str(job.src)):
+            subprocess.run(ffmpeg_command(job, tmp_path), check=True, capture_output=True)
+    except FileNotFoundError:
+        return "ffmpeg is not installed"
+    except subprocess.CalledProcessError as e:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return e.stderr.decode("utf8", errors="replace").strip() or f"ffmpeg exited with {e}"
+    os.replace(tmp_path, job.dst)
+    return None
+
+
+def add_audio_files(
+    config: Config,
+    paths: List[Path],
+    cover_image: Optional[Path] = None,
+    metadata_sheet: Optional[Path] = None,
+    tags: Optional[Dict[str, str]] = None,
+) -> None:
+    """Add the audio files to the music_dir.
+
+    The tags of each file are taken from its row in the metadata sheet, or
+    else from tags, or else asked for interactively.
+
+    """
+    missing = [str(path) for path in paths if not path.exists()]
+    if missing:
+        print(f"{', '.join(missing)}: file does not exist")
+        return
+
+    sheet = read_metadata_sheet(metadata_sheet) if metadata_sheet else {}
+    flags = {key: value for key, value in (tags or {}).items() if value}
+    interactive = not (sheet or flags)
+
+    # Read the library only once, and only when it is needed
+    library: List[LibraryIndex] = []
+
+    def get_index() -> LibraryIndex:
+        if not library:
+            library.append(LibraryIndex.from_songs(get_metadata(config)))
+        return library[0]
+
+    music_dir = Path(config.music_dir)
+    jobs: List[AudioJob] = []
+    for path in paths:
+        row = dict(sheet.get(path.name, {}))
+        if sheet and not row:
+            print(f"WARNING: {path.name} is not in {metadata_sheet}, using the flags only")
+        row_cover = row.pop("cover_image", "")
+        if interactive:
+            song_tags = ask_tags(get_index(), path)
+        else:
+            song_tags = dict(flags, **{key: value for key, value in row.items() if value})
+        song_tags = {key: song_tags[key] for key in TAG_FIELDS if song_tags.get(key)}
+        dst = music_dir.joinpath(target_name(config, path))
+        if dst.exists() or any(job.dst == dst for job in jobs):
+            print(f"{dst} already exists, not adding {path}")
+            return
+        cover = Path(row_cover) if row_cover else cover_image
+        jobs.append(AudioJob(path, dst, song_tags, cover))
+
+    # Songs without a cover image use the cover of other songs in their album
+    album_covers: Dict[str, Optional[Path]] = {}
+    tmp_covers = []
+    for job in jobs:
+        album = job.tags.get("album")
+        if job.cover_image or not album:
+            continue
+        if album not in album_covers:
+            image = get_index().covers.get(album)
+            data = image.read() if isinstance(image, ImageRef) else None
+            album_covers[album] = None
+            if data:
+                with tempfile.NamedTemporaryFile(delete=False) as f:
+                    f.write(data)
+                album_covers[album] = Path(f.name)
+                tmp_covers.append(f.name)
+        job.cover_image = album_covers[album]
+
+    try:
+        with ThreadPoolExecutor(max(config._jobs, 1)) as pool:
+            errors = {job.src: error for job, error in zip(jobs, pool.map(tag_file, jobs)) if error}
+    finally:
+        for name in tmp_covers:
+            os.unlink(name)
+
+    for job in jobs:
+        if job.src not in errors:
+            print(f"Copied audio file to {job.dst}")
+    print_errors("Could not add the following files", errors)
@@ -0,0 +1,110 @@
+"""Run the stages of a build only when their inputs changed.
+
+Each stage declares its inputs (config fields, the songs, files ...) and its
+outputs. Fingerprints of the inputs of each stage are kept in a build state
+file in the out_dir, and a stage is skipped when its inputs are unchanged since
+the last build and its outputs still exist. A stage can also return a (JSON
+serializable) result, like a fingerprint of the songs it read, which is saved
+along with its inputs and returned when the stage is skipped.
+
+Stages that write many files (like the media and the covers) can also watch
+the directories they write to. A snapshot of the watched files is saved at the
+end of the build, and the stage runs again when any of them were changed or
+removed since.
+
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import profiling
+from .scan import snapshot
+from .utils import content_hash, write_if_changed
+
+STATE_FILE = ".earworm-build.json"
+# Bump this when the stages change, to run all of them on the next build
+BUILD_STATE_VERSION = "3"
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def fingerprint(data: Any) -> str:
+    return content_hash(json.dumps(data, sort_keys=True, default=_json_default), length=16)
+
+
+class Build:
+    def __init__(self, out_dir: str, force: bool = False) -> None:
+        self.path = os.path.join(out_dir, STATE_FILE)
+        self.force = force
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        if state.get("version") != BUILD_STATE_VERSION:
+            state = {}
+        self.old_stages: Dict[str, Dict] = state.get("stages", {})
+        self.stages: Dict[str, Dict] = {}
+        self.watched: Dict[str, Sequence[str]] = {}
+        self.report: List[Tuple[str, str]] = []
+
+    def stale_reason(
+        self, name: str, inputs: Dict[str, str], outputs: Sequence[str], watch: Sequence[str] = ()
+    ) -> Optional[str]:
+        """Return why the stage needs to run, or None if it is up to date."""
+        old = self.old_stages.get(name)
+        if self.force:
+            return "forced"
+        elif old is None:
+            return "not built before"
+        changed = [key for key in sorted(inputs) if old["inputs"].get(key) != inputs[key]]
+        if changed:
+            return f"{', '.join(changed)} changed"
+        elif not all(os.path.exists(path) for path in outputs):
+            return "outputs missing"
+        elif watch and old.get("watched") != fingerprint(snapshot(list(watch))):
+            return "outputs changed"
+        return None
+
+    def run(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        inputs: Dict[str, Any],
+        outputs: Sequence[str] = (),
+        watch: Sequence[str] = (),
+    ) -> Any:
+        """Run the stage if it is stale, and return its result."""
+        fingerprints = {key: fingerprint(value) for key, value in inputs.items()}
+        reason = self.stale_reason(name, fingerprints, outputs, watch)
+        self.watched[name] = watch
+        if reason is None:
+            self.stages[name] = self.old_stages[name]
+            self.report.append((name, "skipped"))
+            return self.stages[name]["result"]
+
+        with profiling.span(f"stage {name}", reason=reason):
+            result = func()
+        self.stages[name] = {"inputs": fingerprints, "result": result}
+        self.report.append((name, f"ran ({reason})"))
+        return result
+
+    def save(self) -> None:
+        for name, watch in self.watched.items():
+            if watch:
+                self.stages[name] = {
+                    **self.stages[name],
+                    "watched": fingerprint(snapshot(list(watch))),
+                }
+        state = {"version": BUILD_STATE_VERSION, "stages": self.stages}
+        write_if_changed(self.path, json.dumps(state, indent=1, sort_keys=True))
+
+    def print_report(self) -> None:
+        print("Build stages:")
+        for name, status in self.report:
+            print(f"  {name}: {status}")
@@ -0,0 +1,80 @@
+"""On-disk cache for metadata read from files in the music_dir.
+
+Entries are keyed on the path of a file and are only considered valid when the
+size and the modification time (in ns) of the file are unchanged. The cache is
+a SQLite database, and is thrown away whenever the version of the data stored
+in it changes.
+
+"""
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, Optional, Set
+
+CACHE_FILE = ".earworm-cache.sqlite3"
+
+# An empty entry marks files that are known not to have any metadata
+CacheEntry = Dict[str, Any]
+
+
+class MetadataCache:
+    def __init__(self, path: str, version: str, rebuild: bool = False) -> None:
+        self.path = path
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._seen: Set[str] = set()
+        self._db = sqlite3.connect(path)
+        self._setup(rebuild)
+
+    def _setup(self, rebuild: bool) -> None:
+        db = self._db
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if rebuild or row is None or row[0] != self.version:
+            db.execute("DROP TABLE IF EXISTS files")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, metadata TEXT)"
+        )
+        db.commit()
+
+    def get(self, path: str, st: os.stat_result) -> Optional[CacheEntry]:
+        self._seen.add(path)
+        row = self._db.execute(
+            "SELECT size, mtime_ns, metadata FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None or (row[0], row[1]) != (st.st_size, st.st_mtime_ns):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[2])
+
+    def set(self, path: str, st: os.stat_result, metadata: CacheEntry) -> None:
+        self._seen.add(path)
+        self._db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, json.dumps(metadata)),
+        )
+
+    def prune(self, paths: Iterable[str]) -> None:
+        """Remove entries for paths that were not seen in the current scan."""
+        seen = set(paths)
+        stale = [
+            (path,) for (path,) in self._db.execute("SELECT path FROM files") if path not in seen
+        ]
+        self._db.executemany("DELETE FROM files WHERE path = ?", stale)
+
+    def close(self, prune: bool = True) -> None:
+        if prune:
+            self.prune(self._seen)
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self) -> "MetadataCache":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        # Don't drop entries for files we never got to, if the scan failed
+        self.close(prune=exc_type is None)
@@ -0,0 +1,132 @@
+"""Write precompressed copies of the text files in the out_dir.
+
+Web servers can serve these .gz and .br files directly (like nginx with
+gzip_static and brotli_static), instead of compressing the files on every
+request. Brotli compression needs the optional brotli package, and only gzip
+files are written without it.
+
+A file is only compressed again when its content changed, as recorded in a
+manifest (see earworm.manifest). Compressed copies of files that
+no longer exist are removed, whether or not they are in the manifest, and so
+are .br files when brotli is not installed, and all the compressed copies when
+precompress is turned off, so that servers never serve stale copies.
+
+"""
+
+import gzip
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+from . import profiling
+from .covers import COVERS_DIR
+from .manifest import Manifest
+from .metadata import Config
+from .utils import write_if_changed
+
+MANIFEST_FILE = ".earworm-compressed.json"
+TEXT_EXTENSIONS = (".html", ".js", ".css", ".xml", ".json", ".svg", ".txt")
+COMPRESSED_EXTENSIONS = (".gz", ".br")
+
+
+def _brotli() -> Optional[object]:
+    try:
+        import brotli  # type: ignore
+    except ImportError:
+        return None
+    return brotli
+
+
+def compressed_paths(path: str, use_brotli: bool) -> List[str]:
+    return [f"{path}.gz", f"{path}.br"] if use_brotli else [f"{path}.gz"]
+
+
+def gzip_compress(data: bytes) -> bytes:
+    # mtime=0 keeps the output unchanged when the file is unchanged (the mtime
+    # argument of gzip.compress needs Python 3.8)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def compress_file(path: str, use_brotli: bool) -> None:
+    with open(path, "rb") as f:
+        data = f.read()
+    with profiling.span("compress", path=path):
+        write_if_changed(f"{path}.gz", gzip_compress(data))
+        if use_brotli:
+            brotli = _brotli()
+            write_if_changed(f"{path}.br", brotli.compress(data))  # type: ignore
+    profiling.count("bytes compressed", len(data))
+
+
+def output_files(config: Config) -> Iterator[str]:
+    """Yield the files in the out_dir, skipping hidden files, the media and covers."""
+    skipped = {os.path.join(config.out_dir, name) for name in (config.media_dir, COVERS_DIR)}
+    for root, dirs, files in os.walk(config.out_dir):
+        dirs[:] = [
+            d for d in dirs if not d.startswith(".") and os.path.join(root, d) not in skipped
+        ]
+        for name in files:
+            if not name.startswith("."):
+                yield os.path.join(root, name)
+
+
+def compressed_files(config: Config) -> Iterator[str]:
+    """Yield the compressed copies of text files in the out_dir."""
+    for path in output_files(config):
+        if path.endswith(COMPRESSED_EXTENSIONS) and os.path.splitext(path)[0].endswith(
+            TEXT_EXTENSIONS
+        ):
+            yield path
+
+
+def remove_compressed_output(config: Config) -> None:
+    """Remove the compressed copies, when precompress is turned off."""
+    removed = 0
+    for path in compressed_files(config):
+        os.unlink(path)
+        removed += 1
+    manifest_path = os.path.join(config.out_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.unlink(manifest_path)
+    if removed:
+        print(f"Compressed files: {removed} removed")
+
+
+def precompress_output(config: Config) -> None:
+    use_brotli = _brotli() is not None
+    manifest = Manifest(os.path.join(config.out_dir, MANIFEST_FILE))
+    paths = []
+    for path in output_files(config):
+        if not path.endswith(TEXT_EXTENSIONS):
+            continue
+        name = os.path.relpath(path, config.out_dir)
+        entry, old_entry = manifest.add(name, path, brotli=use_brotli)
+        unchanged = old_entry and (old_entry["hash"], old_entry["brotli"]) == (
+            entry["hash"],
+            use_brotli,
+        )
+        if not (unchanged and all(map(os.path.exists, compressed_paths(path, use_brotli)))):
+            paths.append(path)
+
+    with ThreadPoolExecutor(max(config._jobs, 1)) as pool:
+        list(pool.map(lambda path: compress_file(path, use_brotli), paths))
+
+    # Remove compressed copies of files that no longer exist, like bundles with
+    # an old hash, even if they are missing from the manifest
+    removed = 0
+    for path in compressed_files(config):
+        stale = path.endswith(".br") and not use_brotli
+        if stale or not os.path.exists(os.path.splitext(path)[0]):
+            os.unlink(path)
+            removed += 1
+
+    manifest.save()
+    print(
+        f"Compressed files: {len(paths)} compressed, "
+        f"{len(manifest.entries) - len(paths)} unchanged, "
+        f"{removed} removed{'' if use_brotli else ' (install brotli for .br files)'}"
+    )
@@ -0,0 +1,171 @@
+"""Create cover images for the songs from their embedded artwork.
+
+Covers are named using a hash of the image data, so identical artwork shared
+by many songs is resized and encoded only once, while distinct artwork within
+an album stays distinct. Since the name of a cover depends only on its source
+image, covers written by earlier builds are reused as they are, without even
+reading the artwork from the audio files.
+
+Each cover is written in a few sizes, for the thumbnails in the song list, the
+player, and the og:image of the page, as WebP images with JPEG fallbacks. The
+songs list the sizes as srcsets, for browsers to pick the smallest one that
+fits. Images are never scaled up, and the list size JPEG is the cover of the
+song.
+
+"""
+
+import functools
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Union
+
+from . import profiling
+from .metadata import Config, ImageRef, Song, image_hash, is_url
+
+# NOTE: PIL is imported when first used, to keep the startup of sub-commands fast
+if TYPE_CHECKING:
+    from PIL import Image  # type: ignore
+
+COVERS_DIR = "covers"
+COVER_NAME_RE = re.compile(r"^[0-9a-f]{16}(-\d+)?\.(jpg|webp)$")
+# Widths of the thumbnail, the list (used as the cover) and the og:image sizes
+THUMB_SIZE, LIST_SIZE, OG_SIZE = 64, 300, 600
+COVER_SIZES = (THUMB_SIZE, LIST_SIZE, OG_SIZE)
+# PIL format, MIME type and quality for each format
+IMAGE_FORMATS = {"webp": ("WEBP", "image/webp", 85), "jpg": ("JPEG", "image/jpeg", 95)}
+
+
+@functools.lru_cache(maxsize=None)
+def cover_formats() -> Tuple[str, ...]:
+    from PIL import features  # type: ignore
+
+    return ("webp", "jpg") if features.check("webp") else ("jpg",)
+
+
+def cover_name(image: Union[bytes, ImageRef], size: int = LIST_SIZE, ext: str = "jpg") -> str:
+    digest = image.hash if isinstance(image, ImageRef) else image_hash(image)
+    suffix = "" if size == LIST_SIZE else f"-{size}"
+    return f"{digest[:16]}{suffix}.{ext}"
+
+
+def cover_variant(cover: str, size: int, ext: str = "jpg") -> str:
+    """Return the path of another size or format of a cover."""
+    return f"{cover[:-len('.jpg')]}{'' if size == LIST_SIZE else f'-{size}'}.{ext}"
+
+
+def cover_sources(cover: str) -> Tuple[Dict[str, str], ...]:
+    """Return the srcsets of a cover, preferred format first."""
+    return tuple(
+        {
+            "type": IMAGE_FORMATS[ext][1],
+            "srcset": ", ".join(
+                f"{cover_variant(cover, size, ext)} {size}w" for size in COVER_SIZES
+            ),
+        }
+        for ext in cover_formats()
+    )
+
+
+def square_image(img: "Image.Image", size: int) -> "Image.Image":
+    from PIL import Image
+
+    w, h = img.size
+    l = max(w, h)
+    if l <= size:
+        return img
+    square = Image.new(img.mode, (l, l), (0, 0, 0))
+    paste_coords = ((h - w) // 2, 0) if h > w else (0, (w - h) // 2)
+    square.paste(img, paste_coords)
+    return square.resize((size, size))
+
+
+def resize_image(data: bytes, size: tuple = (LIST_SIZE, LIST_SIZE)) -> "Image.Image":
+    from PIL import Image
+
+    return square_image(Image.open(io.BytesIO(data)), size[0])
+
+
+def write_cover(image: Union[bytes, ImageRef], path: str) -> str:
+    """Write all the sizes and formats of a cover, given the path of its list size JPEG."""
+    from PIL import Image
+
+    with profiling.span("write cover", path=path):
+        data = image.read() if isinstance(image, ImageRef) else image
+        if not data:
+            return path
+        img: Image.Image = Image.open(io.BytesIO(data))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        for size in COVER_SIZES:
+            resized = square_image(img, size)
+            for ext in cover_formats():
+                # Write to a temporary file first, to never leave a partial cover behind
+                variant_path = cover_variant(path, size, ext)
+                tmp_path = f"{variant_path}.tmp"
+                format, _, quality = IMAGE_FORMATS[ext]
+                resized.save(tmp_path, format=format, quality=quality, optimize=True)
+                os.replace(tmp_path, variant_path)
+    return path
+
+
+def write_covers(images: Dict[str, Union[bytes, ImageRef]], jobs: int = 1) -> None:
+    if jobs <= 1 or len(images) <= 1:
+        for path, data in images.items():
+            write_cover(data, path)
+        return
+
+    with ProcessPoolExecutor(jobs) as pool:
+        for timed in pool.map(profiling.Timed(write_cover), images.values(), images.keys()):
+            profiling.record("write cover", timed, path=timed[0])
+
+
+def set_covers(songs: List[Song]) -> List[Song]:
+    """Return songs with their covers set, without creating the cover images."""
+    new_songs = []
+    for song in songs:
+        image = song.image
+        if not image:
+            new_songs.append(song)
+        elif isinstance(image, ImageRef):
+            cover = f"{COVERS_DIR}/{cover_name(image)}"
+            new_songs.append(replace(song, cover=cover, cover_sources=cover_sources(cover)))
+        elif is_url(image):
+            new_songs.append(replace(song, cover=image))
+        else:
+            raise NotImplementedError
+    return new_songs
+
+
+def create_covers(config: Config, songs: List[Song]) -> List[Song]:
+    """Create cover images for the songs, and return songs with covers set."""
+    covers_dir = os.path.join(config.out_dir, COVERS_DIR)
+    os.makedirs(covers_dir, exist_ok=True)
+    new_songs = set_covers(songs)
+    pending: Dict[str, Union[bytes, ImageRef]] = {}
+    used: Set[str] = set()
+    sizes, formats = COVER_SIZES, cover_formats()
+    for song in new_songs:
+        if not isinstance(song.image, ImageRef):
+            continue
+        image_path = os.path.join(config.out_dir, song.cover)
+        variants = [cover_variant(song.cover, size, ext) for size in sizes for ext in formats]
+        used.update(os.path.basename(variant) for variant in variants)
+        if image_path in pending:
+            continue
+        elif not all(os.path.exists(os.path.join(config.out_dir, v)) for v in variants):
+            pending[image_path] = song.image
+
+    write_covers(pending, config._jobs)
+    profiling.count("covers created", len(pending))
+
+    # Remove covers no longer used by any song
+    for name in os.listdir(covers_dir):
+        if COVER_NAME_RE.match(name) and name not in used:
+            os.unlink(os.path.join(covers_dir, name))
+
+    unchanged = len(used) // (len(sizes) * len(formats)) - len(pending)
+    print(f"Covers: {len(pending)} created, {unchanged} unchanged")
+    return new_songs
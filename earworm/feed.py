@@ -1,19 +1,46 @@
+"""Generate an RSS/podcast feed of the songs.
+
+When feed_max_items is set, the subscription feed (index.xml) only has the
+newest songs, and older songs are written to archive feeds in the feed/
+directory, linked to each other as paged archives (RFC 5005). Archives are
+complete pages of songs numbered from the oldest, so they don't change when
+new songs are added.
+
+Rendered entries are cached in the out_dir by song, and feed files are only
+written when their contents change.
+
+"""
+
 import datetime
+import json
 import os
-from typing import List, Dict, Optional
+from typing import Dict, List, Optional
 from urllib.parse import urljoin
 import warnings
 
 from dateutil import parser, tz
+from feedgen.ext.base import BaseExtension  # type: ignore
 from feedgen.feed import FeedGenerator  # type: ignore
+from feedgen.util import xml_elem  # type: ignore
 from jinja2 import Template
 
-from .metadata import Config
+from . import profiling
+from .metadata import Config, Song
+from .utils import content_hash, write_if_changed
+
+FEED_FILE = "index.xml"
+ARCHIVE_DIR = "feed"
+CACHE_FILE = ".earworm-feed.json"
+# Bump this when the rendering of entries changes, to invalidate the cache
+FEED_CACHE_VERSION = "1"
+ATOM_NS = "http://www.w3.org/2005/Atom"
+HISTORY_NS = "http://purl.org/syndication/history/1.0"
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
 
 DESCRIPTION_TEMPLATE = Template(
     """
-{% if song.image %}
-  <img src="{{song.image}}" />
+{% if song.cover %}
+  <img src="{{song.cover}}" />
 {% endif %}
 
 {% if song.artist %}
@@ -31,6 +58,31 @@ DESCRIPTION_TEMPLATE = Template(
 )
 
 
+class ArchiveExtension(BaseExtension):
+    """Links between paged archive feeds (RFC 5005)."""
+
+    def __init__(self) -> None:
+        self.__links: Dict[str, str] = {}
+        self.__archive = False
+
+    def extend_ns(self) -> Dict[str, str]:
+        return {"fh": HISTORY_NS}
+
+    def extend_rss(self, rss_feed):
+        channel = rss_feed[0]
+        for rel, href in self.__links.items():
+            xml_elem(f"{{{ATOM_NS}}}link", channel, href=href, rel=rel)
+        if self.__archive:
+            xml_elem(f"{{{HISTORY_NS}}}archive", channel)
+        return rss_feed
+
+    def archive_link(self, rel: str, href: str) -> None:
+        self.__links[rel] = href
+
+    def archive(self, archive: bool) -> None:
+        self.__archive = archive
+
+
 def entry_date(date: str) -> Optional[datetime.datetime]:
     try:
         parsed_date = parser.parse(date)
@@ -46,30 +98,142 @@ def entry_date(date: str) -> Optional[datetime.datetime]:
     return parsed_date
 
 
-def generate_feed(config: Config, songs: List[Dict]) -> None:
-    assert config.base_url, "Base URL is required to generate a feed!"
-    feed_name = "index.xml"
+def read_cache(path: str) -> Dict:
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return cache if cache.get("version") == FEED_CACHE_VERSION else {}
+
+
+def render_entry(song: Song) -> Dict:
+    date = entry_date(song.date)
+    return {
+        "description": DESCRIPTION_TEMPLATE.render(song=song).strip(),
+        "published": date.isoformat() if date else None,
+    }
+
+
+def song_key(song: Song, base_url: str) -> str:
+    fields = [base_url, song.src, song.title, song.artist, song.album, song.date]
+    return content_hash(json.dumps(fields + [song.cover, song.filesize]))
+
+
+def feed_url(config: Config, page: int) -> str:
+    name = FEED_FILE if page == 0 else f"{ARCHIVE_DIR}/{page:04d}.xml"
+    return urljoin(config.base_url, name)
+
+
+def render_feed(
+    config: Config, songs: List[Song], entries: Dict[str, Dict], links: Dict[str, str]
+) -> bytes:
+    with profiling.span("render feed", items=len(songs)):
+        return _render_feed(config, songs, entries, links)
+
+
+def _render_feed(
+    config: Config, songs: List[Song], entries: Dict[str, Dict], links: Dict[str, str]
+) -> bytes:
     base_url = config.base_url
     fg = FeedGenerator()
     fg.load_extension("podcast")
+    fg.register_extension("archive", ArchiveExtension, atom=False, rss=True)
     fg.id(base_url)
     fg.title(config.title)
     fg.subtitle(config.description)
     fg.link(href=base_url, rel="alternate")
-    artists = {s["artist"] for s in songs if s.get("artist")}
+    artists = sorted({s.artist for s in songs if s.artist})
     fg.author([{"name": artist} for artist in artists])
     fg.logo(urljoin(base_url, "favicon.ico"))
-    fg.link(href=urljoin(base_url, feed_name), rel="self")
+    fg.link(href=links.pop("self"), rel="self")
     fg.language("en")
+    for rel, href in links.items():
+        fg.archive.archive_link(rel, href)
+    fg.archive.archive("current" in links)
 
+    dates = []
     for song in songs[::-1]:
+        entry = entries[song.src]
         fe = fg.add_entry()
-        song_url = urljoin(base_url, song["src"])
+        song_url = urljoin(base_url, song.src)
         fe.id(song_url)
-        fe.title(song["title"])
-        fe.description(DESCRIPTION_TEMPLATE.render(song=song).strip())
-        fe.link(href=urljoin(base_url, f'#{song["src"]}'))
-        fe.enclosure(song_url, song["filesize"], "audio/mpeg")
-        fe.published(entry_date(song["date"]))
+        fe.title(song.title)
+        fe.description(entry["description"])
+        fe.link(href=urljoin(base_url, f"#{song.src}"))
+        fe.enclosure(song_url, song.filesize, "audio/mpeg")
+        if entry["published"]:
+            published = datetime.datetime.fromisoformat(entry["published"])
+            fe.published(published)
+            dates.append(published)
+
+    # Use the date of the newest song, to keep unchanged feeds identical
+    fg.lastBuildDate(max(dates, default=EPOCH))
+    return fg.rss_str()
+
+
+def generate_feed(config: Config, songs: List[Song]) -> None:
+    assert config.base_url, "Base URL is required to generate a feed!"
+    cache_path = os.path.join(config.out_dir, CACHE_FILE)
+    old_cache = read_cache(cache_path)
+    old_entries = old_cache.get("entries", {})
+    entries = {}
+    rendered = 0
+    for song in songs:
+        key = song_key(song, config.base_url)
+        entry = old_entries.get(song.src)
+        if not entry or entry["key"] != key:
+            entry = dict(render_entry(song), key=key)
+            rendered += 1
+        entries[song.src] = entry
+
+    page_size = config.feed_max_items
+    if page_size <= 0:
+        page_size = len(songs) or 1
+    n_archives = len(songs) // page_size if config.feed_max_items > 0 else 0
+    oldest_first = songs[::-1]
+    archive_dir = os.path.join(config.out_dir, ARCHIVE_DIR)
+    if n_archives:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    settings = [config.base_url, config.title, config.description]
+    old_archives = old_cache.get("archives", {})
+    archives = {}
+    written = 0
+    for page in range(1, n_archives + 1):
+        page_songs = oldest_first[(page - 1) * page_size : page * page_size][::-1]
+        name = f"{page:04d}.xml"
+        path = os.path.join(archive_dir, name)
+        # Only the newest archive changes (to link to the next one) when an archive is added
+        keys = [entries[s.src]["key"] for s in page_songs]
+        key = content_hash(json.dumps(settings + [page < n_archives] + keys))
+        archives[name] = key
+        if old_archives.get(name) == key and os.path.exists(path):
+            continue
+
+        links = {"self": feed_url(config, page), "current": feed_url(config, 0)}
+        if page > 1:
+            links["prev-archive"] = feed_url(config, page - 1)
+        if page < n_archives:
+            links["next-archive"] = feed_url(config, page + 1)
+        written += write_if_changed(path, render_feed(config, page_songs, entries, links))
+
+    if os.path.isdir(archive_dir):
+        for name in os.listdir(archive_dir):
+            if name.endswith(".xml") and name not in archives:
+                os.unlink(os.path.join(archive_dir, name))
+
+    links = {"self": feed_url(config, 0)}
+    if n_archives:
+        links["prev-archive"] = feed_url(config, n_archives)
+    current = render_feed(config, songs[:page_size], entries, links)
+    written += write_if_changed(os.path.join(config.out_dir, FEED_FILE), current)
 
-    fg.rss_file(os.path.join(config.out_dir, feed_name))
+    profiling.count("feed entries rendered", rendered)
+    profiling.count("feed entries cached", len(songs) - rendered)
+    cache = {"version": FEED_CACHE_VERSION, "entries": entries, "archives": archives}
+    write_if_changed(cache_path, json.dumps(cache, indent=1, sort_keys=True))
+    print(
+        f"Feed: {rendered} entries rendered, {len(songs) - rendered} cached, "
+        f"{n_archives} archives, {written} files written"
+    )
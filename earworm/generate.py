@@ -1,28 +1,73 @@
 #!/usr/bin/env python
 import argparse
-import datetime
-import io
 import os
-import re
 import shutil
-import subprocess
-import tempfile
 from dataclasses import fields
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
 from urllib.parse import urljoin
 
-import jinja2
-import webassets  # type: ignore
 import yaml
-from PIL import Image  # type: ignore
-from webassets.ext.jinja2 import AssetsExtension  # type: ignore
 
-from .feed import generate_feed
-from .metadata import Config, create_or_update_metadata_csv, download_file, get_metadata, is_url
+from . import profiling
+from .add_audio import TAG_FIELDS, add_audio_files
+from .build import Build, fingerprint
+from .cache import CACHE_FILE
+from .compress import COMPRESSED_EXTENSIONS, precompress_output, remove_compressed_output
+from .covers import COVERS_DIR, OG_SIZE, cover_variant, create_covers, resize_image, set_covers
+from .media import MANIFEST_FILE as MEDIA_MANIFEST_FILE, copy_media
+from .pages import write_song_pages
+from .publish import publish_site
+from .metadata import (
+    Config,
+    Song,
+    create_or_update_metadata_csv,
+    fetch_metadata_csv,
+    get_metadata,
+    is_url,
+)
+from .offline import SERVICE_WORKER_FILE, generate_service_worker
+from .scan import snapshot
+from .search import write_search_index
+from .transcode import (
+    MANIFEST_FILE as RENDITIONS_MANIFEST_FILE,
+    RENDITIONS_DIR,
+    set_sources,
+    transcode_media,
+)
+from .utils import HASHED_ASSET_RE, write_if_changed
+from .waveform import (
+    MANIFEST_FILE as WAVEFORMS_MANIFEST_FILE,
+    WAVEFORMS_DIR,
+    create_waveforms,
+    set_waveforms,
+)
+
+# NOTE: Jinja, webassets and the feed module (feedgen and dateutil) are imported
+# when first used, to keep the startup of sub-commands that don't need them fast
+if TYPE_CHECKING:
+    import jinja2
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_FILE = "template.html"
+SERVICE_WORKER_TEMPLATE = os.path.join(HERE, SERVICE_WORKER_FILE)
+# Config fields that change the metadata of the songs
+METADATA_FIELDS = (
+    "music_dir",
+    "metadata_csv",
+    "title_required",
+    "album_required",
+    "date_required",
+    "date_regex",
+    "date_format",
+    "ignored_dates",
+    "use_ffprobe",
+    "audio_extensions",
+    "sniff_audio",
+    "renditions",
+    "waveforms",
+    "_metadata_url",
+)
 
 
 def read_config(config_path: str) -> Config:
@@ -32,6 +77,7 @@ def read_config(config_path: str) -> Config:
     config_dir = os.path.dirname(config_path)
     config["_config_dir"] = config_dir
     config["_config_path"] = config_path
+    config["_cache_path"] = os.path.join(config_dir, CACHE_FILE)
 
     music_dir = config["music_dir"]
     config["music_dir"] = (
@@ -40,8 +86,9 @@ def read_config(config_path: str) -> Config:
 
     metadata_csv = config.get("metadata_csv")
     if is_url(metadata_csv):
+        # Downloaded only when the metadata is needed, by fetch_metadata_csv
         config["_metadata_url"] = metadata_csv
-        metadata_csv = download_file(metadata_csv, config_dir)
+        metadata_csv = ""
     else:
         metadata_csv = (
             os.path.join(config_dir, os.path.expanduser(metadata_csv)) if metadata_csv else None
@@ -51,6 +98,10 @@ def read_config(config_path: str) -> Config:
     out_dir = os.path.join(config_dir, config.get("out_dir", "output"))
     config["out_dir"] = out_dir
 
+    publish_target = config.get("publish_target")
+    if publish_target and not is_url(publish_target):
+        config["publish_target"] = os.path.join(config_dir, os.path.expanduser(publish_target))
+
     # Ensure base_url always ends with /
     base_url = config.get("base_url", "")
     if base_url and not base_url.endswith("/"):
@@ -59,89 +110,72 @@ def read_config(config_path: str) -> Config:
     return Config(**config)
 
 
-def generate_index(config: Config, songs: List[Dict]) -> str:
+def make_environment(config: Config) -> "jinja2.Environment":
+    import jinja2
+    import webassets  # type: ignore
+    from webassets.ext.jinja2 import AssetsExtension  # type: ignore
+
     static_dir = os.path.join(HERE, "static")
     output_dir = os.path.join(config.out_dir, "static")
     assets_env = webassets.Environment(directory=output_dir, url="./static", load_path=[static_dir])
-    all_js = webassets.Bundle("bundle.js", output="bundle.js")
-    all_css = webassets.Bundle("main.css", output="bundle.css")
+    if config.hash_assets:
+        # The URLs change with the contents, so the files can be cached forever
+        assets_env.url_expire = False
+        all_js = webassets.Bundle("bundle.js", output="bundle.%(version)s.js")
+        all_css = webassets.Bundle("main.css", output="bundle.%(version)s.css")
+    else:
+        all_js = webassets.Bundle("bundle.js", output="bundle.js")
+        all_css = webassets.Bundle("main.css", output="bundle.css")
     assets_env.register("all_js", all_js)
     assets_env.register("all_css", all_css)
 
     loader = jinja2.FileSystemLoader(searchpath=HERE)
     env = jinja2.Environment(loader=loader, extensions=[AssetsExtension])
     env.assets_environment = assets_env  # type: ignore
+    return env
 
-    template = env.get_template(TEMPLATE_FILE)
-    output = template.render(
-        config=config,
-        songs=songs,
-        title=config.title,
-        base_url=config.base_url,
-        description=config.description,
-        feed_url=urljoin(config.base_url, "index.xml") if config.generate_feed else None,
-    )
-    with open(os.path.join(config.out_dir, "index.html"), "w") as f:
-        f.write(output)
-    return f.name
-
-
-def copy_media(config: Config, songs: List[Dict]) -> None:
-    music_dir = os.path.join(config.out_dir, config.media_dir)
-    os.makedirs(music_dir, exist_ok=True)
-    for song in songs:
-        shutil.copyfile(song["path"], os.path.join(config.out_dir, song["src"]))
-
-
-def create_covers(config: Config, songs: List[Dict]) -> List[str]:
-    """Create cover images for albums in the song list.
-
-    NOTE: When image is a binary blob of data in the song, we assume albums
-    have a single cover image. FIXME: This could potentially be fixed, later?
-
-    """
-    covers_dir = os.path.join(config.out_dir, "covers")
-    os.makedirs(covers_dir, exist_ok=True)
-    cover_images = []
-    for song in songs:
-        image = song.get("image")
-        if not image:
-            continue
-
-        if isinstance(image, bytes):
-            image_path = os.path.join(covers_dir, f'{song["album_slug"]}.jpg')
-            song["image"] = os.path.relpath(image_path, start=config.out_dir)
-            if os.path.exists(image_path):
-                continue
-            img = resize_image(image)
-            img.save(image_path, quality=95, optimize=True)
-
-        elif not is_url(image):
-            raise NotImplementedError
 
-        else:
-            image_path = image
-
-        cover_images.append(image_path)
-    return cover_images
+def generate_index(
+    config: Config, songs: List[Song], env: Optional["jinja2.Environment"] = None
+) -> str:
+    if env is None:
+        env = make_environment(config)
+    inline_songs, song_pages = write_song_pages(config, songs)
+    search_index = write_search_index(config, songs) if config.search else None
+    template = env.get_template(TEMPLATE_FILE)
+    with profiling.span("render index"):
+        output = template.render(
+            config=config,
+            songs=inline_songs,
+            song_pages=song_pages,
+            search_index=search_index,
+            title=config.title,
+            base_url=config.base_url,
+            description=config.description,
+            feed_url=urljoin(config.base_url, "index.xml") if config.generate_feed else None,
+        )
+    index_path = os.path.join(config.out_dir, "index.html")
+    write_if_changed(index_path, output)
+    remove_stale_assets(env)
+    return index_path
 
 
-def resize_image(data: bytes, size: tuple = (300, 300)) -> Image:
-    img = Image.open(io.BytesIO(data))
-    w, h = img.size
-    l = max(w, h)
-    if l <= 300:
-        return img
-    square = Image.new(img.mode, (l, l), (0, 0, 0))
-    paste_coords = ((h - w) // 2, 0) if h > w else (0, (w - h) // 2)
-    square.paste(img, paste_coords)
-    return square.resize(size)
+def remove_stale_assets(env: "jinja2.Environment") -> None:
+    """Remove the content-hashed bundles of earlier builds, and their compressed copies."""
+    assets_env = env.assets_environment  # type: ignore
+    current = {
+        os.path.basename(url.split("?")[0]) for bundle in assets_env for url in bundle.urls()
+    }
+    for name in os.listdir(assets_env.directory):
+        match = HASHED_ASSET_RE.match(name)
+        if match and match.group(1) not in current:
+            os.unlink(os.path.join(assets_env.directory, name))
 
 
 def create_og_image(config: Config, path: str) -> None:
     image_dir = os.path.dirname(path)
     og_path = os.path.join(image_dir, "og-image.jpg")
-    shutil.copyfile(path, og_path)
+    shutil.copyfile(cover_variant(path, OG_SIZE), og_path)
 
 
 def create_favicon(config: Config, path: str) -> None:
@@ -152,23 +186,164 @@ def create_favicon(config: Config, path: str) -> None:
     img.save(favicon_path, quality=95, optimize=True)
 
 
-def generate_site(config: Config) -> None:
-    print(f"Generating site from {config.music_dir or config._config_path} ...")
-    songs = get_metadata(config)
-    print(f"Publishing {len(songs)} songs ...")
+def config_values(config: Config, names: Iterable[str]) -> Dict[str, Any]:
+    return {name: getattr(config, name) for name in names}
+
+
+def songs_fingerprint(songs: List[Song]) -> str:
+    return fingerprint([(song.path, song.to_json()) for song in songs])
 
+
+def generate_site(config: Config, env: Optional["jinja2.Environment"] = None) -> None:
+    print(f"Generating site from {config.music_dir or config._config_path} ...")
     os.makedirs(config.out_dir, exist_ok=True)
+    build = Build(config.out_dir, force=config._rebuild_cache)
+    fetch_metadata_csv(config)
+    out_dir = os.path.abspath(config.out_dir)
+    files = snapshot([config.music_dir or "", config.metadata_csv or ""], exclude=out_dir)
+    public_fields = [f.name for f in fields(config) if not f.name.startswith("_")]
+
+    # Songs are only read when a stage that needs them has to run
+    loaded: List[List[Song]] = []
+
+    def songs() -> List[Song]:
+        if not loaded:
+            loaded.append(set_covers(get_metadata(config)))
+            print(f"Publishing {len(loaded[0])} songs ...")
+        return loaded[0]
+
+    songs_key = build.run(
+        "metadata",
+        lambda: songs_fingerprint(songs()),
+        inputs={"config": config_values(config, METADATA_FIELDS), "files": files},
+    )
 
     if config.music_dir:
-        copy_media(config, songs)
-    cover_images = create_covers(config, songs)
-    first_image = cover_images and cover_images[0]
-    if config.base_url and first_image and not is_url(first_image):
-        create_og_image(config, first_image)
-        create_favicon(config, first_image)
+        build.run(
+            "media",
+            lambda: copy_media(config, songs()),
+            inputs={
+                "config": config_values(config, ("out_dir", "media_dir", "media_link")),
+                "songs": songs_key,
+                "files": files,
+            },
+            outputs=[os.path.join(config.out_dir, MEDIA_MANIFEST_FILE)],
+            watch=[os.path.join(config.out_dir, config.media_dir)],
+        )
+
+    renditions_key = None
+    if config.music_dir and config.renditions:
+        renditions_key = build.run(
+            "renditions",
+            lambda: fingerprint(transcode_media(config, songs())),
+            inputs={
+                "config": config_values(config, ("out_dir", "media_dir", "renditions")),
+                "songs": songs_key,
+                "files": files,
+            },
+            outputs=[os.path.join(config.out_dir, RENDITIONS_MANIFEST_FILE)],
+            watch=[os.path.join(config.out_dir, config.media_dir, RENDITIONS_DIR)],
+        )
+
+    waveforms_key = None
+    if config.music_dir and config.waveforms:
+        waveforms_key = build.run(
+            "waveforms",
+            lambda: fingerprint(create_waveforms(config, songs())),
+            inputs={
+                "config": config_values(config, ("out_dir",)),
+                "songs": songs_key,
+                "files": files,
+            },
+            outputs=[
+                os.path.join(config.out_dir, WAVEFORMS_MANIFEST_FILE),
+                os.path.join(config.out_dir, WAVEFORMS_DIR),
+            ],
+            watch=[os.path.join(config.out_dir, WAVEFORMS_DIR)],
+        )
+
+    def create_song_covers() -> None:
+        create_covers(config, songs())
+
+    build.run(
+        "covers",
+        create_song_covers,
+        inputs={"config": config_values(config, ("out_dir",)), "songs": songs_key},
+        outputs=[os.path.join(config.out_dir, COVERS_DIR)],
+        watch=[os.path.join(config.out_dir, COVERS_DIR)],
+    )
+
+    def create_images() -> None:
+        first_image = next((song.cover for song in songs() if song.cover), None)
+        if config.base_url and first_image and not is_url(first_image):
+            first_image = os.path.join(config.out_dir, first_image)
+            create_og_image(config, first_image)
+            create_favicon(config, first_image)
+
+    build.run(
+        "images",
+        create_images,
+        inputs={"config": config_values(config, ("out_dir", "base_url")), "songs": songs_key},
+    )
+
+    def create_feed() -> None:
+        from .feed import generate_feed
+
+        generate_feed(config, songs())
+
     if config.generate_feed:
-        generate_feed(config, songs)
-    index_path = generate_index(config, songs)
+        feed_fields = ("out_dir", "base_url", "title", "description", "feed_max_items")
+        build.run(
+            "feed",
+            create_feed,
+            inputs={"config": config_values(config, feed_fields), "songs": songs_key},
+            outputs=[os.path.join(config.out_dir, "index.xml")],
+        )
+
+    def create_index() -> None:
+        # Songs are listed with the renditions and waveforms that were written
+        generate_index(config, set_waveforms(config, set_sources(config, songs())), env)
+
+    index_path = os.path.join(config.out_dir, "index.html")
+    build.run(
+        "index",
+        create_index,
+        inputs={
+            "config": config_values(config, public_fields),
+            "songs": songs_key,
+            "renditions": renditions_key,
+            "waveforms": waveforms_key,
+            "templates": snapshot(
+                [os.path.join(HERE, TEMPLATE_FILE), os.path.join(HERE, "static")]
+            ),
+        },
+        outputs=[index_path, os.path.join(config.out_dir, "static")],
+    )
+
+    if config.service_worker:
+        sw_inputs = [index_path, os.path.join(config.out_dir, "static"), SERVICE_WORKER_TEMPLATE]
+        # The compressed copies are written after this stage
+        sw_files = {
+            path: stat
+            for path, stat in snapshot(sw_inputs).items()
+            if not path.endswith(COMPRESSED_EXTENSIONS)
+        }
+        build.run(
+            "service worker",
+            lambda: generate_service_worker(config, songs()),
+            inputs={
+                "config": config_values(config, ("out_dir", "media_dir")),
+                "songs": songs_key,
+                "files": sw_files,
+            },
+            outputs=[os.path.join(config.out_dir, SERVICE_WORKER_FILE)],
+        )
+    build.save()
+    build.print_report()
+    if config.precompress:
+        precompress_output(config)
+    else:
+        remove_compressed_output(config)
     print(f"Site generated in {index_path}!")
 
 
@@ -201,60 +376,45 @@ def make_config_file(config: Config) -> None:
     print("Please update the value of music_dir to your directory of files.")
 
 
-def add_audio_file(config: Config, audio_path: Path, cover_image: Optional[Path] = None) -> None:
+def add_metadata_arguments(parser: argparse.ArgumentParser, suppress: bool = False) -> None:
+    def default(value: object) -> object:
+        return argparse.SUPPRESS if suppress else value
 
-    name = audio_path.name
-    date_re = re.compile(config.date_regex)
-
-    today = datetime.date.today().strftime(config.date_format)
-    new_name = (
-        f"{audio_path.stem}_{today}{audio_path.suffix}"
-        if not re.search(config.date_regex, name)
-        else name
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=default(False),
+        help="Don't use the metadata cache",
     )
-    new_path = Path(config.music_dir).joinpath(new_name)
-    songlist = get_metadata(config)
-
-    metadata = {}
-    metadata["title"] = input("Enter Title: ").strip()
-    artists = {song["artist"] for song in songlist}
-    if artists:
-        print(f"Artists for other songs in the music dir: {' | '.join(artists)}")
-    metadata["artist"] = input("Enter Artist: ").strip()
-    albums = {song["album"] for song in songlist}
-    if albums:
-        print(f"Albums for other songs in the music dir: {' | '.join(albums)}")
-    metadata["album"] = input("Enter Album: ").strip()
-
-    shutil.copyfile(str(audio_path), str(new_path))
-    name = f"{new_path.stem}_md{new_path.suffix}"
-    path = Path(config.music_dir).joinpath(name)
-
-    md = [
-        arg
-        for key, value in metadata.items()
-        if value.strip()
-        for arg in ("-metadata", f"{key}={value}")
-    ]
-    if not cover_image:
-        image_data = {song["album"]: song["image"] for song in songlist}.get(metadata["album"])
-        if image_data:
-            with tempfile.NamedTemporaryFile(delete=False) as f:
-                f.write(image_data)
-            cover_image = Path(f.name)
-
-    prefix1 = ["ffmpeg", "-i", new_path.name]
-    prefix2 = ["-map", "0", "-map", "1"]
-    copy = ["-c", "copy"]
-
-    if cover_image:
-        prefix = prefix1 + ["-i", str(cover_image)] + copy + prefix2
-    else:
-        prefix = prefix1 + copy
-    command = prefix + md + [name]
-    subprocess.check_output(command, cwd=config.music_dir)
-    os.unlink(new_path)
-    print(f"Copied audio file to {path}")
+    group.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        default=default(False),
+        help="Discard the metadata cache and re-read all files",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=default(os.cpu_count() or 1),
+        help="Number of files to read metadata from in parallel",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        default=default(None),
+        metavar="TRACE_FILE",
+        help="Print the time taken by each step, and optionally write a Chrome trace",
+    )
+
+
+def serve_site(config: Config, bind: str, port: int) -> None:
+    # NOTE: Imported here, since the serve module imports from this module
+    from .serve import serve
+
+    serve(config, bind, port)
 
 
 def main() -> None:
@@ -263,6 +423,7 @@ def main() -> None:
     # sub-commands themselves add this option, again to be able to pass this
     # argument after the sub-command name
     parser.add_argument("-c", "--config", action="store", default="config.yml")
+    add_metadata_arguments(parser)
     parser.set_defaults(func=generate_site)
 
     subparsers = parser.add_subparsers(title="sub-commands")
@@ -271,19 +432,46 @@ def main() -> None:
         "update-csv", help="Update CSV from files in the music dir"
     )
     parser_update_csv.add_argument("-c", "--config", action="store", default="config.yml")
+    add_metadata_arguments(parser_update_csv, suppress=True)
     parser_update_csv.set_defaults(func=create_or_update_metadata_csv)
 
     parser_make_config = subparsers.add_parser("make-config", help="Make a sample config file")
     parser_make_config.add_argument("-c", "--config", action="store", default="config.yml")
     parser_make_config.set_defaults(func=make_config_file)
 
-    parser_make_config = subparsers.add_parser(
-        "add-audio", help="Add an audio file to the music_dir"
+    parser_add_audio = subparsers.add_parser("add-audio", help="Add audio files to the music_dir")
+    parser_add_audio.add_argument("-c", "--config", action="store", default="config.yml")
+    parser_add_audio.add_argument("-i", "--cover-image", type=Path)
+    parser_add_audio.add_argument(
+        "-m", "--metadata", type=Path, help="CSV or YAML file with the metadata of each file"
     )
-    parser_make_config.add_argument("-c", "--config", action="store", default="config.yml")
-    parser_make_config.add_argument("-i", "--cover-image", type=Path)
-    parser_make_config.add_argument("audio", type=Path)
-    parser_make_config.set_defaults(func=add_audio_file)
+    for name in TAG_FIELDS:
+        parser_add_audio.add_argument(f"--{name}", help=f"{name.title()} of all the files")
+    add_metadata_arguments(parser_add_audio, suppress=True)
+    parser_add_audio.add_argument("audio", type=Path, nargs="+")
+    parser_add_audio.set_defaults(func=add_audio_files)
+
+    parser_serve = subparsers.add_parser(
+        "serve", help="Serve the site locally, and rebuild it when files change"
+    )
+    parser_serve.add_argument("-c", "--config", action="store", default="config.yml")
+    parser_serve.add_argument("-b", "--bind", default="127.0.0.1", help="Address to listen on")
+    parser_serve.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on")
+    add_metadata_arguments(parser_serve, suppress=True)
+    parser_serve.set_defaults(func=serve_site)
+
+    parser_publish = subparsers.add_parser(
+        "publish", help="Upload the changes to the site to the publish_target"
+    )
+    parser_publish.add_argument("-c", "--config", action="store", default="config.yml")
+    parser_publish.add_argument(
+        "-f", "--force", action="store_true", help="Upload all the files, even if unchanged"
+    )
+    parser_publish.add_argument(
+        "-n", "--dry-run", action="store_true", help="Only list the changes to upload"
+    )
+    add_metadata_arguments(parser_publish, suppress=True)
+    parser_publish.set_defaults(func=publish_site)
 
     options = parser.parse_args()
     config_path = os.path.abspath(options.config)
@@ -296,14 +484,26 @@ def main() -> None:
         print(f"Could not find the config file {options.config}.")
         print("Run `earworm make-config' to create the config file")
     else:
-        if options.func.__name__ == "add_audio_file":
-            audio = options.audio
-            if not audio.exists():
-                print(f"{audio} file does not exist")
+        if options.no_cache:
+            config._cache_path = ""
+        config._rebuild_cache = options.rebuild_cache
+        config._jobs = options.jobs
+        profiler = profiling.enable() if options.profile is not None else None
+        try:
+            if options.func.__name__ == "add_audio_files":
+                tags = {name: getattr(options, name) for name in TAG_FIELDS}
+                options.func(config, options.audio, options.cover_image, options.metadata, tags)
+            elif options.func.__name__ == "serve_site":
+                options.func(config, options.bind, options.port)
+            elif options.func.__name__ == "publish_site":
+                options.func(config, options.force, options.dry_run)
             else:
-                options.func(config, options.audio, options.cover_image)
-        else:
-            options.func(config)
+                options.func(config)
+        finally:
+            if profiler is not None:
+                profiler.print_summary()
+                if options.profile:
+                    profiler.write_trace(options.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+"""Manifests of the files derived from source files, kept across builds.
+
+Stages that write files derived from source files (like the renditions and
+the waveforms of the songs, or the compressed copies of the pages) keep a
+manifest in the out_dir, with the size, modification time and content hash of
+each source file. Source files are only hashed again when their size or
+modification time changed, and the derived files are only written again when
+the hash of their source changed, or when they are missing.
+
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .utils import print_errors
+
+
+def read_manifest(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_state(path: str, old_entry: Optional[Dict] = None) -> Dict[str, Any]:
+    """Return the size, modification time and hash of a file.
+
+    The hash of the old entry is reused if the size and modification time of
+    the file are unchanged.
+
+    """
+    st = os.stat(path)
+    if old_entry and (old_entry.get("size"), old_entry.get("mtime_ns")) == (
+        st.st_size,
+        st.st_mtime_ns,
+    ):
+        digest = old_entry["hash"]
+    else:
+        digest = file_hash(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": digest}
+
+
+class Manifest:
+    """The source files of derived files, read from the last build, and written for this one."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.old_entries = read_manifest(path)
+        self.entries: Dict[str, Dict] = {}
+
+    def add(self, key: str, source: str, **fields: Any) -> Tuple[Dict, Optional[Dict]]:
+        """Add the entry of the source file of key, and return it with the old entry.
+
+        The old entry is None if key was derived from another source file.
+
+        """
+        old_entry = self.old_entries.get(key)
+        if old_entry and old_entry.get("source") != source:
+            old_entry = None
+        entry = {"source": source, **file_state(source, old_entry), **fields}
+        self.entries[key] = entry
+        return entry, old_entry
+
+    def save(self) -> None:
+        write_manifest(self.path, self.entries)
+
+
+def remove_unused(directory: str, expected: Set[str]) -> int:
+    """Remove the files in directory, recursively, other than the expected paths."""
+    removed = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if path not in expected:
+                os.unlink(path)
+                removed += 1
+    return removed
+
+
+def print_report(
+    title: str,
+    verb: str,
+    counts: Tuple[int, int, int],
+    errors: Dict[str, str],
+    failure: str,
+) -> None:
+    """Print how many files were written, failed, unchanged and removed, and the errors."""
+    written, unchanged, removed = counts
+    print(
+        f"{title}: {written} {verb}, {len(errors)} failed, "
+        f"{unchanged} unchanged, {removed} removed"
+    )
+    print_errors(failure, errors)
@@ -0,0 +1,162 @@
+"""Incrementally publish the media files to the out_dir.
+
+A manifest of the published files is kept in the out_dir, and a file is only
+copied again when its size or modification time changed since the last build.
+Files can also be hard-linked or reflinked (copy-on-write clones) instead of
+being copied, when the music_dir and out_dir are on the same filesystem.
+Files of songs that are no longer in the library are removed.
+
+"""
+
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from . import profiling
+from .manifest import file_hash, read_manifest, write_manifest
+from .metadata import Config, Song
+
+MANIFEST_FILE = ".earworm-media.json"
+LINK_MODES = ("copy", "hardlink", "reflink")
+FICLONE = 0x40049409  # From linux/fs.h
+
+# Errors that indicate that the two files can't be linked, and that we
+# should fall back to a plain copy
+FALLBACK_ERRORS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EMLINK,
+}
+
+
+def is_up_to_date(src: str, dst: str, entry: Optional[Dict]) -> bool:
+    try:
+        src_st = os.stat(src)
+        dst_st = os.stat(dst)
+    except FileNotFoundError:
+        return False
+
+    if (src_st.st_dev, src_st.st_ino) == (dst_st.st_dev, dst_st.st_ino):
+        return True
+    elif src_st.st_size != dst_st.st_size:
+        return False
+    elif entry and (entry["size"], entry["mtime_ns"]) == (src_st.st_size, src_st.st_mtime_ns):
+        return entry.get("dst_mtime_ns") == dst_st.st_mtime_ns
+    # Same size, but we don't know if the contents changed (touched files,
+    # out_dir from older builds without a manifest, ...)
+    return file_hash(src) == file_hash(dst)
+
+
+def copy_file(src: str, dst: str) -> None:
+    """Copy the file, using the fast copy system calls of the platform, where available."""
+    shutil.copyfile(src, dst)
+
+
+def reflink_file(src: str, dst: str) -> None:
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def publish_file(src: str, dst: str, mode: str = "copy") -> str:
+    """Publish src at dst, and return the mode actually used to do it.
+
+    The file is written to a temporary path and renamed, so that dst is never
+    left half-written.
+
+    """
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.tmp")
+    if os.path.lexists(tmp_path):
+        os.unlink(tmp_path)
+
+    used = "copy"
+    try:
+        if mode == "hardlink":
+            os.link(src, tmp_path)
+            used = mode
+        elif mode == "reflink":
+            reflink_file(src, tmp_path)
+            used = mode
+    except (ImportError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in FALLBACK_ERRORS:
+            raise
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+
+    if used == "copy":
+        copy_file(src, tmp_path)
+        shutil.copystat(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return used
+
+
+def _manifest_entry(src: str, dst: str, mode: str, requested: str) -> Dict:
+    src_st = os.stat(src)
+    return {
+        "source": src,
+        "size": src_st.st_size,
+        "mtime_ns": src_st.st_mtime_ns,
+        "dst_mtime_ns": os.stat(dst).st_mtime_ns,
+        "mode": mode,
+        "requested": requested,
+    }
+
+
+def copy_media(config: Config, songs: List[Song]) -> None:
+    music_dir = os.path.join(config.out_dir, config.media_dir)
+    os.makedirs(music_dir, exist_ok=True)
+    mode = config.media_link
+    if mode not in LINK_MODES:
+        raise ValueError(f"media_link should be one of {', '.join(LINK_MODES)}, not {mode!r}")
+
+    manifest_path = os.path.join(config.out_dir, MANIFEST_FILE)
+    old_manifest = read_manifest(manifest_path)
+
+    def publish(song: Song) -> Tuple[str, str, Optional[str]]:
+        src = song.path
+        dst = os.path.join(config.out_dir, song.src)
+        entry = old_manifest.get(song.src)
+        if entry and entry["source"] != src:
+            entry = None
+        requested = entry["requested"] if entry else "copy"
+        with profiling.span("publish media", path=src):
+            if requested == mode and is_up_to_date(src, dst, entry):
+                return src, dst, None
+            used = publish_file(src, dst, mode)
+        if used == "copy":
+            profiling.count("bytes copied", os.path.getsize(dst))
+        return src, dst, used
+
+    # Songs with the same file name are published to the same path
+    unique_songs = list({song.src: song for song in songs}.values())
+    manifest = {}
+    counts = dict.fromkeys(("copy", "hardlink", "reflink", "skip"), 0)
+    with ThreadPoolExecutor(max(config._jobs, 1)) as pool:
+        for song, (src, dst, used) in zip(unique_songs, pool.map(publish, unique_songs)):
+            if used is None:
+                entry = old_manifest.get(song.src)
+                used = entry["mode"] if entry else "copy"
+                counts["skip"] += 1
+            else:
+                counts[used] += 1
+            manifest[song.src] = _manifest_entry(src, dst, used, mode)
+
+    removed = 0
+    for name in set(old_manifest) - set(manifest):
+        path = os.path.join(config.out_dir, name)
+        if os.path.exists(path):
+            os.unlink(path)
+            removed += 1
+
+    write_manifest(manifest_path, manifest)
+    print(
+        "Media files: {copy} copied, {hardlink} hard-linked, {reflink} reflinked, "
+        "{skip} unchanged, {removed} removed".format(removed=removed, **counts)
+    )
@@ -1,17 +1,46 @@
+import contextlib
 import csv
-import glob
+import hashlib
 import json
 import os
 import re
+import shutil
 import subprocess
-from dataclasses import dataclass, field, fields
-from typing import Dict, List, Optional, Union
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field, fields
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib import parse
 
-import requests
-from tinytag.tinytag import TinyTag, TinyTagException  # type: ignore
+from . import profiling
+from .cache import CacheEntry, MetadataCache
+from .scan import AUDIO_EXTENSIONS, iter_audio_files
+from .utils import print_errors
 
 UNSUPPORTED_FORMATS = (".amr",)  # Not played by FF or Chrome. See issue #10
+# Bump this when the data cached for a file changes
+METADATA_CACHE_VERSION = "2"
+DOWNLOADS_FILE = ".earworm-downloads.json"
+
+# NOTE: requests and tinytag are imported when first used, to keep the startup
+# of sub-commands that don't need them fast
+if TYPE_CHECKING:
+    import requests
+    from tinytag.tinytag import TinyTag  # type: ignore
+
+_session: Optional["requests.Session"] = None
 
 
 @dataclass
@@ -26,15 +55,31 @@ class Config:
     ignored_dates: set = field(default_factory=set)
     out_dir: str = "./public"
     media_dir: str = "music"
+    media_link: str = "copy"
     title: str = "My Music"
     song_description: str = "${song.album} (${song.date})"
     description: str = "<small>Welcome to my music page.</small>"
     base_url: str = ""
     use_ffprobe: bool = True
+    audio_extensions: list = field(default_factory=lambda: list(AUDIO_EXTENSIONS))
+    sniff_audio: bool = True
     generate_feed: bool = True
+    feed_max_items: int = 0
+    renditions: list = field(default_factory=list)
+    songs_per_page: int = 0
+    search: bool = False
+    hash_assets: bool = False
+    precompress: bool = False
+    service_worker: bool = False
+    waveforms: bool = False
+    publish_target: str = ""
+    publish_endpoint_url: str = ""
     _config_path: str = ""
     _config_dir: str = ""
     _metadata_url: str = ""
+    _cache_path: str = ""
+    _rebuild_cache: bool = False
+    _jobs: int = 1
 
 
 @dataclass
@@ -52,11 +97,145 @@ class Row:
     filesize: str = ""
 
 
+ROW_FIELDS = frozenset(f.name for f in fields(Row))
+
+
+def image_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+@dataclass(frozen=True)
+class ImageRef:
+    """Reference to the artwork embedded in an audio file.
+
+    The image data is read from the file only when it is needed, instead of
+    keeping the artwork of the whole library in memory.
+
+    """
+
+    path: str
+    hash: str
+
+    def read(self) -> Optional[bytes]:
+        from tinytag.tinytag import TinyTag  # type: ignore
+
+        return TinyTag.get(self.path, duration=False, image=True).get_image()
+
+
+@dataclass
+class Tags:
+    """Tags read from an audio file using TinyTag.
+
+    Only the attributes used by earworm are kept around, which, unlike TinyTag
+    objects, makes them easy to cache.
+
+    """
+
+    title: Optional[str] = None
+    album: Optional[str] = None
+    artist: Optional[str] = None
+    composer: Optional[str] = None
+    duration: Optional[float] = None
+    filesize: int = 0
+    date: Optional[str] = None
+    _image: Optional[ImageRef] = None
+
+    @classmethod
+    def from_tinytag(cls, tags: "TinyTag", path: str) -> "Tags":
+        names = [f.name for f in fields(cls) if not f.name.startswith("_")]
+        data: Dict[str, Any] = {name: getattr(tags, name, None) for name in names}
+        data["filesize"] = data["filesize"] or 0
+        image = tags.get_image()
+        ref = ImageRef(path, image_hash(image)) if image else None
+        return cls(_image=ref, **data)
+
+    def get_image(self) -> Optional[ImageRef]:
+        return self._image
+
+
+def _intern(text: Optional[str]) -> Optional[str]:
+    return sys.intern(text) if text else text
+
+
+@dataclass
+class Song:
+    """A song published on the site.
+
+    Songs are created once from the metadata, and are not modified in place.
+    Stages of the build that derive data for songs, like their cover images,
+    return updated copies. Strings shared by many songs (artist, album) are
+    interned, to keep memory usage of large libraries low.
+
+    """
+
+    __slots__ = (
+        "path",
+        "filename",
+        "src",
+        "title",
+        "artist",
+        "album",
+        "date",
+        "duration",
+        "image",
+        "metadata_link",
+        "filesize",
+        "cover",
+        "cover_sources",
+        "sources",
+        "waveform",
+    )
+
+    path: str
+    filename: str
+    src: str
+    title: str
+    artist: Optional[str]
+    album: Optional[str]
+    date: str
+    duration: int
+    # Source image for the cover: embedded artwork or URL
+    image: Union[ImageRef, str, None]
+    metadata_link: Optional[str]
+    filesize: str
+    # URL of the cover image published on the site, set by create_covers
+    cover: str
+    # srcsets of the sizes of the cover, for each format, set by create_covers
+    cover_sources: Tuple[Dict[str, str], ...]
+    # Audio sources for the player, smallest first, set by set_sources
+    sources: Tuple[Dict[str, str], ...]
+    # URL of the waveform peaks for the player, set by set_waveforms
+    waveform: str
+
+    def to_json(self) -> Dict[str, Any]:
+        """Data for the song used by the web page."""
+        data: Dict[str, Any] = {
+            "filename": self.filename,
+            "src": self.src,
+            "title": self.title,
+            "artist": self.artist,
+            "album": self.album,
+            "date": self.date,
+            "duration": self.duration,
+            "image": self.cover,
+            "metadata_link": self.metadata_link,
+            "filesize": self.filesize,
+        }
+        if self.cover_sources:
+            data["image_sources"] = list(self.cover_sources)
+        if self.sources:
+            data["sources"] = list(self.sources)
+        if self.waveform:
+            data["waveform"] = self.waveform
+        return data
+
+
 def is_url(text: str) -> bool:
     return bool(parse.urlparse(text).scheme)
 
 
-def google_sheet_cell_link(url: str, row_num: int, column: str = "A") -> Optional[str]:
+def google_sheet_link(url: str) -> Optional[str]:
+    """Return the link to a Google Sheet exported as CSV, without the cell range."""
     parsed_url = parse.urlparse(url)
     if not (bool(parsed_url.scheme) and parsed_url.netloc == "docs.google.com"):
         return None
@@ -64,32 +243,109 @@ def google_sheet_cell_link(url: str, row_num: int, column: str = "A") -> Optiona
     if not ("id" in qs and "gid" in qs):
         return None
 
-    url = "https://docs.google.com/spreadsheets/d/{id[0]}/edit#gid={gid[0]}&range={column}{row_num}"
-    return url.format(row_num=row_num, column=column, **qs)
+    return "https://docs.google.com/spreadsheets/d/{id[0]}/edit#gid={gid[0]}&range=".format(**qs)
+
+
+def google_sheet_cell_link(url: str, row_num: int, column: str = "A") -> Optional[str]:
+    link = google_sheet_link(url)
+    return f"{link}{column}{row_num}" if link else None
+
+
+def http_session() -> "requests.Session":
+    """Return a session shared by all requests, to reuse pooled connections."""
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+    return _session
+
+
+def read_downloads(path: str) -> Dict[str, Dict[str, str]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
 
 
 def download_file(url: str, download_dir: str) -> str:
-    with requests.get(url, stream=True) as r:
+    """Download url to download_dir, unless the earlier download is up to date.
+
+    The ETag and Last-Modified headers of downloads are saved in download_dir,
+    and sent back as conditional request headers, so that the file is only
+    downloaded again when it changed.
+
+    """
+    downloads_path = os.path.join(download_dir, DOWNLOADS_FILE)
+    downloads = read_downloads(downloads_path)
+    cached = downloads.get(url)
+    if cached and not os.path.exists(cached["path"]):
+        cached = None
+
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with http_session().get(url, headers=headers, stream=True) as r:
+        if cached and r.status_code == 304:
+            print(f"Using cached {os.path.basename(cached['path'])}, it is unchanged")
+            return cached["path"]
+
         header = r.headers.get("Content-Disposition", "")
         match = re.search('filename="(.*)"', header)
         name = match.group(1) if match else "metadata.csv"
         filename = os.path.join(download_dir, name)
         print(f"Downloading {name} ...")
         r.raise_for_status()
-        with open(filename, "wb") as f:
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "wb") as f:
             for chunk in r.iter_content(chunk_size=8192):
                 f.write(chunk)
+        os.replace(tmp_filename, filename)
+
+    downloads[url] = {
+        "path": filename,
+        "etag": r.headers.get("ETag", ""),
+        "last_modified": r.headers.get("Last-Modified", ""),
+    }
+    with open(downloads_path, "w") as f:
+        json.dump(downloads, f, indent=1, sort_keys=True)
     return filename
 
 
-def get_metadata(config: Config) -> List[Dict]:
+def fetch_metadata_csv(config: Config) -> None:
+    """Download the metadata CSV, if it is a URL, and point metadata_csv to it."""
+    if config._metadata_url and not config.metadata_csv:
+        config.metadata_csv = download_file(config._metadata_url, config._config_dir)
+
+
+def get_metadata(config: Config) -> List[Song]:
+    fetch_metadata_csv(config)
     if config.metadata_csv:
         songs = get_song_list_from_csv(config)
     else:
         songs = get_song_list_from_music_dir(config)
 
-    excluded_songs = {song["path"] for song in songs if song["path"].endswith(UNSUPPORTED_FORMATS)}
-    filtered_songs = [song for song in songs if song["path"] not in excluded_songs]
+    if config.renditions and config.music_dir is not None:
+        # Songs in unsupported formats are played from their renditions, and
+        # dropped by set_sources when they have none
+        return songs
+    return drop_unsupported(songs)
+
+
+def drop_unsupported(songs: List[Song]) -> List[Song]:
+    """Return the songs that can be played, warning about the others.
+
+    Songs in unsupported formats can only be played from their renditions.
+
+    """
+    excluded_songs = [
+        song.path for song in songs if song.path.endswith(UNSUPPORTED_FORMATS) and not song.sources
+    ]
+    filtered_songs = [song for song in songs if song.path not in excluded_songs]
     if excluded_songs:
         print(
             "\n\033[91mWARNING: The following files have unsupported formats:\n    ",
@@ -100,26 +356,85 @@ def get_metadata(config: Config) -> List[Dict]:
     return filtered_songs
 
 
+def _lower_fieldnames(reader: csv.DictReader) -> None:
+    reader.fieldnames = [f.lower() for f in reader.fieldnames] if reader.fieldnames else None
+
+
 def read_metadata_csv(config: Config) -> List[Dict]:
     with open(config.metadata_csv) as f:
         reader = csv.DictReader(f)
-        reader.fieldnames = [f.lower() for f in reader.fieldnames] if reader.fieldnames else None
+        _lower_fieldnames(reader)
         return [row for row in reader]
 
 
-def get_song_list_from_csv(config: Config) -> List[Dict]:
-    music_dir = config.music_dir
-    rows = read_metadata_csv(config)
+def parse_row(row: Dict[Optional[str], Any]) -> Row:
+    """Return the Row for a row of the metadata CSV, or raise a ValueError."""
+    if None in row:
+        raise ValueError(f"{len(row[None])} more values than there are columns")
+    if not row.get("filename"):
+        raise ValueError("no filename")
+    return Row(**{key: value or "" for key, value in row.items() if key in ROW_FIELDS})
 
-    def _path(row: Dict) -> str:
-        return (
-            row["filename"]
-            if config.music_dir is None
-            else os.path.join(config.music_dir, row["filename"])
-        )
 
-    metadata = {_path(row): Row(**row) for row in rows}
-    return metadata_to_song_list(config, metadata)
+def file_exists_checker(music_dir: Optional[str]) -> Callable[[str], bool]:
+    """Return a function to check if a file in music_dir exists.
+
+    The top-level of music_dir is listed once, instead of calling stat for
+    every file, which is slow on network mounted directories.
+
+    """
+    if music_dir is None:
+        return lambda filename: is_url(filename) or os.path.exists(filename)
+
+    try:
+        with os.scandir(music_dir) as it:
+            names = {entry.name for entry in it}
+    except FileNotFoundError:
+        names = set()
+
+    def exists(filename: str) -> bool:
+        if os.sep in filename or (os.altsep and os.altsep in filename):
+            return os.path.exists(os.path.join(music_dir, filename))
+        return filename in names
+
+    return exists
+
+
+def get_song_list_from_csv(config: Config) -> List[Song]:
+    music_dir = config.music_dir
+    exists = file_exists_checker(music_dir)
+    sheet_link = google_sheet_link(config._metadata_url)
+    songs: Dict[str, Song] = {}
+    errors = []
+    with open(config.metadata_csv, newline="") as f:
+        reader = csv.DictReader(f)
+        _lower_fieldnames(reader)
+        if "filename" not in (reader.fieldnames or []):
+            raise ValueError(f"{config.metadata_csv} has no filename column")
+        unknown = [name for name in reader.fieldnames or [] if name not in ROW_FIELDS]
+        if unknown:
+            errors.append(f"unknown columns ignored: {', '.join(unknown)}")
+
+        for num_row, data in enumerate(reader, start=2):
+            try:
+                row = parse_row(data)
+            except ValueError as e:
+                errors.append(f"line {reader.line_num}: {e}")
+                continue
+
+            if not exists(row.filename):
+                continue
+            path = row.filename if music_dir is None else os.path.join(music_dir, row.filename)
+            metadata_link = f"{sheet_link}A{num_row}" if sheet_link else None
+            song = song_from_metadata(config, path, row, metadata_link)
+            if song is not None:
+                songs[path] = song
+
+    if errors:
+        print(f"\n\033[91mWARNING: Problems in {config.metadata_csv}:\n    ", end="")
+        print("\n    ".join(errors))
+        print("\033[00m")
+    return sort_songs(songs.values())
 
 
 def ffprobe_metadata(path: str) -> Dict:
@@ -132,8 +447,11 @@ def ffprobe_metadata(path: str) -> Dict:
         "-show_format",
         path,
     ]
+    profiling.count("files probed")
+    profiling.count("subprocesses")
     try:
-        output = json.loads(subprocess.check_output(command))
+        with profiling.span("ffprobe"):
+            output = json.loads(subprocess.check_output(command))
     except FileNotFoundError as e:
         fn = e.filename
         print(f"Install {fn} to get duration, other metatdata for non-mp3 files.")
@@ -142,29 +460,164 @@ def ffprobe_metadata(path: str) -> Dict:
         output = {}
 
     data = output.get("format")
+    if not data:
+        return {}
     data["filesize"] = data.get("size", "")
     return data
 
 
-def get_metadata_from_music_dir(
-    config: Config, song_list: bool = True
-) -> Dict[str, Union[Row, TinyTag]]:
-    music_dir = config.music_dir
-    paths = glob.glob(f"{music_dir}/**/*", recursive=True)
-    metadata = {}
+def read_tags(path: str) -> Optional[Tags]:
+    from tinytag.tinytag import TinyTag, TinyTagException  # type: ignore
+
+    try:
+        with profiling.span("read tags"):
+            return Tags.from_tinytag(TinyTag.get(path, image=True), path)
+    except TinyTagException as e:
+        return None
+
+
+def probe_metadata(
+    path: str, tags: Optional[Tags], use_ffprobe: bool = True
+) -> Optional[Union[Row, Tags]]:
+    if tags is not None and tags.duration:
+        return tags
+
+    md = ffprobe_metadata(path) if use_ffprobe else {"filename": path}
+    if not md:
+        return tags
     row_keys = {f.name for f in fields(Row)}
-    for path in paths:
-        try:
-            metadata[path] = TinyTag.get(path, image=True)
-        except TinyTagException as e:
-            pass
-
-        if path not in metadata or not metadata[path].duration:
-            md = ffprobe_metadata(path) if config.use_ffprobe else {"filename": path}
-            if not md:
+    md = {key: value for key, value in md.items() if key in row_keys}
+    return Row(**md)
+
+
+def read_file_metadata(path: str, use_ffprobe: bool = True) -> Optional[Union[Row, Tags]]:
+    return probe_metadata(path, read_tags(path), use_ffprobe)
+
+
+def _format_error(e: Exception) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+def extract_metadata(
+    paths: Iterable[str], use_ffprobe: bool = True, jobs: int = 1
+) -> Tuple[Dict[str, Optional[Union[Row, Tags]]], Dict[str, str]]:
+    """Read the metadata of the given files.
+
+    When jobs > 1, the tags are parsed in a pool of processes, and at most jobs
+    ffprobe processes are run at a time. The results are in the same order as
+    the paths, irrespective of the number of jobs. Errors are collected per
+    file, instead of being raised.
+
+    """
+    metadata: Dict[str, Optional[Union[Row, Tags]]] = {}
+    errors: Dict[str, str] = {}
+    if jobs <= 1:
+        for path in paths:
+            try:
+                metadata[path] = read_file_metadata(path, use_ffprobe)
+            except Exception as e:
+                errors[path] = _format_error(e)
+        return metadata, errors
+
+    order = []
+    results: Dict[str, Future] = {}
+    with ProcessPoolExecutor(jobs) as tag_pool, ThreadPoolExecutor(jobs) as probe_pool:
+        tag_futures = {}
+        for path in paths:
+            order.append(path)
+            tag_futures[tag_pool.submit(profiling.Timed(read_tags), path)] = path
+
+        for future in as_completed(tag_futures):
+            path = tag_futures[future]
+            try:
+                tags = profiling.record("read tags", future.result())
+            except Exception as e:
+                errors[path] = _format_error(e)
+                continue
+            results[path] = probe_pool.submit(probe_metadata, path, tags, use_ffprobe)
+
+        for path in order:
+            if path not in results:
                 continue
-            md = {key: value for key, value in md.items() if key in row_keys}
-            metadata[path] = Row(**md)
+            try:
+                metadata[path] = results[path].result()
+            except Exception as e:
+                errors[path] = _format_error(e)
+
+    return metadata, errors
+
+
+def open_metadata_cache(config: Config) -> Optional[MetadataCache]:
+    if not config._cache_path:
+        return None
+    version = f"{METADATA_CACHE_VERSION}:ffprobe={config.use_ffprobe}"
+    return MetadataCache(config._cache_path, version, rebuild=config._rebuild_cache)
+
+
+def _cache_entry(tags: Optional[Union[Row, Tags]]) -> CacheEntry:
+    if tags is None:
+        return {}
+    data = {key: value for key, value in asdict(tags).items() if not key.startswith("_")}
+    data.pop("date")
+    if isinstance(tags, Row):
+        return {"kind": "row", "data": data}
+    image = tags.get_image()
+    return {"kind": "tags", "data": data, "image": image and image.hash}
+
+
+def _from_cache_entry(path: str, entry: CacheEntry) -> Optional[Union[Row, Tags]]:
+    if not entry:
+        return None
+    elif entry["kind"] == "tags":
+        image = ImageRef(path, entry["image"]) if entry["image"] else None
+        return Tags(_image=image, **entry["data"])
+    else:
+        return Row(**entry["data"])
+
+
+def get_metadata_from_music_dir(
+    config: Config, song_list: bool = True
+) -> Dict[str, Union[Row, Tags]]:
+    entries = iter_audio_files(config.music_dir, config.audio_extensions, config.sniff_audio)
+    cache = open_metadata_cache(config)
+    stats: Dict[str, os.stat_result] = {}
+    cached: Dict[str, Optional[Union[Row, Tags]]] = {}
+
+    def uncached_paths(entries: Iterable[os.DirEntry]) -> Iterator[str]:
+        for entry in entries:
+            path = entry.path
+            st = stats[path] = entry.stat()
+            cache_entry = cache.get(path, st) if cache is not None else None
+            if cache_entry is None:
+                yield path
+            else:
+                cached[path] = _from_cache_entry(path, cache_entry)
+
+    # Without ffprobe, files without a duration in their tags get placeholder
+    # rows, which are not cached, so that they are read again once it is installed
+    cache_rows = not config.use_ffprobe or shutil.which("ffprobe") is not None
+    with cache or contextlib.nullcontext():
+        extracted, errors = extract_metadata(
+            uncached_paths(entries), config.use_ffprobe, config._jobs
+        )
+        if cache is not None:
+            for path, tags in extracted.items():
+                if cache_rows or not isinstance(tags, Row):
+                    cache.set(path, stats[path], _cache_entry(tags))
+
+    profiling.count("files scanned", len(stats))
+    profiling.count("files read", len(extracted) + len(errors))
+    if cache is not None:
+        profiling.count("cache hits", cache.hits)
+        profiling.count("cache misses", cache.misses)
+        print(f"Metadata cache: {cache.hits} hits, {cache.misses} misses")
+    print_errors("Could not read metadata from the following files", errors)
+
+    metadata: Dict[str, Union[Row, Tags]] = {}
+    for path in stats:
+        tags = cached[path] if path in cached else extracted.get(path)
+        if tags is not None:
+            metadata[path] = tags
 
     date_re = re.compile(config.date_regex)
     for path, tags in metadata.items():
@@ -175,50 +628,55 @@ def get_metadata_from_music_dir(
     return metadata
 
 
-def get_song_list_from_music_dir(config: Config) -> List[Dict]:
+def get_song_list_from_music_dir(config: Config) -> List[Song]:
     metadata = get_metadata_from_music_dir(config)
     return metadata_to_song_list(config, metadata)
 
 
-def metadata_to_song_list(config: Config, metadata: Dict[str, Row]) -> List[Dict]:
-    songs = []
-
-    for num_row, (path, tags) in enumerate(metadata.items(), start=2):
-        src = os.path.basename(path)
-
-        if not ((config.music_dir is None and is_url(path)) or os.path.exists(path)):
-            continue
-        elif config.title_required and not tags.title:
-            continue
-        elif config.album_required and not tags.album:
-            continue
-        elif config.date_required and not tags.date:
-            continue
-
-        duration = int(float(tags.duration or 0))
-        album_slug = tags.album.lower().replace(" ", "-") if tags.album else ""
-        metadata_link = google_sheet_cell_link(config._metadata_url, num_row)
-        song = {
-            "path": path,
-            "filename": path if config.music_dir is None else src,
-            "src": path if config.music_dir is None else os.path.join(config.media_dir, src),
-            "title": tags.title or src,
-            "artist": tags.artist,
-            "album": tags.album,
-            "date": tags.date or "",
-            "duration": duration,
-            "image": tags.get_image() if isinstance(tags, TinyTag) else tags.image,
-            "album_slug": album_slug,
-            "metadata_link": metadata_link,
-            "filesize": str(tags.filesize),
-        }
-        songs.append(song)
+def song_from_metadata(
+    config: Config, path: str, tags: Union[Row, Tags], metadata_link: Optional[str] = None
+) -> Optional[Song]:
+    """Return the Song for a file, or None if it is missing required metadata."""
+    if config.title_required and not tags.title:
+        return None
+    elif config.album_required and not tags.album:
+        return None
+    elif config.date_required and not tags.date:
+        return None
 
-    n = len(songs)
-    return sorted(songs, key=lambda s: s["date"], reverse=True)
+    src = os.path.basename(path)
+    duration = int(float(tags.duration or 0))
+    return Song(
+        path=path,
+        filename=path if config.music_dir is None else src,
+        src=path if config.music_dir is None else os.path.join(config.media_dir, src),
+        title=tags.title or src,
+        artist=_intern(tags.artist),
+        album=_intern(tags.album),
+        date=tags.date or "",
+        duration=duration,
+        image=tags.get_image() if isinstance(tags, Tags) else tags.image,
+        metadata_link=metadata_link,
+        filesize=str(tags.filesize),
+        cover="",
+        cover_sources=(),
+        sources=(),
+        waveform="",
+    )
+
+
+def sort_songs(songs: Iterable[Song]) -> List[Song]:
+    return sorted(songs, key=lambda s: s.date, reverse=True)
+
+
+def metadata_to_song_list(config: Config, metadata: Mapping[str, Union[Row, Tags]]) -> List[Song]:
+    # The files were just listed from the music_dir, and don't need existence checks
+    songs = (song_from_metadata(config, path, tags) for path, tags in metadata.items())
+    return sort_songs(song for song in songs if song is not None)
 
 
 def create_or_update_metadata_csv(config: Config) -> None:
+    fetch_metadata_csv(config)
     if not config.metadata_csv:
         config.metadata_csv = os.path.join(config._config_dir, "metadata.csv")
 
@@ -0,0 +1,75 @@
+"""Write a service worker, to play songs without waiting for the network.
+
+The service worker precaches the page, the static files and the thumbnails
+of the covers of the newest songs, listed with their revisions (content
+hashes) in a precache manifest. Files whose revision is unchanged are reused
+from the caches of earlier versions of the service worker. Songs are cached as
+they are played, and the player prefetches the start of the next song in the
+queue, so that songs play right away, and songs played before also play
+offline. See sw.js for the caching strategies.
+
+"""
+
+import os
+from typing import Dict, List
+
+from .covers import COVERS_DIR, THUMB_SIZE
+from .metadata import Config, Song, is_url
+from .pages import SONGS_DIR
+from .search import SEARCH_DIR
+from .utils import content_hash, write_if_changed
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_WORKER_FILE = "sw.js"
+# Number of covers precached, for the newest songs
+PRECACHE_COVERS = 100
+
+
+def file_revision(path: str) -> str:
+    with open(path, "rb") as f:
+        return content_hash(f.read())
+
+
+def precache_manifest(config: Config, songs: List[Song]) -> List[Dict[str, str]]:
+    index_path = os.path.join(config.out_dir, "index.html")
+    manifest = [{"url": "./", "revision": file_revision(index_path)}]
+
+    static_dir = os.path.join(config.out_dir, "static")
+    for name in sorted(os.listdir(static_dir)):
+        path = os.path.join(static_dir, name)
+        if not name.startswith(".") and not name.endswith((".gz", ".br")) and os.path.isfile(path):
+            manifest.append({"url": f"static/{name}", "revision": file_revision(path)})
+
+    # Covers are named after the hash of their contents, and need no revision
+    covers: Dict[str, Song] = {}
+    for song in songs:
+        if len(covers) >= PRECACHE_COVERS:
+            break
+        if song.cover and not is_url(song.cover):
+            covers.setdefault(song.cover, song)
+    for song in covers.values():
+        for source in song.cover_sources:
+            for candidate in source["srcset"].split(", "):
+                url, width = candidate.split()
+                if width == f"{THUMB_SIZE}w":
+                    manifest.append({"url": url, "revision": ""})
+    return manifest
+
+
+def generate_service_worker(config: Config, songs: List[Song]) -> None:
+    from jinja2 import Template
+
+    with open(os.path.join(HERE, SERVICE_WORKER_FILE)) as f:
+        template = Template(f.read())
+    manifest = precache_manifest(config, songs)
+    output = template.render(
+        version=content_hash(repr(manifest)),
+        precache=manifest,
+        media_dir=config.media_dir,
+        covers_dir=COVERS_DIR,
+        songs_dir=SONGS_DIR,
+        search_dir=SEARCH_DIR,
+    )
+    path = os.path.join(config.out_dir, SERVICE_WORKER_FILE)
+    written = write_if_changed(path, output)
+    print(f"Service worker: {len(manifest)} files precached{'' if written else ', unchanged'}")
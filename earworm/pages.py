@@ -0,0 +1,74 @@
+"""Split the song list into pages, loaded lazily by the web page.
+
+Inlining the whole library into index.html makes the page weight, and the
+time taken by the browser to parse it, grow with the library. When
+songs_per_page is set, the songs are written as JSON pages in the songs/
+directory instead, and only the newest page is inlined in the index.
+
+Pages are numbered from the oldest song, so that adding new songs only changes
+the newest pages, and the older pages stay unchanged (and cached by browsers)
+across builds. The URLs of the pages include a hash of their contents, which
+changes when the songs on the page do.
+
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+from .metadata import Config, Song
+from .utils import content_hash, write_if_changed
+
+SONGS_DIR = "songs"
+MANIFEST_FILE = "index.json"
+
+
+def dump_json(data: Any) -> str:
+    return json.dumps(data, separators=(",", ":"), sort_keys=True)
+
+
+def write_song_pages(
+    config: Config, songs: List[Song]
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Write pages of songs, and return the inlined songs and the manifest.
+
+    The manifest has the total number of songs and their total duration, used
+    by the web page to size the playlist before all the songs are loaded. It
+    also lists the pages that are not inlined, newest first. When
+    songs_per_page is not set, all the songs are inlined.
+
+    """
+    data = [song.to_json() for song in songs]
+    totals = {"total": len(data), "duration": sum(song["duration"] for song in data)}
+    page_size = config.songs_per_page
+    if page_size <= 0:
+        return data, dict(totals, pages=[])
+
+    songs_dir = os.path.join(config.out_dir, SONGS_DIR)
+    os.makedirs(songs_dir, exist_ok=True)
+
+    # songs are sorted newest first, but pages are numbered from the oldest
+    oldest_first = data[::-1]
+    pages: List[Dict[str, Any]] = []
+    # Songs of each page, oldest page first
+    page_songs_list: List[List[Dict[str, Any]]] = []
+    names = set()
+    for start in range(0, len(oldest_first), page_size):
+        page_songs = oldest_first[start : start + page_size][::-1]
+        name = f"{start // page_size + 1:04d}.json"
+        content = dump_json(page_songs)
+        write_if_changed(os.path.join(songs_dir, name), content)
+        names.add(name)
+        url = f"{SONGS_DIR}/{name}?v={content_hash(content)}"
+        pages.append({"url": url, "count": len(page_songs)})
+        page_songs_list.append(page_songs)
+
+    for name in os.listdir(songs_dir):
+        if name.endswith(".json") and name != MANIFEST_FILE and name not in names:
+            os.unlink(os.path.join(songs_dir, name))
+
+    pages.reverse()
+    inline_songs = page_songs_list[-1] if page_songs_list else []
+    manifest: Dict[str, Any] = dict(totals, pages=pages[1:])
+    write_if_changed(os.path.join(songs_dir, MANIFEST_FILE), dump_json(manifest))
+    return inline_songs, manifest
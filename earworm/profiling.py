@@ -0,0 +1,151 @@
+"""Profile builds: time spent in each stage and per-file operation, and counters.
+
+Profiling is off by default, and span() and count() only check a global when
+it is off, so that they can be left in the hot paths. When it is on, a summary
+table is printed at the end of the build, and the spans can also be written as
+a Chrome trace-event file, to view in chrome://tracing or Perfetto.
+
+Operations run in worker processes (reading tags and writing covers, when
+jobs > 1) are wrapped with Timed, which returns their durations along with
+their results, and their spans are recorded by the parent process with
+record().
+
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+_profiler: Optional["Profiler"] = None
+_null_context = contextlib.nullcontext()
+
+# Result of a Timed call: result, start (epoch seconds), duration, process id
+TimedResult = Tuple[Any, float, float, int]
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        # Spans of worker processes are timed with the wall clock
+        self.wall_start = time.time()
+        self.events: List[Dict[str, Any]] = []
+        self.counters: Counter = Counter()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, args: Dict[str, Any]) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": round((start - self.start) * 1e6),
+                "dur": round((end - start) * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def add_span(self, name: str, start: float, duration: float, pid: int, args: Dict) -> None:
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((start - self.wall_start) * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": pid,
+            "tid": pid,
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def count(self, name: str, n: int) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def print_summary(self) -> None:
+        totals: Dict[str, List[float]] = {}
+        for event in self.events:
+            totals.setdefault(event["name"], []).append(event["dur"] / 1e6)
+
+        width = max([len(name) for name in totals] + [len(name) for name in self.counters] + [9])
+        print(f"\n{'Operation':<{width}} {'Calls':>8} {'Total (s)':>10} {'Mean (ms)':>10}")
+        for name, durations in sorted(totals.items(), key=lambda item: -sum(item[1])):
+            total = sum(durations)
+            mean = total / len(durations) * 1000
+            print(f"{name:<{width}} {len(durations):>8} {total:>10.3f} {mean:>10.2f}")
+        if self.counters:
+            print(f"\n{'Counter':<{width}} {'Value':>8}")
+            for name, value in sorted(self.counters.items()):
+                print(f"{name:<{width}} {value:>8}")
+
+    def write_trace(self, path: str) -> None:
+        counters = {
+            "name": "counters",
+            "ph": "C",
+            "ts": round((time.perf_counter() - self.start) * 1e6),
+            "pid": os.getpid(),
+            "args": dict(self.counters),
+        }
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events + [counters], "displayTimeUnit": "ms"}, f)
+        print(f"Wrote trace to {path}")
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def span(name: str, **args: Any) -> ContextManager:
+    """Time the operation run in the with block."""
+    profiler = _profiler
+    return _null_context if profiler is None else profiler.span(name, args)
+
+
+def count(name: str, n: int = 1) -> None:
+    profiler = _profiler
+    if profiler is not None:
+        profiler.count(name, n)
+
+
+class Timed:
+    """Wrap a function run in worker processes, to return its duration with its result.
+
+    Spans recorded in worker processes are lost, so the result of the call is
+    passed to record() in the parent process.
+
+    """
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+
+    def __call__(self, *args: Any) -> TimedResult:
+        start, t0 = time.time(), time.perf_counter()
+        result = self.func(*args)
+        return result, start, time.perf_counter() - t0, os.getpid()
+
+
+def record(name: str, timed: TimedResult, **args: Any) -> Any:
+    """Record the span of a Timed call, and return its result."""
+    result, start, duration, pid = timed
+    profiler = _profiler
+    if profiler is not None:
+        profiler.add_span(name, start, duration, pid, args)
+    return result
@@ -0,0 +1,179 @@
+"""Publish the out_dir to a web server or an object store.
+
+A manifest of the files published by the last run is kept in the out_dir,
+with their content hashes, and only new or changed files are uploaded, while
+files that were removed from the out_dir are deleted from the target (see
+earworm.manifest for how files are hashed). HTML
+files are uploaded after all the other files, so that pages never refer to
+files that are not uploaded yet.
+
+The target is a local directory (or a mounted remote directory), or an S3
+bucket, like s3://bucket/prefix, written using the optional boto3 package.
+publish_endpoint_url can be set to use other S3-compatible object stores.
+
+"""
+
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from urllib import parse
+
+from . import profiling
+from .manifest import file_state, read_manifest, write_manifest
+from .media import publish_file
+from .metadata import Config
+from .utils import HASHED_ASSET_RE, print_errors
+
+MANIFEST_FILE = ".earworm-publish.json"
+
+
+def cache_control(key: str) -> str:
+    # Content-hashed bundles never change, and the other files are revalidated
+    if HASHED_ASSET_RE.match(key.rsplit("/", 1)[-1]):
+        return "public, max-age=31536000, immutable"
+    return "no-cache"
+
+
+class LocalBackend:
+    """Copy files to a directory."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def upload(self, src: str, key: str) -> None:
+        dst = os.path.join(self.path, *key.split("/"))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        publish_file(src, dst)
+
+    def delete(self, key: str) -> None:
+        dst = os.path.join(self.path, *key.split("/"))
+        if os.path.exists(dst):
+            os.unlink(dst)
+
+
+class S3Backend:
+    """Upload files to an S3 (compatible) bucket.
+
+    Credentials are read by boto3 from the environment or its config files.
+
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = "") -> None:
+        try:
+            import boto3  # type: ignore
+        except ImportError:
+            raise RuntimeError("Publishing to S3 needs boto3: pip install earworm[s3]")
+
+        self.bucket = bucket
+        self.prefix = f"{prefix.strip('/')}/" if prefix.strip("/") else ""
+        # boto3 clients are thread-safe, and shared by the upload threads
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def upload(self, src: str, key: str) -> None:
+        extra_args = {
+            "ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream",
+            "CacheControl": cache_control(key),
+        }
+        self.client.upload_file(src, self.bucket, f"{self.prefix}{key}", ExtraArgs=extra_args)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=f"{self.prefix}{key}")
+
+
+Backend = Union[LocalBackend, S3Backend]
+
+
+def get_backend(config: Config) -> Backend:
+    target = config.publish_target
+    url = parse.urlparse(target)
+    if url.scheme == "s3":
+        return S3Backend(url.netloc, url.path, config.publish_endpoint_url)
+    elif url.scheme == "file":
+        return LocalBackend(parse.unquote(url.path))
+    elif url.scheme and len(url.scheme) > 1:
+        raise ValueError(f"publish_target should be a directory or s3:// URL, not {target!r}")
+    return LocalBackend(target)
+
+
+def published_files(out_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yield the paths and keys of the files to publish, skipping hidden files."""
+    for root, dirs, files in os.walk(out_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.startswith(".") and not name.endswith(".tmp"):
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, out_dir).replace(os.sep, "/")
+
+
+def publish_site(config: Config, force: bool = False, dry_run: bool = False) -> None:
+    if not config.publish_target:
+        print("Set publish_target in the config file, to the directory or S3 URL to publish to")
+        return
+
+    manifest_path = os.path.join(config.out_dir, MANIFEST_FILE)
+    state = read_manifest(manifest_path)
+    old_files: Dict[str, Dict] = {}
+    if not force and state.get("target") == config.publish_target:
+        old_files = state["files"]
+
+    files: Dict[str, Dict] = {}
+    paths: Dict[str, str] = {}
+    for path, key in published_files(config.out_dir):
+        files[key] = file_state(path, old_files.get(key))
+        paths[key] = path
+
+    changed = [key for key in files if old_files.get(key, {}).get("hash") != files[key]["hash"]]
+    removed = sorted(set(old_files) - set(files))
+    size = sum(files[key]["size"] for key in changed)
+    print(
+        f"Publishing to {config.publish_target}: {len(changed)} files to upload "
+        f"({size / 2**20:.1f} MiB), {len(removed)} to delete, "
+        f"{len(files) - len(changed)} unchanged"
+    )
+    if dry_run:
+        for key in changed:
+            print(f"  upload {key}")
+        for key in removed:
+            print(f"  delete {key}")
+        return
+
+    backend = get_backend(config)
+    errors: Dict[str, str] = {}
+
+    def transfer(action: str, key: str) -> Optional[str]:
+        try:
+            with profiling.span(action, key=key):
+                if action == "upload":
+                    backend.upload(paths[key], key)
+                else:
+                    backend.delete(key)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        if action == "upload":
+            profiling.count("bytes uploaded", files[key]["size"])
+        return None
+
+    # Pages are uploaded last, after the files they refer to
+    pages = [key for key in changed if key.endswith(".html")]
+    steps: List[List[Tuple[str, str]]] = [
+        [("upload", key) for key in changed if not key.endswith(".html")],
+        [("upload", key) for key in pages],
+        [("delete", key) for key in removed],
+    ]
+    with ThreadPoolExecutor(max(config._jobs, 1)) as pool:
+        for step in steps:
+            for (action, key), error in zip(step, pool.map(lambda job: transfer(*job), step)):
+                if error:
+                    errors[key] = error
+
+    # Failed uploads are retried, and failed deletes are kept, on the next run
+    for key, error in errors.items():
+        if key in old_files:
+            files[key] = old_files[key]
+        else:
+            files.pop(key, None)
+    write_manifest(manifest_path, {"target": config.publish_target, "files": files})
+
+    print(f"Published {len(changed) + len(removed) - len(errors)} changes")
+    print_errors("Could not publish the following files", errors)
@@ -0,0 +1,177 @@
+"""Discover the audio files in a music_dir.
+
+The directory tree is walked lazily using os.scandir, so that metadata can be
+read from files while the walk is still in progress. Only files with a known
+audio extension are yielded, and files without an extension are sniffed for
+the magic bytes of common audio formats.
+
+Files and directories can be ignored by listing glob patterns in an
+.earwormignore file. The patterns apply to the directory containing the file
+and all its sub-directories. Patterns containing a / are matched against the
+path relative to the directory of the ignore file, others against the name of
+the file. A trailing / matches only directories. Lines starting with # are
+comments.
+
+"""
+
+import fnmatch
+import os
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+IGNORE_FILE = ".earwormignore"
+
+Snapshot = Dict[str, Tuple[int, int]]
+
+AUDIO_EXTENSIONS = (
+    ".aac",
+    ".aif",
+    ".aiff",
+    ".amr",
+    ".flac",
+    ".m4a",
+    ".m4b",
+    ".mp3",
+    ".mp4",
+    ".oga",
+    ".ogg",
+    ".opus",
+    ".wav",
+    ".wma",
+)
+
+# (pattern, directory containing the ignore file, only match directories)
+IgnorePattern = Tuple[str, str, bool]
+
+
+def sniff_audio(path: str) -> bool:
+    """Check if the file starts with the magic bytes of an audio format."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+    except OSError:
+        return False
+
+    if head.startswith((b"ID3", b"fLaC", b"OggS", b"#!AMR")):
+        return True
+    elif head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return True
+    elif head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return True
+    elif head[4:8] == b"ftyp":  # MP4 container (m4a, m4b, ...)
+        return True
+    elif head[:4] == b"\x30\x26\xb2\x75":  # ASF header (wma)
+        return True
+    # MPEG audio frame sync, without an ID3 tag
+    return len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+
+
+def read_ignore_file(path: str) -> List[IgnorePattern]:
+    root = os.path.dirname(path)
+    patterns = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            dir_only = line.endswith("/")
+            patterns.append((line.strip("/"), root, dir_only))
+    return patterns
+
+
+def is_ignored(entry: os.DirEntry, patterns: Iterable[IgnorePattern]) -> bool:
+    for pattern, root, dir_only in patterns:
+        if dir_only and not entry.is_dir():
+            continue
+        if "/" in pattern:
+            name = os.path.relpath(entry.path, root).replace(os.sep, "/")
+        else:
+            name = entry.name
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def iter_audio_files(
+    music_dir: str,
+    extensions: Iterable[str] = AUDIO_EXTENSIONS,
+    sniff: bool = True,
+) -> Iterator[os.DirEntry]:
+    """Yield the audio files in music_dir, recursively, sorted by name.
+
+    Nothing is yielded for a missing music_dir, or directories removed during the walk.
+
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    visited: Set[Tuple[int, int]] = set()
+    stack: List[Tuple[str, List[IgnorePattern]]] = [(music_dir, [])]
+    while stack:
+        directory, patterns = stack.pop()
+        try:
+            st = os.stat(directory)
+        except FileNotFoundError:
+            continue
+        if (st.st_dev, st.st_ino) in visited:  # Symlink loops
+            continue
+        visited.add((st.st_dev, st.st_ino))
+
+        ignore_path = os.path.join(directory, IGNORE_FILE)
+        if os.path.isfile(ignore_path):
+            patterns = patterns + read_ignore_file(ignore_path)
+
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith(".") or is_ignored(entry, patterns):
+                continue
+            elif entry.is_dir():
+                subdirs.append((entry.path, patterns))
+            elif not entry.is_file():
+                continue
+            elif _is_audio(entry, extensions, sniff):
+                yield entry
+
+        stack.extend(reversed(subdirs))
+
+
+def _is_audio(entry: os.DirEntry, extensions: Tuple[str, ...], sniff: bool) -> bool:
+    ext = os.path.splitext(entry.name)[1].lower()
+    if ext:
+        return ext in extensions
+    return sniff and sniff_audio(entry.path)
+
+
+def snapshot(paths: List[str], exclude: str = "") -> Snapshot:
+    """Return the modification times and sizes of the files in paths.
+
+    Hidden files (like the metadata cache) other than ignore files, and the
+    exclude directory (the out_dir), are skipped.
+
+    """
+    files = {}
+    stack = [path for path in paths if path]
+    while stack:
+        path = stack.pop()
+        if exclude and os.path.abspath(path) == exclude:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isdir(path):
+            files[path] = (st.st_mtime_ns, st.st_size)
+            continue
+        try:
+            with os.scandir(path) as it:
+                stack.extend(
+                    entry.path
+                    for entry in it
+                    if not entry.name.startswith(".") or entry.name == IGNORE_FILE
+                )
+        except OSError:
+            continue
+    return files
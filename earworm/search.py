@@ -0,0 +1,106 @@
+"""Write a search index of the songs, fetched by the web page when searching.
+
+Searching the song list in the browser means going over every song on each
+keystroke, and needs all the pages of songs to be loaded. Instead, an inverted
+index of the words in the title, artist, album and date of the songs is
+written to the search/ directory. Each word is indexed by its prefixes of one
+and two characters (for short queries), and by its trigrams. The web page
+intersects the lists of songs for the trigrams of a query, and checks the
+candidates against the query, to drop false positives. See js/search.mjs.
+
+The index is split into segments of SEGMENT_SIZE songs, numbered from the
+oldest song, like the pages of songs. Adding new songs only changes the newest
+segment, and the other segments are neither rebuilt, nor downloaded again by
+browsers. Lists of songs are delta-encoded, and the segments compress well
+(see precompress).
+
+"""
+
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, List, Set
+
+from .metadata import Config, Song
+from .pages import dump_json
+from .utils import content_hash, write_if_changed
+
+SEARCH_DIR = "search"
+MANIFEST_FILE = "index.json"
+SEGMENT_SIZE = 2000
+# Fields of the songs that are searched, in the order they are stored
+SEARCH_FIELDS = ("src", "title", "artist", "album", "date")
+WORD_RE = re.compile(r"[^\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Lower case text, without accents, like normalize in js/search.mjs."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokens(text: str) -> Set[str]:
+    result: Set[str] = set()
+    for word in WORD_RE.findall(normalize(text)):
+        result.update(f"^{word[:n]}" for n in (1, 2) if len(word) >= n)
+        result.update(word[i : i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def build_segment(docs: List[List[str]]) -> Dict[str, Any]:
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for i, doc in enumerate(docs):
+        # The src of a song is not searched
+        for token in tokens(" ".join(doc[1:])):
+            postings[token].append(i)
+
+    index = {}
+    for token, ids in sorted(postings.items()):
+        index[token] = [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+    return {"docs": docs, "index": index}
+
+
+def write_search_index(config: Config, songs: List[Song]) -> Dict[str, Any]:
+    """Write the segments of the search index, and return its manifest.
+
+    The manifest lists the URLs of the segments, newest first. Segments whose
+    songs didn't change since the last build are reused as is.
+
+    """
+    search_dir = os.path.join(config.out_dir, SEARCH_DIR)
+    os.makedirs(search_dir, exist_ok=True)
+    manifest_path = os.path.join(search_dir, MANIFEST_FILE)
+    old_segments = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old_segments = {segment["name"]: segment for segment in json.load(f)["segments"]}
+
+    # songs are sorted newest first, but segments are numbered from the oldest
+    oldest_first = [[getattr(song, name) or "" for name in SEARCH_FIELDS] for song in songs][::-1]
+    segments = []
+    built = 0
+    for start in range(0, len(oldest_first), SEGMENT_SIZE):
+        docs = oldest_first[start : start + SEGMENT_SIZE][::-1]
+        name = f"{start // SEGMENT_SIZE + 1:04d}.json"
+        key = content_hash(dump_json(docs))
+        old = old_segments.get(name)
+        if old and old["key"] == key and os.path.exists(os.path.join(search_dir, name)):
+            segments.append(old)
+            continue
+        content = dump_json(build_segment(docs))
+        write_if_changed(os.path.join(search_dir, name), content)
+        url = f"{SEARCH_DIR}/{name}?v={content_hash(content)}"
+        segments.append({"name": name, "key": key, "url": url, "count": len(docs)})
+        built += 1
+
+    names = {segment["name"] for segment in segments}
+    for name in os.listdir(search_dir):
+        if name.endswith(".json") and name != MANIFEST_FILE and name not in names:
+            os.unlink(os.path.join(search_dir, name))
+
+    segments.reverse()
+    write_if_changed(manifest_path, dump_json({"segments": segments}))
+    print(f"Search index: {built} of {len(segments)} segments built")
+    return {"segments": [{"url": s["url"], "count": s["count"]} for s in segments]}
@@ -0,0 +1,181 @@
+"""Serve the site locally, and rebuild it when its sources change.
+
+Sites are rebuilt by generate_site, just like by the build sub-command, whose
+build graph only runs the stages affected by a change: a change to the
+templates or static files only re-renders the index, while a change to the
+music_dir or the metadata CSV also re-reads the metadata (mostly from the
+metadata cache) and republishes the changed media, covers and feed. The
+template environment is kept in memory between builds. Pages opened in a
+browser are reloaded after every rebuild.
+
+"""
+
+import functools
+import os
+import threading
+import time
+import traceback
+from dataclasses import replace
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import jinja2
+
+from .generate import HERE, TEMPLATE_FILE, generate_site, make_environment, read_config
+from .metadata import Config
+from .scan import Snapshot, snapshot
+
+LIVE_RELOAD_PATH = "/__earworm/reload"
+LIVE_RELOAD_SCRIPT = (
+    f"<script>new EventSource({LIVE_RELOAD_PATH!r}).onmessage = () => location.reload();</script>"
+)
+# Stages to rebuild, from the one that rebuilds the most
+STAGES = ("config", "metadata", "template")
+
+
+def watched_paths(config: Config) -> Dict[str, List[str]]:
+    return {
+        "config": [config._config_path],
+        "metadata": [config.metadata_csv or "", config.music_dir or ""],
+        "template": [os.path.join(HERE, TEMPLATE_FILE), os.path.join(HERE, "static")],
+    }
+
+
+def inject_live_reload(html: bytes) -> bytes:
+    script = LIVE_RELOAD_SCRIPT.encode("utf8")
+    index = html.rfind(b"</body>")
+    if index == -1:
+        return html + script
+    return html[:index] + script + html[index:]
+
+
+class Reloader:
+    """Notify the pages waiting for a reload, after each rebuild."""
+
+    def __init__(self) -> None:
+        self.generation = 0
+        self.condition = threading.Condition()
+
+    def notify(self) -> None:
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def wait(self, generation: int, timeout: float) -> int:
+        with self.condition:
+            self.condition.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+
+class Handler(SimpleHTTPRequestHandler):
+    reloader: Reloader
+
+    def do_GET(self) -> None:
+        if self.path == LIVE_RELOAD_PATH:
+            self.send_events()
+            return
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        if not path.endswith(".html") or not os.path.isfile(path):
+            super().do_GET()
+            return
+
+        with open(path, "rb") as f:
+            content = inject_live_reload(f.read())
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_events(self) -> None:
+        generation = self.reloader.generation
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while True:
+                new_generation = self.reloader.wait(generation, timeout=15)
+                # Comments keep the connection alive, and let us notice closed pages
+                message = b": ping\n\n" if new_generation == generation else b"data: reload\n\n"
+                generation = new_generation
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class Site:
+    """The state of the site kept in memory between builds."""
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.env: Optional[jinja2.Environment] = None
+
+    def reload_config(self) -> None:
+        config = read_config(self.config._config_path)
+        # Keep the options passed on the command line
+        self.config = replace(config, _cache_path=self.config._cache_path, _jobs=self.config._jobs)
+
+    def build(self, stage: str) -> None:
+        if stage == "config" or self.env is None:
+            self.env = make_environment(self.config)
+        generate_site(self.config, self.env)
+        self.config._rebuild_cache = False
+
+
+def changed_stage(old: Dict[str, Snapshot], new: Dict[str, Snapshot]) -> Optional[str]:
+    return next((stage for stage in STAGES if old.get(stage) != new.get(stage)), None)
+
+
+def serve(config: Config, bind: str = "127.0.0.1", port: int = 8000, interval: float = 1.0) -> None:
+    site = Site(config)
+    site.build("config")
+
+    def take_snapshots() -> Dict[str, Snapshot]:
+        out_dir = os.path.abspath(site.config.out_dir)
+        paths = watched_paths(site.config)
+        return {stage: snapshot(paths[stage], exclude=out_dir) for stage in STAGES}
+
+    reloader = Reloader()
+    handler = type("Handler", (Handler,), {"reloader": reloader})
+    server = ThreadingHTTPServer(
+        (bind, port), functools.partial(handler, directory=site.config.out_dir)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {site.config.out_dir} at http://{bind}:{port}/ (Ctrl-C to stop)")
+
+    snapshots = take_snapshots()
+    try:
+        while True:
+            time.sleep(interval)
+            new_snapshots = take_snapshots()
+            stage = changed_stage(snapshots, new_snapshots)
+            if stage is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if stage == "config":
+                    site.reload_config()
+                    new_snapshots = take_snapshots()
+                site.build(stage)
+            except Exception:
+                traceback.print_exc()
+            else:
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"Rebuilt the site ({stage} changed) in {elapsed:.0f} ms")
+                reloader.notify()
+            snapshots = new_snapshots
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
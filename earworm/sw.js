@@ -0,0 +1,263 @@
+// Service worker for the site, rendered by earworm/offline.py
+//
+// The page and the static files are precached, and served from the cache
+// when offline. Songs and covers are cached as they are played, and are
+// served from the cache after that, to play them without waiting for the
+// network, and offline. The player also prefetches the start of the next
+// song, which is played while the rest of the song is fetched.
+
+const VERSION = {{ version | tojson }};
+const PRECACHE = {{ precache | tojson }};
+const MEDIA_DIR = {{ media_dir | tojson }};
+const COVERS_DIR = {{ covers_dir | tojson }};
+const SONGS_DIR = {{ songs_dir | tojson }};
+const SEARCH_DIR = {{ search_dir | tojson }};
+
+const PRECACHE_NAME = `earworm-precache-${VERSION}`;
+const AUDIO_CACHE = "earworm-audio";
+const PREFETCH_CACHE = "earworm-prefetch";
+const RUNTIME_CACHE = "earworm-runtime";
+// Number of songs, starts of songs and other files kept in the runtime caches
+const AUDIO_CACHE_SIZE = 50;
+const PREFETCH_CACHE_SIZE = 10;
+const RUNTIME_CACHE_SIZE = 1000;
+// Bytes prefetched from the start of a song, about 30 seconds at 128 kbps
+const PREFETCH_BYTES = 512 * 1024;
+
+const scopeUrl = (path) => new URL(path, self.registration.scope).href;
+// Cache keys include the revision of a file, so unchanged files are reused
+// from the caches of earlier versions, instead of being downloaded again
+const precacheKey = ({ url, revision }) =>
+  revision ? `${scopeUrl(url)}?__revision=${revision}` : scopeUrl(url);
+const precacheKeys = new Map(PRECACHE.map((entry) => [scopeUrl(entry.url), precacheKey(entry)]));
+
+self.addEventListener("install", (event) => {
+  const precache = async () => {
+    const cache = await caches.open(PRECACHE_NAME);
+    for (const entry of PRECACHE) {
+      const key = precacheKey(entry);
+      const cached = await caches.match(key);
+      const response = cached || (await fetch(scopeUrl(entry.url), { cache: "reload" }));
+      if (response.ok) {
+        await cache.put(key, response);
+      }
+    }
+  };
+  event.waitUntil(precache().then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", (event) => {
+  const cleanup = async () => {
+    for (const name of await caches.keys()) {
+      if (name.startsWith("earworm-precache-") && name !== PRECACHE_NAME) {
+        await caches.delete(name);
+      }
+    }
+    await self.clients.claim();
+  };
+  event.waitUntil(cleanup());
+});
+
+const trimCache = async (name, size) => {
+  const cache = await caches.open(name);
+  const keys = await cache.keys();
+  for (const key of keys.slice(0, Math.max(keys.length - size, 0))) {
+    await cache.delete(key);
+  }
+};
+
+// Songs are cached whole, from the response that is played, and range
+// requests are answered from the cache
+const putSong = async (url, response) => {
+  try {
+    const cache = await caches.open(AUDIO_CACHE);
+    await cache.put(url, response);
+    await trimCache(AUDIO_CACHE, AUDIO_CACHE_SIZE);
+    await (await caches.open(PREFETCH_CACHE)).delete(url);
+  } catch (e) {
+    console.error(`Could not cache ${url}`, e);
+  }
+};
+
+const totalSize = (response) =>
+  Number(/\/(\d+)$/.exec(response.headers.get("Content-Range") || "")?.[1]);
+
+// Only the start of a song is prefetched, so that skipped songs are not
+// downloaded whole. Servers may ignore the range, so the body is cut short too.
+const prefetchSong = async (url) => {
+  if (await caches.match(url, { cacheName: AUDIO_CACHE })) {
+    return;
+  }
+  const prefetch = await caches.open(PREFETCH_CACHE);
+  if (await prefetch.match(url)) {
+    return;
+  }
+  const response = await fetch(url, { headers: { Range: `bytes=0-${PREFETCH_BYTES - 1}` } });
+  if (!response.ok) {
+    return;
+  }
+  const reader = response.body.getReader();
+  const chunks = [];
+  let size = 0;
+  let done = false;
+  while (!done && size < PREFETCH_BYTES) {
+    const chunk = await reader.read();
+    done = chunk.done;
+    if (!done) {
+      chunks.push(chunk.value);
+      size += chunk.value.length;
+    }
+  }
+  if (!done) {
+    await reader.cancel();
+  }
+
+  const head = new Response(new Blob(chunks), {
+    headers: { "Content-Type": response.headers.get("Content-Type") || "" },
+  });
+  // Short songs are prefetched whole
+  if (response.status === 200 ? done : size === totalSize(response)) {
+    await putSong(url, head);
+  } else {
+    await prefetch.put(url, head);
+    await trimCache(PREFETCH_CACHE, PREFETCH_CACHE_SIZE);
+  }
+};
+
+const prefetching = new Map();
+const prefetchOnce = (url) => {
+  if (!prefetching.has(url)) {
+    const done = prefetchSong(url)
+      .catch((e) => console.error(`Could not prefetch ${url}`, e))
+      .finally(() => prefetching.delete(url));
+    prefetching.set(url, done);
+  }
+  return prefetching.get(url);
+};
+
+// The whole song, starting with its prefetched start, if any
+const fetchSong = async (url) => {
+  const head = await caches.match(url, { cacheName: PREFETCH_CACHE });
+  if (!head) {
+    return fetch(url);
+  }
+  const start = await head.arrayBuffer();
+  const rest = await fetch(url, { headers: { Range: `bytes=${start.byteLength}-` } });
+  if (rest.status !== 206) {
+    return rest;
+  }
+  const reader = rest.body.getReader();
+  const body = new ReadableStream({
+    start: (controller) => controller.enqueue(new Uint8Array(start)),
+    pull: async (controller) => {
+      const { done, value } = await reader.read();
+      if (done) {
+        controller.close();
+      } else {
+        controller.enqueue(value);
+      }
+    },
+    cancel: (reason) => reader.cancel(reason),
+  });
+  const headers = { "Content-Type": head.headers.get("Content-Type") || "" };
+  if (totalSize(rest)) {
+    headers["Content-Length"] = String(totalSize(rest));
+  }
+  return new Response(body, { headers });
+};
+
+const rangeResponse = async (request, response) => {
+  const range = /^bytes=(\d*)-(\d*)$/.exec(request.headers.get("range") || "");
+  if (!range) {
+    return response;
+  }
+  const blob = await response.blob();
+  const [, first, last] = range;
+  const start = first ? Number(first) : Math.max(blob.size - Number(last), 0);
+  const end = first && last ? Math.min(Number(last) + 1, blob.size) : blob.size;
+  return new Response(blob.slice(start, end), {
+    status: 206,
+    headers: {
+      "Accept-Ranges": "bytes",
+      "Content-Length": String(end - start),
+      "Content-Range": `bytes ${start}-${end - 1}/${blob.size}`,
+      "Content-Type": response.headers.get("Content-Type") || "",
+    },
+  });
+};
+
+const playSong = async (event) => {
+  const url = event.request.url;
+  const cached = await caches.match(url, { cacheName: AUDIO_CACHE });
+  if (cached) {
+    return rangeResponse(event.request, cached);
+  }
+  // Seeking in a song that is not cached yet is left to the network
+  const range = event.request.headers.get("range");
+  if (range && range !== "bytes=0-") {
+    return fetch(event.request);
+  }
+  // Stream the song, and cache it for the next time, without fetching it twice
+  const response = await fetchSong(url);
+  if (response.status === 200) {
+    event.waitUntil(putSong(url, response.clone()));
+  }
+  return response;
+};
+
+const cacheFirst = async (request) => {
+  const cached = await caches.match(request);
+  if (cached) {
+    return cached;
+  }
+  const response = await fetch(request);
+  if (response.ok) {
+    const cache = await caches.open(RUNTIME_CACHE);
+    await cache.put(request, response.clone());
+    await trimCache(RUNTIME_CACHE, RUNTIME_CACHE_SIZE);
+  }
+  return response;
+};
+
+const networkFirst = async (request, key) => {
+  try {
+    return await fetch(request);
+  } catch (e) {
+    const cached = await caches.match(key);
+    if (cached) {
+      return cached;
+    }
+    throw e;
+  }
+};
+
+self.addEventListener("fetch", (event) => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method !== "GET" || url.origin !== self.location.origin) {
+    return;
+  }
+
+  const path = url.href.slice(self.registration.scope.length);
+  // Static files are requested with a version in the query string
+  const precacheUrl = `${url.origin}${url.pathname}`;
+  if (request.mode === "navigate") {
+    event.respondWith(networkFirst(request, precacheKeys.get(scopeUrl("./"))));
+  } else if (path.startsWith(`${MEDIA_DIR}/`)) {
+    event.respondWith(playSong(event));
+  } else if (precacheKeys.has(precacheUrl)) {
+    const key = precacheKeys.get(precacheUrl);
+    event.respondWith(caches.match(key).then((cached) => cached || fetch(request)));
+  } else if ([COVERS_DIR, SONGS_DIR, SEARCH_DIR].some((dir) => path.startsWith(`${dir}/`))) {
+    // Covers, pages of songs and segments of the search index have
+    // content-hashed URLs
+    event.respondWith(cacheFirst(request));
+  }
+});
+
+// The player asks for the start of the next song in the queue to be cached
+self.addEventListener("message", (event) => {
+  if (event.data?.type === "prefetch") {
+    event.waitUntil(prefetchOnce(event.data.url));
+  }
+});
@@ -0,0 +1,174 @@
+"""Transcode the songs to smaller renditions, for streaming.
+
+Renditions are configured by name, as the format followed by the bitrate, like
+opus-64k or aac-128k. Each song is listed with a source for each rendition,
+smallest first, followed by the original file, so that the browser plays the
+smallest format it supports. Songs in formats browsers can't play (like .amr)
+are only listed with their renditions.
+
+Renditions are written to a directory per rendition in the media_dir, named
+after the source file (a.mp3 is transcoded to a.mp3.opus), and are only
+transcoded again when the source file or the settings change, as recorded in a
+manifest (see earworm.manifest). Songs are only listed with the renditions that
+were written, and not with failed ones.
+
+"""
+
+import mimetypes
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple
+
+from . import profiling
+from .manifest import Manifest, print_report, read_manifest, remove_unused
+from .metadata import UNSUPPORTED_FORMATS, Config, Song, drop_unsupported
+
+MANIFEST_FILE = ".earworm-renditions.json"
+RENDITIONS_DIR = "renditions"
+RENDITION_RE = re.compile(r"^(?P<format>[a-z0-9]+)-(?P<bitrate>\d+)k$")
+
+# Encoder, ffmpeg output format, file extension and MIME type for each format
+FORMATS = {
+    "opus": ("libopus", "ogg", "opus", "audio/ogg; codecs=opus"),
+    "aac": ("aac", "ipod", "m4a", "audio/mp4; codecs=mp4a.40.2"),
+    "mp3": ("libmp3lame", "mp3", "mp3", "audio/mpeg"),
+}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    name: str
+    codec: str
+    format: str
+    extension: str
+    mime_type: str
+    bitrate: int
+
+    @classmethod
+    def parse(cls, name: str) -> "Rendition":
+        match = RENDITION_RE.match(name)
+        if not match or match.group("format") not in FORMATS:
+            formats = ", ".join(FORMATS)
+            raise ValueError(f"Invalid rendition {name!r}: use <format>-<bitrate>k, with {formats}")
+        codec, format, extension, mime_type = FORMATS[match.group("format")]
+        return cls(name, codec, format, extension, mime_type, int(match.group("bitrate")))
+
+    def command(self, src: str, dst: str) -> List[str]:
+        return [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-i",
+            src,
+            "-vn",
+            "-c:a",
+            self.codec,
+            "-b:a",
+            f"{self.bitrate}k",
+            "-f",
+            self.format,
+            dst,
+        ]
+
+
+def get_renditions(config: Config) -> List[Rendition]:
+    renditions = [Rendition.parse(name) for name in config.renditions]
+    return sorted(renditions, key=lambda rendition: rendition.bitrate)
+
+
+def rendition_src(config: Config, rendition: Rendition, song: Song) -> str:
+    # The extension of the source is kept, so that a.mp3 and a.wav don't clash
+    name = os.path.basename(song.src)
+    return f"{config.media_dir}/{RENDITIONS_DIR}/{rendition.name}/{name}.{rendition.extension}"
+
+
+def set_sources(config: Config, songs: List[Song]) -> List[Song]:
+    """Return songs with the sources of their renditions, and their original file.
+
+    Only the renditions recorded in the manifest by transcode_media are listed,
+    and songs in unsupported formats without any rendition are dropped.
+
+    """
+    renditions = get_renditions(config)
+    if not renditions or config.music_dir is None:
+        return songs
+
+    manifest = read_manifest(os.path.join(config.out_dir, MANIFEST_FILE))
+    new_songs = []
+    for song in songs:
+        entry = manifest.get(song.src)
+        written = entry["renditions"] if entry and entry["source"] == song.path else {}
+        sources = [
+            {"src": rendition_src(config, rendition, song), "type": rendition.mime_type}
+            for rendition in renditions
+            if rendition.name in written
+        ]
+        if not song.path.endswith(UNSUPPORTED_FORMATS):
+            mime_type = mimetypes.guess_type(song.src)[0] or "audio/mpeg"
+            sources.append({"src": song.src, "type": mime_type})
+        new_songs.append(replace(song, sources=tuple(sources)))
+    return drop_unsupported(new_songs)
+
+
+def transcode_file(rendition: Rendition, src: str, dst: str) -> Optional[str]:
+    """Transcode src to dst, and return an error message if it fails."""
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.tmp")
+    profiling.count("subprocesses")
+    try:
+        with profiling.span("transcode", path=src, rendition=rendition.name):
+            subprocess.run(rendition.command(src, tmp_path), check=True, capture_output=True)
+    except FileNotFoundError:
+        return "ffmpeg is not installed"
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return e.stderr.decode("utf8", errors="replace").strip() or f"ffmpeg exited with {e}"
+    os.replace(tmp_path, dst)
+    return None
+
+
+def transcode_media(config: Config, songs: List[Song]) -> Dict[str, List[str]]:
+    """Transcode the songs, and return the names of the renditions written for each song."""
+    renditions = get_renditions(config)
+    media_dir = os.path.join(config.out_dir, config.media_dir, RENDITIONS_DIR)
+    manifest = Manifest(os.path.join(config.out_dir, MANIFEST_FILE))
+    jobs: List[Tuple[str, Rendition, str, str]] = []
+    for rendition in renditions:
+        os.makedirs(os.path.join(media_dir, rendition.name), exist_ok=True)
+
+    for song in {song.src: song for song in songs}.values():
+        entry, old_entry = manifest.add(song.src, song.path, renditions={})
+        for rendition in renditions:
+            dst = os.path.join(config.out_dir, rendition_src(config, rendition, song))
+            # The settings are part of the name of the rendition
+            done = old_entry and old_entry["renditions"].get(rendition.name) == entry["hash"]
+            if not (done and os.path.exists(dst)):
+                jobs.append((song.src, rendition, song.path, dst))
+            entry["renditions"][rendition.name] = entry["hash"]
+
+    errors = {}
+    with ThreadPoolExecutor(max(config._jobs, 1)) as pool:
+        results = pool.map(lambda job: transcode_file(*job[1:]), jobs)
+        for (key, rendition, src, dst), error in zip(jobs, results):
+            if error:
+                errors[src] = error
+                del manifest.entries[key]["renditions"][rendition.name]
+
+    # Remove renditions no longer used by any song
+    expected = {
+        os.path.join(config.out_dir, rendition_src(config, rendition, song))
+        for song in songs
+        for rendition in renditions
+    }
+    removed = remove_unused(media_dir, expected)
+
+    manifest.save()
+    counts = (len(jobs) - len(errors), len(expected) - len(jobs), removed)
+    print_report(
+        "Renditions", "transcoded", counts, errors, "Could not transcode the following files"
+    )
+    return {key: sorted(entry["renditions"]) for key, entry in manifest.entries.items()}
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import re
+from typing import Any, Mapping, Union
+
+# Content-hashed bundles, and their precompressed copies
+HASHED_ASSET_RE = re.compile(r"^(bundle\.[0-9a-f]+\.(js|css))(\.gz|\.br)?$")
+
+
+def content_hash(data: Union[str, bytes], length: int = 12) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf8")
+    return hashlib.sha1(data).hexdigest()[:length]
+
+
+def write_if_changed(path: str, content: Union[str, bytes]) -> bool:
+    """Write content to path, unless the file already has the same content.
+
+    Leaving unchanged files alone keeps their modification times intact, which
+    keeps them cacheable and avoids re-uploading them. The file is written to a
+    temporary file and renamed, so readers never see a partially written file.
+    Returns True if the file was written.
+
+    """
+    data = content.encode("utf8") if isinstance(content, str) else content
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def print_errors(message: str, errors: Mapping[Any, str]) -> None:
+    """Print a warning in red, with the error of each file."""
+    if errors:
+        print(f"\n\033[91mWARNING: {message}:\n    ", end="")
+        print("\n    ".join(f"{path} ({error})" for path, error in errors.items()))
+        print("\033[00m")
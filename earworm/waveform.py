@@ -0,0 +1,191 @@
+"""Compute waveform peaks of the songs, for the player to draw.
+
+Each song is decoded once by ffmpeg to mono 16-bit PCM at a low sample rate,
+and read from the pipe in fixed size chunks, so that memory use doesn't grow
+with the length of the song, except for 4 bytes per block of samples. The
+minimum and maximum of each block are computed with NumPy, and the blocks are
+then merged into at most PEAKS buckets. Peaks are written as pairs of signed
+bytes (min, max), to a file per song in the waveforms directory of the out_dir.
+
+Peaks are only computed again when the source file changes, as recorded in a
+manifest (see earworm.manifest). Songs are decoded in a pool of processes, since computing the peaks is
+CPU-bound.
+
+"""
+
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import IO, TYPE_CHECKING, List, Optional, Tuple
+
+from . import profiling
+from .manifest import Manifest, print_report, read_manifest, remove_unused
+from .metadata import Config, Song
+
+# NOTE: numpy is an optional dependency, imported when the peaks are computed
+if TYPE_CHECKING:
+    import numpy
+
+MANIFEST_FILE = ".earworm-waveforms.json"
+WAVEFORMS_DIR = "waveforms"
+SAMPLE_RATE = 8000
+# Samples in a block, and blocks in a chunk read from ffmpeg
+BLOCK_SIZE = 800
+CHUNK_BLOCKS = 64
+# Maximum number of (min, max) pairs in a waveform
+PEAKS = 1000
+# Changing the format or the resolution of the peaks recomputes them
+VERSION = f"s8-{SAMPLE_RATE}-{BLOCK_SIZE}-{PEAKS}"
+
+
+def waveform_src(song: Song) -> str:
+    return f"{WAVEFORMS_DIR}/{os.path.basename(song.src)}.peaks"
+
+
+def set_waveforms(config: Config, songs: List[Song]) -> List[Song]:
+    """Return songs with the URLs of their waveforms.
+
+    Only the waveforms recorded in the manifest by create_waveforms are set.
+
+    """
+    if not config.waveforms or config.music_dir is None:
+        return songs
+    manifest = read_manifest(os.path.join(config.out_dir, MANIFEST_FILE))
+    return [
+        (
+            replace(song, waveform=waveform_src(song))
+            if manifest.get(song.src, {}).get("source") == song.path
+            else song
+        )
+        for song in songs
+    ]
+
+
+def decode_command(src: str) -> List[str]:
+    return [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-i",
+        src,
+        "-vn",
+        "-ac",
+        "1",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-f",
+        "s16le",
+        "-",
+    ]
+
+
+def block_peaks(stream: IO[bytes]) -> Tuple["numpy.ndarray", "numpy.ndarray"]:
+    """Return the minimum and maximum sample of each block of a PCM stream."""
+    import numpy as np
+
+    block_bytes = BLOCK_SIZE * 2
+    mins: List[np.ndarray] = []
+    maxs: List[np.ndarray] = []
+    rest = b""
+    while True:
+        chunk = stream.read(block_bytes * CHUNK_BLOCKS)
+        if not chunk:
+            break
+        # Reads from a pipe may end in the middle of a block, or a sample
+        data = rest + chunk if rest else chunk
+        end = len(data) - len(data) % block_bytes
+        blocks = np.frombuffer(data, dtype="<i2", count=end // 2).reshape(-1, BLOCK_SIZE)
+        mins.append(blocks.min(axis=1))
+        maxs.append(blocks.max(axis=1))
+        rest = data[end:]
+
+    if len(rest) >= 2:
+        samples = np.frombuffer(rest, dtype="<i2", count=len(rest) // 2)
+        mins.append(samples.min(keepdims=True))
+        maxs.append(samples.max(keepdims=True))
+    if not mins:
+        return np.zeros(0, dtype="<i2"), np.zeros(0, dtype="<i2")
+    return np.concatenate(mins), np.concatenate(maxs)
+
+
+def merge_peaks(mins: "numpy.ndarray", maxs: "numpy.ndarray", n: int = PEAKS) -> bytes:
+    """Merge the peaks of blocks into at most n pairs of signed bytes."""
+    import numpy as np
+
+    if len(mins) > n:
+        starts = np.linspace(0, len(mins), n, endpoint=False).astype(np.intp)
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+    peaks = np.empty(len(mins) * 2, dtype=np.int8)
+    peaks[0::2] = mins >> 8
+    peaks[1::2] = maxs >> 8
+    return peaks.tobytes()
+
+
+def compute_peaks(src: str, dst: str) -> Optional[str]:
+    """Write the waveform peaks of src to dst, and return an error message if it fails."""
+    try:
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(decode_command(src), stdout=subprocess.PIPE, stderr=stderr)
+            assert process.stdout is not None
+            with process.stdout:
+                mins, maxs = block_peaks(process.stdout)
+            if process.wait() != 0:
+                stderr.seek(0)
+                error = stderr.read().decode("utf8", errors="replace").strip()
+                return error or f"ffmpeg exited with status {process.returncode}"
+    except FileNotFoundError:
+        return "ffmpeg is not installed"
+
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(merge_peaks(mins, maxs))
+    os.replace(tmp_path, dst)
+    return None
+
+
+def create_waveforms(config: Config, songs: List[Song]) -> List[str]:
+    """Compute the waveforms of new or changed songs, and return the srcs of those written."""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Waveforms need numpy: pip install earworm[waveform]")
+
+    waveforms_dir = os.path.join(config.out_dir, WAVEFORMS_DIR)
+    os.makedirs(waveforms_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(config.out_dir, MANIFEST_FILE))
+    jobs: List[Tuple[str, str, str]] = []
+
+    for song in {song.src: song for song in songs}.values():
+        entry, old_entry = manifest.add(song.src, song.path, version=VERSION)
+        dst = os.path.join(config.out_dir, waveform_src(song))
+        done = old_entry and (old_entry["hash"], old_entry["version"]) == (entry["hash"], VERSION)
+        if not (done and os.path.exists(dst)):
+            jobs.append((song.src, song.path, dst))
+
+    errors = {}
+    profiling.count("subprocesses", len(jobs))
+    with profiling.span("waveforms", songs=len(jobs)):
+        if config._jobs > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(config._jobs) as pool:
+                sources, outputs = [job[1] for job in jobs], [job[2] for job in jobs]
+                results = list(pool.map(compute_peaks, sources, outputs))
+        else:
+            results = [compute_peaks(src, dst) for _, src, dst in jobs]
+    for (key, src, _), error in zip(jobs, results):
+        if error:
+            errors[src] = error
+            del manifest.entries[key]
+
+    # Remove waveforms no longer used by any song
+    removed = remove_unused(
+        waveforms_dir, {os.path.join(config.out_dir, waveform_src(song)) for song in songs}
+    )
+
+    manifest.save()
+    counts = (len(jobs) - len(errors), len(manifest.entries) - len(jobs) + len(errors), removed)
+    failure = "Could not compute the waveforms of these files"
+    print_report("Waveforms", "computed", counts, errors, failure)
+    return sorted(manifest.entries)
@@ -8,7 +8,19 @@ export const AppStore = new Store({
   queue: [],
 });
 
-export const findSongIndex = (songList, src) => songList.findIndex((it) => it.src === src);
+// Index of songs by their src, for each song list (queue, library) that we
+// look up songs in. Lists are never modified in place, so an index can be
+// reused for as long as the list is around.
+const songIndexes = new WeakMap();
+
+export const findSongIndex = (songList, src) => {
+  let index = songIndexes.get(songList);
+  if (!index) {
+    index = new Map(songList.map((it, idx) => [it.src, idx]));
+    songIndexes.set(songList, index);
+  }
+  return index.get(src) ?? -1;
+};
 
 export const setCurrentSong = (song) =>
   AppStore.update((s) => {
@@ -0,0 +1,17 @@
+import React from "react";
+
+// Covers are displayed at 2em, and the browser picks the smallest size that
+// fits from the srcsets. Covers of rows off screen are loaded lazily.
+const CoverArt = ({ song, className, lazy = true }) => (
+  <picture className={className}>
+    {song.image &&
+      (song.image_sources || []).map(({ type, srcset }) => (
+        <source key={type} type={type} srcSet={srcset} sizes="2em" />
+      ))}
+    {song.image && (
+      <img src={song.image} alt="" loading={lazy ? "lazy" : "eager"} decoding="async" />
+    )}
+  </picture>
+);
+
+export default CoverArt;
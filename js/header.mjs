@@ -2,11 +2,10 @@ import React from "react";
 
 import RssFeedIcon from "@material-ui/icons/RssFeed";
 
-import { AppStore } from "./app-store.mjs";
-
-const Header = ({ title, description }) => {
-  const queue = AppStore.useState((s) => s.queue);
-  const totalMinutes = Math.floor(queue.reduce((acc, it) => acc + it.duration, 0) / 60);
+const Header = ({ title, description, total, totalDuration }) => {
+  // Totals are computed when building the site, since the songs may not all
+  // be loaded yet, and to avoid going over the whole library on each render
+  const totalMinutes = Math.floor(totalDuration / 60);
   const hours = Math.floor(totalMinutes / 60);
   const minutes = totalMinutes % 60;
   const duration = hours > 0 ? `${hours} hours, ${minutes} minutes` : `${minutes} minutes`;
@@ -19,7 +18,7 @@ const Header = ({ title, description }) => {
         </a>
       )}
       <p dangerouslySetInnerHTML={{ __html: description }} />
-      <span>{queue.length} songs</span>
+      <span>{total} songs</span>
       <span> · </span>
       <span>{duration}</span>
     </header>
@@ -4,6 +4,7 @@ import { render } from "react-dom";
 import Header from "./header.mjs";
 import Playlist from "./playlist.mjs";
 import Player from "./player.mjs";
+import Search from "./search.mjs";
 import {
   AppStore,
   findSongIndex,
@@ -22,30 +23,71 @@ const showSong = (element) => {
   }
 };
 
-const App = ({ library }) => {
+// Fetch pages of songs that are not inlined in the page. See earworm/pages.py
+const usePagedLibrary = (initialSongs, pages) => {
+  const [library, setLibrary] = useState(initialSongs);
+  const [nextPage, setNextPage] = useState(0);
+  const [loading, setLoading] = useState(false);
+  const hasMore = nextPage < pages.pages.length;
+
+  const loadMore = useCallback(() => {
+    if (!hasMore || loading) {
+      return;
+    }
+    setLoading(true);
+    fetch(pages.pages[nextPage].url)
+      .then((response) => response.json())
+      .then((songs) => {
+        setLibrary((library) => [...library, ...songs]);
+        setNextPage(nextPage + 1);
+      })
+      .catch((e) => console.error(e))
+      .finally(() => setLoading(false));
+  }, [hasMore, loading, nextPage]);
+
+  return { library, hasMore, loadMore };
+};
+
+const App = ({ initialSongs, pages }) => {
+  const { library, hasMore, loadMore } = usePagedLibrary(initialSongs, pages);
+
   // Setup Queue
   useEffect(() => {
     setQueue(library);
   }, []);
 
-  // Update state if valid hash in URL
+  // Update state if valid hash in URL. The song may be on a page that hasn't
+  // been loaded yet, so we keep loading pages until we find it.
   const hash = decodeURI(location.hash.substring(1));
-  const songIndex = findSongIndex(library, hash);
+  const [findingHash, setFindingHash] = useState(true);
   useEffect(() => {
+    if (!findingHash) {
+      return;
+    }
+    const songIndex = hash === "" ? -1 : findSongIndex(library, hash);
     if (songIndex > -1) {
       const song = library[songIndex];
       setCurrentSong(song);
       setPlaying(true);
       setRepeatIndex(0);
+      setFindingHash(false);
+    } else if (hash !== "" && hasMore) {
+      loadMore();
     } else {
       setCurrentSong(library[0]);
+      setFindingHash(false);
     }
-  }, []);
+  }, [library, findingHash]);
 
   // Set page props based on current song
   const currentSong = AppStore.useState((s) => s.currentSong);
   const songElement = useRef();
-  const jumpToSong = () => songElement.current && showSong(songElement.current);
+  const scrollToSong = useRef();
+  // The row of the current song may not be rendered, if it is not in view
+  const jumpToSong = () =>
+    songElement.current
+      ? showSong(songElement.current)
+      : scrollToSong.current && currentSong && scrollToSong.current(currentSong.src);
   useEffect(() => {
     if (!currentSong) {
       return;
@@ -59,12 +101,44 @@ const App = ({ library }) => {
     document.title = `${currentSong.title} — ${currentSong.artist} — ${pageTitle}`;
   }, [currentSong?.src]);
 
+  // Play a song found by searching, loading pages of songs until we find it
+  const [searchedSrc, setSearchedSrc] = useState(null);
+  useEffect(() => {
+    if (searchedSrc === null) {
+      return;
+    }
+    const songIndex = findSongIndex(library, searchedSrc);
+    if (songIndex > -1) {
+      setCurrentSong(library[songIndex]);
+      setPlaying(true);
+      setSearchedSrc(null);
+      scrollToSong.current && scrollToSong.current(searchedSrc);
+    } else if (hasMore) {
+      loadMore();
+    } else {
+      setSearchedSrc(null);
+    }
+  }, [library, searchedSrc]);
+
   return (
     <div>
       <Player jumpToSong={jumpToSong} />
       <div id="container">
-        <Header description={pageDescription} title={pageTitle} />
-        <Playlist library={library} songElement={songElement} />
+        <Header
+          description={pageDescription}
+          title={pageTitle}
+          total={pages.total}
+          totalDuration={pages.duration}
+        />
+        {searchIndex && <Search playSong={setSearchedSrc} />}
+        <Playlist
+          library={library}
+          total={pages.total}
+          songElement={songElement}
+          scrollToSong={scrollToSong}
+          hasMore={hasMore}
+          loadMore={loadMore}
+        />
         <small>
           This page was generated using{" "}
           <a href="https://pypi.org/project/earworm/" rel="noopener noreferrer" target="_blank">
@@ -76,4 +150,4 @@ const App = ({ library }) => {
   );
 };
 
-render(<App library={songs} />, document.querySelector("#app"));
+render(<App initialSongs={songs} pages={songPages} />, document.querySelector("#app"));
@@ -0,0 +1,30 @@
+// Prefetch songs into the cache of the service worker (earworm/sw.js), so
+// that they play right away, and offline.
+
+const audio = document.createElement("audio");
+
+// The source the browser will play: the first one of a type it supports
+export const playableSource = (song) => {
+  const sources = song.sources || [{ src: song.src, type: "audio/mp3" }];
+  return (sources.find(({ type }) => audio.canPlayType(type)) || sources[0]).src;
+};
+
+const prefetched = new Set();
+
+export const prefetchSong = (song) => {
+  const src = playableSource(song);
+  if (prefetched.has(src) || navigator.connection?.saveData) {
+    return;
+  }
+  prefetched.add(src);
+  const worker = navigator.serviceWorker?.controller;
+  if (worker) {
+    worker.postMessage({ type: "prefetch", url: new URL(src, location.href).href });
+  } else {
+    // Without a service worker, let the browser fetch it into its HTTP cache
+    const link = document.createElement("link");
+    link.rel = "prefetch";
+    link.href = src;
+    document.head.appendChild(link);
+  }
+};
@@ -8,6 +8,9 @@ import RepeatOneIcon from "@material-ui/icons/RepeatOne";
 import ShuffleIcon from "@material-ui/icons/Shuffle";
 import Plyr from "plyr";
 import { Popover } from "./popover.mjs";
+import CoverArt from "./cover-art.mjs";
+import { prefetchSong } from "./offline.mjs";
+import Waveform from "./waveform.mjs";
 
 import {
   AppStore,
@@ -80,11 +83,12 @@ const Player = ({ jumpToSong }) => {
 
   const currentSong = AppStore.useState((s) => s.currentSong);
   useEffect(() => {
-    // Set Player Source
+    // Set Player Source. Renditions are listed smallest first, and the
+    // browser plays the first one it supports.
     const source = {
       title: currentSong?.title,
       type: "audio",
-      sources: [{ src: currentSong?.src, type: "audio/mp3" }],
+      sources: currentSong?.sources || [{ src: currentSong?.src, type: "audio/mp3" }],
     };
     const player = plyrRef.current;
     player.source = source;
@@ -113,6 +117,15 @@ const Player = ({ jumpToSong }) => {
     setPlaying(true);
   };
 
+  // Prefetch the next song in the queue while the current one plays
+  useEffect(() => {
+    if (!playing || !currentSong || queue.length < 2) {
+      return;
+    }
+    const songIndex = findSongIndex(queue, currentSong.src);
+    prefetchSong(queue[(songIndex + 1) % queue.length]);
+  }, [currentSong?.src, playing, queue]);
+
   useEffect(() => {
     const player = plyrRef.current;
     player.on("play", setPlayingState);
@@ -143,12 +156,7 @@ const Player = ({ jumpToSong }) => {
         {currentSong && (
           <div className="plyr--audio ">
             <div className="player-controls plyr__controls">
-              <span
-                className="currentSong-cover"
-                style={{
-                  backgroundImage: `url(${currentSong.image})`,
-                }}
-              ></span>
+              <CoverArt song={currentSong} className="currentSong-cover" lazy={false} />
               <span className="currentSong-description">
                 <span className="title" onClick={jumpToSong}>
                   {currentSong.title}
@@ -198,6 +206,7 @@ const Player = ({ jumpToSong }) => {
           </div>
         </div>
       </div>
+      <Waveform song={currentSong} player={plyrRef.current} />
       <Popover open={playError} text="Auto play blocked!" />
       <audio ref={plyrRef} id="player" style={hideStyle}></audio>
     </div>
@@ -1,29 +1,115 @@
-import React, { useEffect } from "react";
+import React, { useEffect, useRef, useState } from "react";
 
-import { AppStore, setQueue } from "./app-store.mjs";
+import { AppStore, findSongIndex, setQueue } from "./app-store.mjs";
 import Song from "./song.mjs";
 
-const Playlist = ({ library, songElement }) => {
+// Number of rows rendered above and below the visible rows
+const OVERSCAN = 10;
+// Height of a row (including the margin between rows) until we measure it
+const DEFAULT_ROW_HEIGHT = 80;
+
+export const shuffled = (songs) => {
+  // Fisher-Yates shuffle
+  const q = [...songs];
+  for (let i = q.length - 1; i > 0; i--) {
+    const j = Math.floor(Math.random() * (i + 1));
+    [q[i], q[j]] = [q[j], q[i]];
+  }
+  return q;
+};
+
+// Range of rows of the list that are (nearly) visible in the window
+const useVisibleRange = (listRef, count, rowHeight) => {
+  const [range, setRange] = useState([0, Math.min(count, 2 * OVERSCAN)]);
+  useEffect(() => {
+    let frame = null;
+    const update = () => {
+      frame = null;
+      const list = listRef.current;
+      if (!list) {
+        return;
+      }
+      const top = list.getBoundingClientRect().top;
+      const start = Math.max(0, Math.floor(-top / rowHeight) - OVERSCAN);
+      const end = Math.min(count, Math.ceil((window.innerHeight - top) / rowHeight) + OVERSCAN);
+      setRange((prev) => (prev[0] === start && prev[1] === end ? prev : [start, end]));
+    };
+    const onScroll = () => {
+      if (frame === null) {
+        frame = requestAnimationFrame(update);
+      }
+    };
+    update();
+    window.addEventListener("scroll", onScroll, { passive: true });
+    window.addEventListener("resize", onScroll);
+    return () => {
+      window.removeEventListener("scroll", onScroll);
+      window.removeEventListener("resize", onScroll);
+      frame !== null && cancelAnimationFrame(frame);
+    };
+  }, [count, rowHeight]);
+  return range;
+};
+
+const measureRowHeight = (list) => {
+  const rows = list.querySelectorAll(".song");
+  if (rows.length < 2) {
+    return null;
+  }
+  return rows[1].offsetTop - rows[0].offsetTop;
+};
+
+// Only the rows of the playlist near the visible part of the window are
+// rendered, with spacers standing in for the rest. The list is as tall as the
+// whole library, including songs on pages that have not been loaded yet.
+const Playlist = ({ library, total, songElement, scrollToSong, hasMore, loadMore }) => {
   // Shuffle state
   const shuffle = AppStore.useState((s) => s.shuffle);
   useEffect(() => {
     // NOTE: Simple implementation of shuffle, assuming the queue contains
     // the full library. This needs to change when we have a way to
     // add/remove from the queue and to see actual queue.
-    const q = [...library];
-    if (shuffle) {
-      for (let i = 0; i < 12; i++) {
-        q.sort(() => Math.random() - 0.5);
-      }
+    setQueue(shuffle ? shuffled(library) : library);
+  }, [shuffle, library]);
+
+  const listRef = useRef();
+  const [rowHeight, setRowHeight] = useState(DEFAULT_ROW_HEIGHT);
+  const count = Math.max(total, library.length);
+  const [start, end] = useVisibleRange(listRef, count, rowHeight);
+
+  useEffect(() => {
+    const height = listRef.current && measureRowHeight(listRef.current);
+    if (height && height !== rowHeight) {
+      setRowHeight(height);
+    }
+  });
+
+  // Load more songs when scrolled to the songs that haven't been loaded yet
+  useEffect(() => {
+    if (end > library.length && hasMore) {
+      loadMore();
+    }
+  }, [end, library.length, hasMore, loadMore]);
+
+  // Scroll to a song, even if its row is not currently rendered
+  scrollToSong.current = (src) => {
+    const index = findSongIndex(library, src);
+    if (index > -1 && listRef.current) {
+      const top = listRef.current.getBoundingClientRect().top + window.scrollY;
+      window.scrollTo({ top: top + index * rowHeight, behavior: "smooth" });
     }
-    setQueue(q);
-  }, [shuffle]);
+  };
 
+  const loadedEnd = Math.min(end, library.length);
+  const before = start * rowHeight;
+  const after = (count - Math.max(loadedEnd, start)) * rowHeight;
   return (
-    <ul className="songlist">
-      {library.map((s) => (
-        <Song song={s} songElement={songElement} />
+    <ul className="songlist" ref={listRef}>
+      <li style={{ height: `${before}px` }}></li>
+      {library.slice(start, loadedEnd).map((s) => (
+        <Song song={s} songElement={songElement} key={s.src} />
       ))}
+      <li style={{ height: `${after}px` }}></li>
     </ul>
   );
 };
@@ -0,0 +1,188 @@
+import React, { useMemo, useState } from "react";
+
+// Search the songs using the index written by earworm/search.py. The
+// segments of the index are fetched when the search box is first focused.
+// Queries are split into words, and each word must match a word of the
+// title, artist, album or date of a song: at its start for words of one or
+// two characters, and anywhere in it for longer words.
+
+const MAX_RESULTS = 50;
+
+// Lower case text, without accents, like normalize in earworm/search.py
+const normalize = (text) => text.normalize("NFKD").replace(/\p{M}/gu, "").toLowerCase();
+const words = (text) => normalize(text).match(/[\p{L}\p{N}]+/gu) || [];
+
+const termTokens = (term) => {
+  if (term.length < 3) {
+    return [`^${term}`];
+  }
+  const tokens = [];
+  for (let i = 0; i + 3 <= term.length; i++) {
+    tokens.push(term.slice(i, i + 3));
+  }
+  return tokens;
+};
+
+// Intersection of sorted lists of ids
+const intersect = (a, b) => {
+  const result = [];
+  for (let i = 0, j = 0; i < a.length && j < b.length; ) {
+    if (a[i] < b[j]) {
+      i++;
+    } else if (a[i] > b[j]) {
+      j++;
+    } else {
+      result.push(a[i]);
+      i++;
+      j++;
+    }
+  }
+  return result;
+};
+
+class Segment {
+  constructor({ docs, index }) {
+    this.docs = docs;
+    this.index = index;
+    // Lists of songs are decoded, and texts are normalized, when first used
+    this.postings = new Map();
+    this.texts = new Map();
+  }
+
+  postingList(token) {
+    let ids = this.postings.get(token);
+    if (!ids) {
+      const deltas = this.index[token] || [];
+      ids = new Int32Array(deltas.length);
+      let id = 0;
+      deltas.forEach((delta, i) => {
+        id += delta;
+        ids[i] = id;
+      });
+      this.postings.set(token, ids);
+    }
+    return ids;
+  }
+
+  text(id) {
+    if (!this.texts.has(id)) {
+      this.texts.set(id, ` ${words(this.docs[id].slice(1).join(" ")).join(" ")}`);
+    }
+    return this.texts.get(id);
+  }
+
+  search(terms, limit) {
+    const lists = terms.flatMap(termTokens).map((token) => this.postingList(token));
+    lists.sort((a, b) => a.length - b.length);
+    let ids = lists[0];
+    for (const list of lists.slice(1)) {
+      if (ids.length === 0) {
+        break;
+      }
+      ids = intersect(ids, list);
+    }
+
+    // Trigrams of a word may be spread over the words of a song
+    const results = [];
+    for (const id of ids) {
+      const text = this.text(id);
+      if (terms.every((term) => term.length < 3 || text.includes(term))) {
+        const [src, title, artist, album, date] = this.docs[id];
+        results.push({ src, title, artist, album, date });
+        if (results.length >= limit) {
+          break;
+        }
+      }
+    }
+    return results;
+  }
+}
+
+let segments = null;
+const loadSegments = () => {
+  if (!segments) {
+    segments = Promise.all(
+      searchIndex.segments.map(({ url }) =>
+        fetch(url)
+          .then((response) => response.json())
+          .then((data) => new Segment(data))
+      )
+    ).catch((e) => {
+      segments = null;
+      throw e;
+    });
+  }
+  return segments;
+};
+
+// Segments are newest first, like the songs in them
+const searchSegments = (segments, terms) => {
+  const results = [];
+  for (const segment of segments) {
+    results.push(...segment.search(terms, MAX_RESULTS - results.length));
+    if (results.length >= MAX_RESULTS) {
+      break;
+    }
+  }
+  return results;
+};
+
+const escapeRegExp = (text) => text.replace(/[.*+?^${}()|[\]\\]/g, "\\$&");
+
+const Highlight = ({ text, pattern }) =>
+  text
+    .split(pattern)
+    .map((part, i) => (i % 2 ? <mark key={i}>{part}</mark> : <span key={i}>{part}</span>));
+
+const Search = ({ playSong }) => {
+  const [query, setQuery] = useState("");
+  const [loaded, setLoaded] = useState(null);
+  const load = () =>
+    loadSegments()
+      .then(setLoaded)
+      .catch((e) => console.error(e));
+
+  const terms = useMemo(() => [...new Set(words(query))], [query]);
+  const results = useMemo(
+    () => (loaded && terms.length > 0 ? searchSegments(loaded, terms) : []),
+    [loaded, terms]
+  );
+  const pattern = new RegExp(`(${terms.map(escapeRegExp).join("|")})`, "giu");
+
+  const choose = (src) => {
+    setQuery("");
+    playSong(src);
+  };
+  return (
+    <div className="search">
+      <input
+        type="search"
+        placeholder="Search songs"
+        aria-label="Search songs"
+        value={query}
+        onFocus={load}
+        onChange={(e) => setQuery(e.target.value)}
+      />
+      {terms.length > 0 && loaded && (
+        <ul className="search-results">
+          {results.length === 0 && <li>No songs found</li>}
+          {results.map((song) => (
+            <li key={song.src} onClick={() => choose(song.src)}>
+              <span className="song-title">
+                <Highlight text={song.title} pattern={pattern} />
+              </span>
+              <small>
+                <Highlight
+                  text={[song.artist, song.album, song.date].filter(Boolean).join(" · ")}
+                  pattern={pattern}
+                />
+              </small>
+            </li>
+          ))}
+        </ul>
+      )}
+    </div>
+  );
+};
+
+export default Search;
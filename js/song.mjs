@@ -12,6 +12,7 @@ import MoreVertIcon from "@material-ui/icons/MoreVert";
 import FileCopyIcon from "@material-ui/icons/FileCopy";
 
 import { AppStore } from "./app-store.mjs";
+import CoverArt from "./cover-art.mjs";
 import { Popover } from "./popover.mjs";
 
 // From https://stackoverflow.com/a/41015840
@@ -130,7 +131,7 @@ const Song = ({ song, songElement }) => {
           {playIcon}
         </button>
       </span>
-      <span className="song-cover-art" style={{ backgroundImage: `url(${song.image})` }}></span>
+      <CoverArt song={song} className="song-cover-art" />
       <span className="song-description">
         <span className="song-title"> {song.title} </span>
         <small className="song-album" dangerouslySetInnerHTML={{ __html: description }} />
@@ -0,0 +1,92 @@
+import React, { useEffect, useRef, useState } from "react";
+
+// Waveforms are pairs of signed bytes (min, max), written by
+// earworm/waveform.py. The played part of the song is drawn in the main color
+// of the player, and clicking on the waveform seeks to that position.
+
+const fetchPeaks = async (url) => {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`Could not fetch ${url}: ${response.status}`);
+  }
+  return new Int8Array(await response.arrayBuffer());
+};
+
+const drawPeaks = (canvas, peaks, progress) => {
+  const ratio = window.devicePixelRatio || 1;
+  const width = Math.round(canvas.clientWidth * ratio);
+  const height = Math.round(canvas.clientHeight * ratio);
+  if (canvas.width !== width || canvas.height !== height) {
+    canvas.width = width;
+    canvas.height = height;
+  }
+  const context = canvas.getContext("2d");
+  context.clearRect(0, 0, width, height);
+  const n = peaks.length / 2;
+  if (!n || !width) {
+    return;
+  }
+
+  const style = getComputedStyle(canvas);
+  const played = style.getPropertyValue("--plyr-color-main").trim() || "#00b3ff";
+  const middle = height / 2;
+  const scale = middle / 128;
+  const barWidth = width / n;
+  for (let i = 0; i < n; i++) {
+    const min = peaks[2 * i];
+    const max = peaks[2 * i + 1];
+    const top = middle - max * scale;
+    context.fillStyle = i / n < progress ? played : "#bbb";
+    context.fillRect(i * barWidth, top, Math.max(barWidth, 1), Math.max((max - min) * scale, 1));
+  }
+};
+
+const Waveform = ({ song, player }) => {
+  const canvasRef = useRef(null);
+  const [peaks, setPeaks] = useState(null);
+
+  useEffect(() => {
+    setPeaks(null);
+    if (!song?.waveform) {
+      return;
+    }
+    let current = true;
+    fetchPeaks(song.waveform)
+      .then((data) => current && setPeaks(data))
+      .catch((e) => console.error(e));
+    return () => {
+      current = false;
+    };
+  }, [song?.waveform]);
+
+  useEffect(() => {
+    const canvas = canvasRef.current;
+    if (!canvas || !peaks || !player) {
+      return;
+    }
+    const draw = () => {
+      const progress = player.duration ? player.currentTime / player.duration : 0;
+      drawPeaks(canvas, peaks, progress);
+    };
+    draw();
+    player.on("timeupdate", draw);
+    window.addEventListener("resize", draw);
+    return () => {
+      player.off("timeupdate", draw);
+      window.removeEventListener("resize", draw);
+    };
+  }, [peaks, player]);
+
+  if (!peaks) {
+    return null;
+  }
+  const seek = (e) => {
+    const rect = e.currentTarget.getBoundingClientRect();
+    if (player?.duration) {
+      player.currentTime = ((e.clientX - rect.left) / rect.width) * player.duration;
+    }
+  };
+  return <canvas ref={canvasRef} className="waveform" title="Seek" onClick={seek} />;
+};
+
+export default Waveform;
@@ -0,0 +1,41 @@
+import os
+
+from earworm.metadata import Song
+
+
+def make_song(path, **fields):
+    """Return a song for the file at path, with empty metadata unless given."""
+    name = os.path.basename(path)
+    values = dict(
+        path=path,
+        filename=name,
+        src=f"music/{name}",
+        title=name,
+        artist=None,
+        album=None,
+        date="",
+        duration=0,
+        image=None,
+        metadata_link=None,
+        filesize="0",
+        cover="",
+        cover_sources=(),
+        sources=(),
+        waveform="",
+    )
+    values.update(fields)
+    return Song(**values)
+
+
+def make_songs(music_dir, names):
+    return [make_song(str(music_dir.join(name))) for name in names]
+
+
+def numbered_songs(n, **fields):
+    """Return songs 1 to n, newest first, one per day."""
+    return [
+        make_song(
+            f"/music/{i}.mp3", title=f"Song {i}", date=f"2021-01-{i:02d}", duration=60, **fields
+        )
+        for i in range(n, 0, -1)
+    ]
@@ -0,0 +1,71 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+from earworm import add_audio
+from earworm.add_audio import add_audio_files, read_metadata_sheet
+from earworm.metadata import Config
+
+
+def fake_ffmpeg(commands):
+    def run(command, **kwargs):
+        commands.append(command)
+        if "broken" in command[5]:
+            raise subprocess.CalledProcessError(1, command, stderr=b"Invalid data")
+        shutil.copy(command[5], command[-1])
+
+    return run
+
+
+def test_read_metadata_sheet(tmpdir):
+    csv_sheet = tmpdir.join("sheet.csv")
+    csv_sheet.write("Filename,Title,Album,Cover_Image\nrec/a.mp3,A,Live,covers/a.jpg\nb.mp3,B,,\n")
+    sheet = read_metadata_sheet(Path(str(csv_sheet)))
+    assert sheet["a.mp3"] == {
+        "title": "A",
+        "album": "Live",
+        "cover_image": str(tmpdir.join("covers", "a.jpg")),
+    }
+    assert sheet["b.mp3"]["title"] == "B"
+
+    yaml_sheet = tmpdir.join("sheet.yml")
+    yaml_sheet.write("a.mp3:\n  title: A\n  artist: Me\nb.mp3:\n")
+    assert read_metadata_sheet(Path(str(yaml_sheet))) == {
+        "a.mp3": {"title": "A", "artist": "Me"},
+        "b.mp3": {},
+    }
+
+
+def test_add_audio_files(tmpdir, capsys, monkeypatch):
+    music_dir = tmpdir.mkdir("music")
+    recordings = tmpdir.mkdir("recordings")
+    paths = []
+    for name in ("a_2021_01_01.mp3", "b.mp3", "broken.mp3"):
+        recordings.join(name).write(name)
+        paths.append(Path(str(recordings.join(name))))
+    sheet = tmpdir.join("sheet.csv")
+    sheet.write("filename,title,album\na_2021_01_01.mp3,A,\nb.mp3,B,Demos\n")
+    config = Config(music_dir=str(music_dir), _jobs=2)
+
+    commands: list = []
+    scans: list = []
+    monkeypatch.setattr(subprocess, "run", fake_ffmpeg(commands))
+    monkeypatch.setattr(add_audio, "get_metadata", lambda config: scans.append(config) or [])
+    add_audio_files(config, paths, metadata_sheet=Path(str(sheet)), tags={"album": "Live"})
+
+    output = capsys.readouterr().out
+    assert "broken.mp3 (Invalid data)" in output
+    names = sorted(path.basename for path in music_dir.listdir())
+    assert names[0] == "a_2021_01_01.mp3" and names[1].startswith("b_")
+    assert len(names) == 2
+    assert music_dir.join("a_2021_01_01.mp3").read() == "a_2021_01_01.mp3"
+    metadata = {command[5]: command[command.index("-metadata") :] for command in commands}
+    assert metadata[str(paths[0])][:-1] == ["-metadata", "title=A", "-metadata", "album=Live"]
+    assert metadata[str(paths[1])][:-1] == ["-metadata", "title=B", "-metadata", "album=Demos"]
+    # The library is read once, to look for the covers of the albums
+    assert len(scans) == 1
+
+    # Files already in the music_dir are not overwritten
+    add_audio_files(config, paths[:1], tags={"title": "A"})
+    assert "already exists" in capsys.readouterr().out
+    assert len(commands) == 3
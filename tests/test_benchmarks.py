@@ -0,0 +1,27 @@
+from benchmarks.library import generate_library
+from earworm.metadata import Config, ImageRef, get_metadata
+
+
+def test_generate_library(tmpdir):
+    music_dir = tmpdir.join("music")
+    rows = generate_library(str(music_dir), 30)
+    assert len(music_dir.listdir()) == 30
+
+    config = Config(music_dir=str(music_dir), use_ffprobe=False)
+    songs = {song.filename: song for song in get_metadata(config)}
+    assert len(songs) == 30
+    for row in rows:
+        song = songs[row["filename"]]
+        assert (song.title, song.artist, song.album) == (row["title"], row["artist"], row["album"])
+        assert song.date == row["date"]
+        assert abs(song.duration - int(row["duration"])) <= 1
+
+    # Every 4th album has no cover, and songs in an album share the cover
+    images = [songs[row["filename"]].image for row in rows]
+    assert images[:10] == [None] * 10
+    assert all(isinstance(image, ImageRef) for image in images[10:])
+    assert len({image.hash for image in images[10:]}) == 2
+    assert all(image.read() for image in images[10:30:3])
+
+    csv_config = Config(music_dir=str(music_dir), metadata_csv=str(tmpdir.join("metadata.csv")))
+    assert len(get_metadata(csv_config)) == 30
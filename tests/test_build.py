@@ -0,0 +1,58 @@
+from earworm.build import Build
+
+
+def test_build(tmpdir):
+    runs = []
+
+    def run_stages(build, value):
+        result = build.run("a", lambda: runs.append("a") or value, inputs={"value": value})
+        output = str(tmpdir.join("b.txt"))
+        build.run(
+            "b",
+            lambda: runs.append("b") or tmpdir.join("b.txt").write(""),
+            inputs={"a": result},
+            outputs=[output],
+        )
+        build.save()
+        return build.report
+
+    report = run_stages(Build(str(tmpdir)), 1)
+    assert report == [("a", "ran (not built before)"), ("b", "ran (not built before)")]
+
+    report = run_stages(Build(str(tmpdir)), 1)
+    assert report == [("a", "skipped"), ("b", "skipped")]
+    assert runs == ["a", "b"]
+
+    tmpdir.join("b.txt").remove()
+    report = run_stages(Build(str(tmpdir)), 1)
+    assert report == [("a", "skipped"), ("b", "ran (outputs missing)")]
+
+    report = run_stages(Build(str(tmpdir)), 2)
+    assert report == [("a", "ran (value changed)"), ("b", "ran (a changed)")]
+
+    report = run_stages(Build(str(tmpdir), force=True), 2)
+    assert report == [("a", "ran (forced)"), ("b", "ran (forced)")]
+
+
+def test_build_watch(tmpdir):
+    out_dir = tmpdir.mkdir("out")
+    runs = []
+
+    def copy():
+        runs.append("copy")
+        out_dir.join("a.txt").write("a")
+
+    def run_stage():
+        build = Build(str(tmpdir))
+        build.run("copy", copy, inputs={}, watch=[str(out_dir)])
+        # Files written by later stages are part of the snapshot
+        out_dir.join("b.txt").write("b")
+        build.save()
+        return build.report
+
+    assert run_stage() == [("copy", "ran (not built before)")]
+    assert run_stage() == [("copy", "skipped")]
+    out_dir.join("a.txt").remove()
+    assert run_stage() == [("copy", "ran (outputs changed)")]
+    assert out_dir.join("a.txt").exists()
+    assert runs == ["copy", "copy"]
@@ -0,0 +1,70 @@
+import gzip
+import os
+
+from earworm import compress
+from earworm.compress import MANIFEST_FILE, precompress_output, remove_compressed_output
+from earworm.manifest import read_manifest
+from earworm.metadata import Config
+
+
+def test_precompress_output(tmpdir, capsys):
+    out_dir = tmpdir.mkdir("public")
+    out_dir.join("index.html").write("<html>" * 100)
+    out_dir.mkdir("songs").join("0001.json").write("[]")
+    out_dir.mkdir("music").join("a.xml").write("not compressed")
+    out_dir.mkdir("covers").join("a.jpg").write("not compressed")
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir), _jobs=2)
+
+    precompress_output(config)
+    assert "2 compressed, 0 unchanged, 0 removed" in capsys.readouterr().out
+    with gzip.open(str(out_dir.join("index.html.gz"))) as f:
+        assert f.read() == b"<html>" * 100
+    assert not out_dir.join("music", "a.xml.gz").exists()
+    assert set(read_manifest(str(out_dir.join(MANIFEST_FILE)))) == {
+        "index.html",
+        os.path.join("songs", "0001.json"),
+    }
+
+    # Touched files with unchanged contents are not compressed again
+    os.utime(str(out_dir.join("index.html")), ns=(0, 0))
+    precompress_output(config)
+    assert "0 compressed, 2 unchanged, 0 removed" in capsys.readouterr().out
+
+    out_dir.join("index.html").write("<body>")
+    out_dir.join("songs", "0001.json").remove()
+    precompress_output(config)
+    assert "1 compressed, 0 unchanged, 1 removed" in capsys.readouterr().out
+    assert not out_dir.join("songs", "0001.json.gz").exists()
+    with gzip.open(str(out_dir.join("index.html.gz"))) as f:
+        assert f.read() == b"<body>"
+
+    # Compressed copies of removed files are removed, even if not in the manifest
+    static_dir = out_dir.mkdir("static")
+    static_dir.join("bundle.0123abcd.js.gz").write("stale")
+    static_dir.join("bundle.0123abcd.js.br").write("stale")
+    static_dir.join("bundle.4567cdef.js").write("js")
+    precompress_output(config)
+    assert "1 compressed, 1 unchanged, 2 removed" in capsys.readouterr().out
+    assert [path.basename for path in static_dir.listdir(sort=True)] == [
+        "bundle.4567cdef.js",
+        "bundle.4567cdef.js.gz",
+    ]
+
+
+def test_remove_compressed_output(tmpdir, capsys, monkeypatch):
+    out_dir = tmpdir.mkdir("public")
+    out_dir.join("index.html").write("<html>")
+    out_dir.join("index.html.br").write("stale")
+    out_dir.join("backup.tar.gz").write("not ours")
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir))
+
+    # .br files are removed when brotli is not installed
+    monkeypatch.setattr(compress, "_brotli", lambda: None)
+    precompress_output(config)
+    assert "1 compressed, 0 unchanged, 1 removed" in capsys.readouterr().out
+    assert not out_dir.join("index.html.br").exists()
+
+    # All the compressed copies are removed when precompress is turned off
+    remove_compressed_output(config)
+    assert "1 removed" in capsys.readouterr().out
+    assert sorted(path.basename for path in out_dir.listdir()) == ["backup.tar.gz", "index.html"]
@@ -0,0 +1,71 @@
+import io
+import struct
+
+from PIL import Image
+
+from earworm.covers import create_covers
+from earworm.metadata import Config, ImageRef, image_hash
+
+from .helpers import make_song
+
+
+def make_image(color, size=(400, 300), mode="RGB"):
+    f = io.BytesIO()
+    Image.new(mode, size, color).save(f, format="PNG")
+    return f.getvalue()
+
+
+def write_id3_with_cover(path, image):
+    body = b"\x00image/png\x00\x03\x00" + image
+    frame = b"APIC" + struct.pack(">I", len(body)) + b"\x00\x00" + body
+    size = len(frame)
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    path.write_binary(b"ID3\x03\x00\x00" + syncsafe + frame)
+
+
+def make_cover_song(tmpdir, name, album="", image=None):
+    path = tmpdir.join(name)
+    if isinstance(image, bytes):
+        write_id3_with_cover(path, image)
+        image = ImageRef(str(path), image_hash(image))
+    return make_song(str(path), album=album, image=image)
+
+
+def test_create_covers(tmpdir, capsys):
+    red, blue = make_image("red"), make_image("blue", size=(100, 100), mode="RGBA")
+    songs = [
+        make_cover_song(tmpdir, "1.mp3", "A", red),
+        make_cover_song(tmpdir, "2.mp3", "A", blue),
+        make_cover_song(tmpdir, "3.mp3", "", red),
+        make_cover_song(tmpdir, "4.mp3", ""),
+        make_cover_song(tmpdir, "5.mp3", "B", "https://example.com/cover.jpg"),
+    ]
+    out_dir = tmpdir.join("public")
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir), _jobs=2)
+
+    new_songs = create_covers(config, songs)
+    assert "2 created" in capsys.readouterr().out
+    covers = [song.cover for song in new_songs]
+    assert covers[0] == covers[2] != covers[1]
+    assert covers[3] == ""
+    assert covers[4] == "https://example.com/cover.jpg"
+    assert covers[0].startswith("covers/") and covers[0].endswith(".jpg")
+    assert Image.open(str(out_dir.join(covers[0]))).size == (300, 300)
+    assert Image.open(str(out_dir.join(covers[1]))).size == (100, 100)
+    # Smaller sizes and WebP versions are written too, but images are not scaled up
+    webp, jpeg = new_songs[1].cover_sources
+    assert webp["type"] == "image/webp" and jpeg["srcset"].split(", ")[1] == f"{covers[1]} 300w"
+    sizes = [
+        Image.open(str(out_dir.join(src.split()[0]))).size for src in webp["srcset"].split(", ")
+    ]
+    assert sizes == [(64, 64), (100, 100), (100, 100)]
+    assert new_songs[1].to_json()["image_sources"] == [webp, jpeg]
+    # Songs passed in are not modified
+    assert all(song.cover == "" for song in songs)
+
+    assert [song.cover for song in create_covers(config, songs[:2])] == covers[:2]
+    assert "0 created, 2 unchanged" in capsys.readouterr().out
+
+    # Covers no longer used by songs are removed
+    create_covers(config, songs[1:2])
+    assert len(out_dir.join("covers").listdir()) == 6
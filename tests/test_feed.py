@@ -0,0 +1,53 @@
+from dataclasses import replace
+
+from earworm.feed import generate_feed
+from earworm.metadata import Config
+
+from .helpers import numbered_songs
+
+
+def make_songs(n):
+    songs = numbered_songs(n, artist="Artist", filesize="1")
+    return [replace(song, date=f"{song.date}T00:00:00+00:00") for song in songs]
+
+
+def test_generate_feed(tmpdir, capsys):
+    out_dir = tmpdir.join("public")
+    out_dir.ensure(dir=True)
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir), base_url="https://example.com/")
+    generate_feed(config, make_songs(5))
+    feed = out_dir.join("index.xml")
+    assert feed.read().count("<item>") == 5
+    assert not out_dir.join("feed").exists()
+    assert "5 entries rendered" in capsys.readouterr().out
+
+    # Unchanged feeds are not re-rendered or rewritten
+    mtime = feed.mtime()
+    generate_feed(config, make_songs(5))
+    assert feed.mtime() == mtime
+    assert "0 entries rendered, 5 cached" in capsys.readouterr().out
+
+    config.feed_max_items = 2
+    generate_feed(config, make_songs(5))
+    current = feed.read()
+    assert current.count("<item>") == 2
+    assert "Song 5" in current and "Song 4" in current
+    assert 'rel="prev-archive"' in current and "feed/0002.xml" in current
+    archives = out_dir.join("feed")
+    assert sorted(p.basename for p in archives.listdir()) == ["0001.xml", "0002.xml"]
+    first = archives.join("0001.xml").read()
+    assert "Song 1" in first and "Song 2" in first and "<fh:archive/>" in first
+    assert 'rel="next-archive"' in first and 'rel="current"' in first
+    assert 'rel="next-archive"' not in archives.join("0002.xml").read()
+
+    # Adding songs only touches the newest archive
+    mtime = archives.join("0001.xml").mtime()
+    generate_feed(config, make_songs(7))
+    assert archives.join("0001.xml").mtime() == mtime
+    assert 'rel="next-archive"' in archives.join("0002.xml").read()
+    assert archives.join("0003.xml").exists()
+
+    config.feed_max_items = 0
+    generate_feed(config, make_songs(7))
+    assert not archives.listdir()
+    assert feed.read().count("<item>") == 7
@@ -0,0 +1,35 @@
+import os
+
+from earworm.manifest import Manifest, file_state, remove_unused
+
+
+def test_manifest(tmpdir):
+    a, b = tmpdir.join("a.mp3"), tmpdir.join("b.mp3")
+    a.write("a")
+    b.write("b")
+    path = str(tmpdir.join("manifest.json"))
+
+    manifest = Manifest(path)
+    entry, old_entry = manifest.add("a", str(a), version=1)
+    assert old_entry is None
+    assert entry["source"] == str(a) and entry["version"] == 1
+    manifest.save()
+
+    # The hash is reused while the size and modification time are unchanged
+    manifest = Manifest(path)
+    manifest.old_entries["a"]["hash"] = "cached"
+    assert manifest.add("a", str(a))[0]["hash"] == "cached"
+    a.write("A")
+    os.utime(str(a), ns=(0, 0))
+    assert manifest.add("a", str(a))[0]["hash"] == file_state(str(a))["hash"] != "cached"
+
+    # Entries derived from another source are not reused
+    assert manifest.add("a", str(b))[1] is None
+
+
+def test_remove_unused(tmpdir):
+    tmpdir.mkdir("x").join("kept").write("")
+    tmpdir.join("x", "stale").write("")
+    tmpdir.join("stale").write("")
+    assert remove_unused(str(tmpdir), {str(tmpdir.join("x", "kept"))}) == 2
+    assert sorted(path.basename for path in tmpdir.visit()) == ["kept", "x"]
@@ -0,0 +1,46 @@
+import os
+
+from earworm.manifest import read_manifest
+from earworm.media import MANIFEST_FILE, copy_media
+from earworm.metadata import Config
+
+from .helpers import make_songs
+
+
+def test_copy_media_incremental(tmpdir, capsys):
+    music_dir = tmpdir.mkdir("music")
+    out_dir = tmpdir.join("public")
+    for name in ("a.mp3", "b.mp3", "c.mp3"):
+        music_dir.join(name).write(name * 1000)
+    config = Config(music_dir=str(music_dir), out_dir=str(out_dir))
+
+    copy_media(config, make_songs(music_dir, ["a.mp3", "b.mp3", "c.mp3"]))
+    assert "3 copied" in capsys.readouterr().out
+    assert out_dir.join("music", "b.mp3").read() == "b.mp3" * 1000
+
+    music_dir.join("b.mp3").write("changed")
+    copy_media(config, make_songs(music_dir, ["a.mp3", "b.mp3"]))
+    output = capsys.readouterr().out
+    assert "1 copied" in output and "1 unchanged" in output and "1 removed" in output
+    assert out_dir.join("music", "b.mp3").read() == "changed"
+    assert not out_dir.join("music", "c.mp3").exists()
+    assert set(read_manifest(str(out_dir.join(MANIFEST_FILE)))) == {"music/a.mp3", "music/b.mp3"}
+
+    # Touched files with unchanged contents are not copied again
+    os.utime(str(music_dir.join("a.mp3")), ns=(0, 0))
+    copy_media(config, make_songs(music_dir, ["a.mp3", "b.mp3"]))
+    assert "2 unchanged" in capsys.readouterr().out
+
+
+def test_copy_media_hardlink(tmpdir, capsys):
+    music_dir = tmpdir.mkdir("music")
+    out_dir = tmpdir.join("public")
+    music_dir.join("a.mp3").write("a")
+    config = Config(music_dir=str(music_dir), out_dir=str(out_dir), media_link="hardlink")
+
+    copy_media(config, make_songs(music_dir, ["a.mp3"]))
+    assert "1 hard-linked" in capsys.readouterr().out
+    assert os.path.samefile(str(music_dir.join("a.mp3")), str(out_dir.join("music", "a.mp3")))
+
+    copy_media(config, make_songs(music_dir, ["a.mp3"]))
+    assert "1 unchanged" in capsys.readouterr().out
@@ -1,13 +1,21 @@
 import os
+import wave
 
 import requests_mock
 
+from earworm import metadata
+from earworm.generate import read_config
 from earworm.metadata import (
     download_file,
+    extract_metadata,
     google_sheet_cell_link,
     is_url,
     Config,
+    ImageRef,
+    Row,
+    Tags,
     get_metadata,
+    get_metadata_from_music_dir,
 )
 
 
@@ -46,6 +54,63 @@ def test_dowload_file(tmpdir):
     assert download_text == text
 
 
+def test_download_file_conditional(tmpdir):
+    url = "https://example.com/metadata.csv"
+    responses = [
+        {"text": "filename,title", "headers": {"ETag": '"v1"'}},
+        {"status_code": 304},
+        {"text": "filename,title,album", "headers": {"ETag": '"v2"'}},
+    ]
+    with requests_mock.Mocker() as m:
+        m.get(url, responses)
+        path = download_file(url, str(tmpdir))
+        assert "If-None-Match" not in m.last_request.headers
+
+        assert download_file(url, str(tmpdir)) == path
+        assert m.last_request.headers["If-None-Match"] == '"v1"'
+        with open(path) as f:
+            assert f.read() == "filename,title"
+
+        assert download_file(url, str(tmpdir)) == path
+        with open(path) as f:
+            assert f.read() == "filename,title,album"
+
+
+def test_metadata_csv_fetched_lazily(tmpdir):
+    url = "https://example.com/metadata.csv"
+    config_path = tmpdir.join("config.yml")
+    config_path.write(f"music_dir: null\nmetadata_csv: {url}\n")
+    with requests_mock.Mocker() as m:
+        m.get(url, text="filename,title\nhttps://example.com/a.mp3,A\n")
+        config = read_config(str(config_path))
+        assert not m.called
+        songs = get_metadata(config)
+        assert m.call_count == 1
+    assert [song.title for song in songs] == ["A"]
+    assert config.metadata_csv == str(tmpdir.join("metadata.csv"))
+
+
+def test_get_metadata_from_csv_malformed_rows(tmpdir, capsys):
+    music_dir = tmpdir.mkdir("music")
+    music_dir.join("a.mp3").write("")
+    music_dir.join("b.mp3").write("")
+    csv_path = tmpdir.join("metadata.csv")
+    csv_path.write(
+        "Filename,Title,Rating\n"
+        "a.mp3,A,5\n"
+        "b.mp3,B,4,extra\n"
+        ",No file,3\n"
+        "missing.mp3,Missing,2\n"
+    )
+    config = Config(music_dir=str(music_dir), metadata_csv=str(csv_path))
+    songs = get_metadata(config)
+    assert [song.title for song in songs] == ["A"]
+    output = capsys.readouterr().out
+    assert "unknown columns ignored: rating" in output
+    assert "line 3: 1 more values than there are columns" in output
+    assert "line 4: no filename" in output
+
+
 def test_google_sheet_cell_link():
     example_url = "https://docs.google.com/spreadsheets/d/1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms/export?format=csv&id=1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms&gid=0"
     url = google_sheet_cell_link(example_url, 10)
@@ -57,5 +122,87 @@ def test_get_metadata_from_csv():
     config = Config(music_dir=None, metadata_csv=csv_path)
     songs = get_metadata(config)
     assert len(songs) == 4
-    assert all(is_url(s["filename"]) for s in songs)
-    assert all(is_url(s["image"]) for s in songs)
+    assert all(is_url(s.filename) for s in songs)
+    assert all(is_url(s.image) for s in songs)
+
+
+def test_metadata_cache(tmpdir, monkeypatch):
+    music_dir = tmpdir.mkdir("music")
+    for name in ("a_2021_01_01.mp3", "b_2021_01_02.mp3"):
+        music_dir.join(name).write("not really an mp3")
+
+    calls = []
+
+    def read_file_metadata(path, use_ffprobe=True):
+        calls.append(path)
+        return Tags(title=os.path.basename(path), duration=10.0, _image=ImageRef(path, "abcd"))
+
+    monkeypatch.setattr(metadata, "read_file_metadata", read_file_metadata)
+    config = Config(music_dir=str(music_dir), _cache_path=str(tmpdir.join("cache.sqlite3")))
+
+    first = get_metadata_from_music_dir(config)
+    assert len(calls) == 2
+
+    second = get_metadata_from_music_dir(config)
+    assert len(calls) == 2
+    assert second == first
+    assert all(tags.get_image() == ImageRef(path, "abcd") for path, tags in second.items())
+    assert {tags.date for tags in second.values()} == {"2021-01-01", "2021-01-02"}
+
+    music_dir.join("b_2021_01_02.mp3").write("changed")
+    get_metadata_from_music_dir(config)
+    assert len(calls) == 3 and calls[-1].endswith("b_2021_01_02.mp3")
+
+    config._rebuild_cache = True
+    get_metadata_from_music_dir(config)
+    assert len(calls) == 5
+
+
+def test_metadata_cache_without_ffprobe(tmpdir, monkeypatch):
+    music_dir = tmpdir.mkdir("music")
+    music_dir.join("a.mp3").write("not really an mp3")
+    calls = []
+
+    def read_file_metadata(path, use_ffprobe=True):
+        calls.append(path)
+        return Row(filename=os.path.basename(path))
+
+    monkeypatch.setattr(metadata, "read_file_metadata", read_file_metadata)
+    monkeypatch.setattr(metadata.shutil, "which", lambda name: None)
+    config = Config(music_dir=str(music_dir), _cache_path=str(tmpdir.join("cache.sqlite3")))
+
+    # Placeholder rows are read again, until ffprobe is installed
+    get_metadata_from_music_dir(config)
+    get_metadata_from_music_dir(config)
+    assert len(calls) == 2
+
+    monkeypatch.setattr(metadata.shutil, "which", lambda name: f"/usr/bin/{name}")
+    get_metadata_from_music_dir(config)
+    get_metadata_from_music_dir(config)
+    assert len(calls) == 3
+
+
+def write_wav(path, seconds=1):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(b"\0\0" * 8000 * seconds)
+
+
+def test_extract_metadata_parallel(tmpdir):
+    paths = []
+    for i in range(1, 6):
+        path = tmpdir.join(f"song_{i}.wav")
+        write_wav(path, seconds=i)
+        paths.append(str(path))
+    broken = tmpdir.mkdir("broken.wav")
+    paths.insert(2, str(broken))
+
+    serial, serial_errors = extract_metadata(paths, use_ffprobe=False, jobs=1)
+    parallel, parallel_errors = extract_metadata(iter(paths), use_ffprobe=False, jobs=3)
+
+    assert list(parallel) == list(serial)
+    assert parallel == serial
+    assert [tags.duration for tags in parallel.values()] == [1, 2, 3, 4, 5]
+    assert list(serial_errors) == list(parallel_errors) == [str(broken)]
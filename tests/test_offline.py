@@ -0,0 +1,45 @@
+import json
+import re
+from dataclasses import replace
+
+from earworm.covers import cover_sources
+from earworm.metadata import Config
+from earworm.offline import SERVICE_WORKER_FILE, generate_service_worker
+
+from .helpers import make_songs
+
+
+def read_precache(out_dir):
+    sw = out_dir.join(SERVICE_WORKER_FILE).read()
+    return json.loads(re.search(r"const PRECACHE = (.*);", sw).group(1))
+
+
+def test_generate_service_worker(tmpdir, capsys):
+    out_dir = tmpdir.mkdir("public")
+    out_dir.join("index.html").write("<html>")
+    static_dir = out_dir.mkdir("static")
+    static_dir.join("bundle.js").write("js")
+    static_dir.join("bundle.js.gz").write("gz")
+    static_dir.mkdir(".webassets-cache")
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir), service_worker=True)
+    cover = "covers/0123456789abcdef.jpg"
+    songs = [
+        replace(song, cover=cover, cover_sources=cover_sources(cover))
+        for song in make_songs(tmpdir, ["a.mp3", "b.mp3"])
+    ]
+
+    generate_service_worker(config, songs)
+    precache = read_precache(out_dir)
+    urls = [entry["url"] for entry in precache]
+    assert urls[:2] == ["./", "static/bundle.js"]
+    # Thumbnails of the covers are precached once, in each format
+    assert set(urls[2:]) <= {"covers/0123456789abcdef-64.webp", "covers/0123456789abcdef-64.jpg"}
+    assert "covers/0123456789abcdef-64.jpg" in urls[2:]
+    assert 'const MEDIA_DIR = "music";' in out_dir.join(SERVICE_WORKER_FILE).read()
+
+    generate_service_worker(config, songs)
+    assert "unchanged" in capsys.readouterr().out.splitlines()[-1]
+
+    out_dir.join("index.html").write("<html>changed")
+    generate_service_worker(config, songs)
+    assert read_precache(out_dir)[0]["revision"] != precache[0]["revision"]
@@ -0,0 +1,29 @@
+import json
+
+from earworm.metadata import Config
+from earworm.pages import write_song_pages
+
+from .helpers import numbered_songs
+
+
+def test_write_song_pages(tmpdir):
+    out_dir = tmpdir.join("public")
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir))
+    songs, manifest = write_song_pages(config, numbered_songs(3))
+    assert len(songs) == 3
+    assert manifest == {"total": 3, "duration": 180, "pages": []}
+    assert not out_dir.join("songs").exists()
+
+    config.songs_per_page = 4
+    songs, manifest = write_song_pages(config, numbered_songs(10))
+    assert [song["title"] for song in songs] == ["Song 10", "Song 9"]
+    assert manifest["total"] == 10 and manifest["duration"] == 600
+    assert [page["count"] for page in manifest["pages"]] == [4, 4]
+    assert manifest["pages"][0]["url"].startswith("songs/0002.json?v=")
+    page = json.loads(out_dir.join("songs", "0001.json").read())
+    assert [song["title"] for song in page] == ["Song 4", "Song 3", "Song 2", "Song 1"]
+
+    # Adding a song only changes the newest page
+    _, new_manifest = write_song_pages(config, numbered_songs(11))
+    assert new_manifest["pages"][-2:] == manifest["pages"]
+    assert len(out_dir.join("songs").listdir()) == 4
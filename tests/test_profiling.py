@@ -0,0 +1,46 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from earworm import profiling
+
+
+def test_profiling(tmpdir, capsys):
+    # Nothing is recorded when profiling is off
+    with profiling.span("off"):
+        profiling.count("off")
+    assert profiling.disable() is None
+
+    profiler = profiling.enable()
+    try:
+        for path in ("a", "b"):
+            with profiling.span("read", path=path):
+                profiling.count("files")
+    finally:
+        profiling.disable()
+
+    assert [event["args"]["path"] for event in profiler.events] == ["a", "b"]
+    assert profiler.counters == {"files": 2}
+
+    profiler.print_summary()
+    output = capsys.readouterr().out
+    assert "read" in output and "files" in output
+
+    trace = tmpdir.join("trace.json")
+    profiler.write_trace(str(trace))
+    events = json.loads(trace.read())["traceEvents"]
+    assert [event["ph"] for event in events] == ["X", "X", "C"]
+
+
+def test_profiling_workers():
+    profiler = profiling.enable()
+    try:
+        # Spans of worker processes are recorded by the parent
+        with ProcessPoolExecutor(2) as pool:
+            for timed in pool.map(profiling.Timed(abs), [-1, -2]):
+                profiling.record("abs", timed, value=timed[0])
+    finally:
+        profiling.disable()
+
+    assert [event["args"]["value"] for event in profiler.events] == [1, 2]
+    assert all(event["pid"] != os.getpid() for event in profiler.events)
@@ -0,0 +1,93 @@
+import os
+import sys
+import types
+
+from earworm import publish
+from earworm.metadata import Config
+from earworm.publish import LocalBackend, publish_site
+
+
+def test_publish_site(tmpdir, capsys, monkeypatch):
+    out_dir = tmpdir.mkdir("public")
+    target = tmpdir.join("www")
+    out_dir.join("index.html").write("<html>")
+    out_dir.mkdir("music").join("a.mp3").write("a" * 1000)
+    out_dir.join("music", "b.mp3").write("b" * 1000)
+    out_dir.join(".earworm-media.json").write("{}")
+    config = Config(music_dir="", out_dir=str(out_dir), publish_target=str(target), _jobs=2)
+
+    uploads = []
+
+    class Backend(LocalBackend):
+        def upload(self, src, key):
+            uploads.append(key)
+            super().upload(src, key)
+
+    monkeypatch.setattr(publish, "LocalBackend", Backend)
+    publish_site(config)
+    assert "3 files to upload" in capsys.readouterr().out
+    # Pages are uploaded after the files they refer to
+    assert uploads[-1] == "index.html"
+    assert target.join("music", "a.mp3").read() == "a" * 1000
+    assert not target.join(".earworm-media.json").exists()
+
+    # Only changed files are uploaded, and removed files are deleted
+    uploads.clear()
+    out_dir.join("index.html").write("<html>changed")
+    out_dir.join("music", "b.mp3").remove()
+    os.utime(str(out_dir.join("music", "a.mp3")), ns=(0, 0))
+    publish_site(config, dry_run=True)
+    assert "1 files to upload (0.0 MiB), 1 to delete, 1 unchanged" in capsys.readouterr().out
+    assert uploads == [] and target.join("music", "b.mp3").exists()
+
+    publish_site(config)
+    assert uploads == ["index.html"]
+    assert target.join("index.html").read() == "<html>changed"
+    assert not target.join("music", "b.mp3").exists()
+
+    uploads.clear()
+    publish_site(config, force=True)
+    assert len(uploads) == 2
+
+
+def test_publish_site_s3(tmpdir, capsys, monkeypatch):
+    out_dir = tmpdir.mkdir("public")
+    out_dir.join("index.html").write("<html>")
+    out_dir.mkdir("static").join("bundle.0123abcd.js").write("js")
+    out_dir.mkdir("music").join("a.mp3").write("a")
+    config = Config(music_dir="", out_dir=str(out_dir), publish_target="s3://bucket/site/")
+
+    uploads, deletes = {}, []
+
+    class Client:
+        def upload_file(self, src, bucket, key, ExtraArgs):
+            assert bucket == "bucket"
+            uploads[key] = ExtraArgs
+
+        def delete_object(self, Bucket, Key):
+            deletes.append(Key)
+
+    boto3 = types.ModuleType("boto3")
+    boto3.client = lambda service, endpoint_url: Client()  # type: ignore
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+    publish_site(config)
+    assert sorted(uploads) == [
+        "site/index.html",
+        "site/music/a.mp3",
+        "site/static/bundle.0123abcd.js",
+    ]
+    assert uploads["site/index.html"] == {"ContentType": "text/html", "CacheControl": "no-cache"}
+    assert uploads["site/music/a.mp3"]["ContentType"] == "audio/mpeg"
+    # Content-hashed bundles are cached for good, other files are revalidated
+    bundle = uploads["site/static/bundle.0123abcd.js"]
+    assert bundle["CacheControl"] == "public, max-age=31536000, immutable"
+    assert bundle["ContentType"].endswith("javascript")
+    assert uploads["site/music/a.mp3"]["CacheControl"] == "no-cache"
+
+    # Only changed files are uploaded, and removed files are deleted
+    uploads.clear()
+    out_dir.join("index.html").write("<html>changed")
+    out_dir.join("music", "a.mp3").remove()
+    publish_site(config)
+    assert list(uploads) == ["site/index.html"]
+    assert deletes == ["site/music/a.mp3"]
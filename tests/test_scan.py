@@ -0,0 +1,34 @@
+import os
+
+from earworm.scan import IGNORE_FILE, iter_audio_files
+
+
+def test_iter_audio_files(tmpdir):
+    music_dir = tmpdir.mkdir("music")
+    music_dir.join("b.mp3").write("")
+    music_dir.join("a.FLAC").write("")
+    music_dir.join("cover.jpg").write("")
+    music_dir.join("lyrics.txt").write("")
+    music_dir.join(".DS_Store").write("")
+    music_dir.join("untitled").write_binary(b"ID3\x04\x00")
+    music_dir.join("README").write("not audio")
+    album = music_dir.mkdir("album")
+    album.join("track_01.ogg").write("")
+    album.join("track_02.ogg.part").write("")
+    drafts = music_dir.mkdir("drafts")
+    drafts.join("draft.mp3").write("")
+    music_dir.join(IGNORE_FILE).write("# Work in progress\ndrafts/\n*_02.ogg\nalbum/track_01.ogg\n")
+
+    names = [os.path.relpath(e.path, str(music_dir)) for e in iter_audio_files(str(music_dir))]
+    assert names == ["a.FLAC", "b.mp3", "untitled"]
+
+    music_dir.join(IGNORE_FILE).write("drafts\n")
+    names = [
+        os.path.relpath(e.path, str(music_dir))
+        for e in iter_audio_files(str(music_dir), extensions=[".ogg"], sniff=False)
+    ]
+    assert names == [os.path.join("album", "track_01.ogg")]
+
+
+def test_iter_audio_files_missing_dir(tmpdir):
+    assert list(iter_audio_files(str(tmpdir.join("missing")))) == []
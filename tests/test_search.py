@@ -0,0 +1,54 @@
+import json
+from dataclasses import replace
+
+from earworm import search
+from earworm.metadata import Config
+from earworm.search import build_segment, tokens, write_search_index
+
+from .helpers import numbered_songs
+
+
+def test_tokens():
+    assert tokens("Ça va") == {"^c", "^ca", "^v", "^va"}
+    assert tokens("Raga_Yaman") == {"^r", "^ra", "rag", "aga", "^y", "^ya", "yam", "ama", "man"}
+
+
+def test_build_segment():
+    docs = [
+        ["a", "Raga Yaman", "", "", ""],
+        ["b", "Yaman", "", "", ""],
+        ["c", "Bhairav", "", "", ""],
+    ]
+    segment = build_segment(docs)
+    assert segment["docs"] == docs
+    # Lists of songs are delta-encoded
+    assert segment["index"]["yam"] == [0, 1]
+    assert segment["index"]["^b"] == [2]
+
+
+def test_write_search_index(tmpdir, capsys, monkeypatch):
+    out_dir = tmpdir.join("public")
+    config = Config(music_dir=str(tmpdir), out_dir=str(out_dir), search=True)
+    monkeypatch.setattr(search, "SEGMENT_SIZE", 4)
+    manifest = write_search_index(config, numbered_songs(10))
+    assert [segment["count"] for segment in manifest["segments"]] == [2, 4, 4]
+    assert manifest["segments"][0]["url"].startswith("search/0003.json?v=")
+    segment = json.loads(out_dir.join("search", "0001.json").read())
+    assert [doc[1] for doc in segment["docs"]] == ["Song 4", "Song 3", "Song 2", "Song 1"]
+    assert "3 of 3 segments built" in capsys.readouterr().out
+
+    # Adding a song only rebuilds the newest segment
+    new_manifest = write_search_index(config, numbered_songs(11))
+    assert new_manifest["segments"][1:] == manifest["segments"][1:]
+    assert "1 of 3 segments built" in capsys.readouterr().out
+
+    # Changing a song rebuilds its segment, and removed segments are deleted
+    songs = numbered_songs(4)
+    songs[0] = replace(songs[0], title="Changed")
+    manifest = write_search_index(config, songs)
+    assert manifest["segments"][0]["url"] != new_manifest["segments"][-1]["url"]
+    assert "1 of 1 segments built" in capsys.readouterr().out
+    assert sorted(out_dir.join("search").listdir()) == [
+        out_dir.join("search", "0001.json"),
+        out_dir.join("search", "index.json"),
+    ]
@@ -0,0 +1,43 @@
+import functools
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+from earworm.scan import snapshot
+from earworm.serve import Handler, Reloader, changed_stage, inject_live_reload
+
+
+def test_snapshot(tmpdir):
+    music = tmpdir.mkdir("music")
+    music.join("a.mp3").write("a")
+    music.join(".earworm-cache.sqlite3").write("")
+    out_dir = music.mkdir("public")
+    out_dir.join("index.html").write("")
+    files = snapshot([str(music)], exclude=str(out_dir))
+    assert list(files) == [str(music.join("a.mp3"))]
+
+    old = {"config": {}, "metadata": files, "template": {}}
+    assert changed_stage(old, dict(old)) is None
+    music.join("b.mp3").write("b")
+    new = dict(old, metadata=snapshot([str(music)], exclude=str(out_dir)))
+    assert changed_stage(old, new) == "metadata"
+
+
+def test_live_reload(tmpdir):
+    assert inject_live_reload(b"<body></body>").startswith(b"<body><script>")
+    tmpdir.join("index.html").write("<html><body></body></html>")
+    reloader = Reloader()
+    handler = type("Handler", (Handler,), {"reloader": reloader})
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(handler, directory=str(tmpdir))
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    try:
+        assert b"EventSource" in urllib.request.urlopen(url).read()
+        with urllib.request.urlopen(url + "__earworm/reload") as events:
+            reloader.notify()
+            assert events.readline() == b"data: reload\n"
+    finally:
+        server.shutdown()
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import earworm
+
+# Packages that slow down the startup, and are only imported when used
+HEAVY_MODULES = (
+    "jinja2",
+    "webassets",
+    "PIL",
+    "feedgen",
+    "dateutil",
+    "requests",
+    "tinytag",
+    "numpy",
+)
+
+CHECK_IMPORTS = """
+import sys
+{code}
+heavy = {modules!r}
+print(" ".join(sorted({{name.split(".")[0] for name in sys.modules}} & set(heavy))))
+"""
+
+
+def imported_heavy_modules(code, cwd=None):
+    script = CHECK_IMPORTS.format(code=code, modules=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(earworm.__file__)))
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=cwd, env=env)
+    return output.decode().split("\n")[-2].split()
+
+
+def test_startup_imports(tmpdir):
+    assert imported_heavy_modules("import earworm.generate") == []
+
+    code = "from earworm.generate import main; sys.argv[1:] = ['make-config']; main()"
+    assert imported_heavy_modules(code, cwd=str(tmpdir)) == []
+    assert tmpdir.join("config.yml").exists()
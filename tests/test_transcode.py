@@ -0,0 +1,96 @@
+import shutil
+import subprocess
+
+import pytest
+
+from earworm.manifest import read_manifest, write_manifest
+from earworm.metadata import Config
+from earworm.transcode import MANIFEST_FILE, Rendition, set_sources, transcode_media
+
+from .helpers import make_songs
+
+
+def test_parse_rendition():
+    rendition = Rendition.parse("opus-64k")
+    assert (rendition.codec, rendition.extension, rendition.bitrate) == ("libopus", "opus", 64)
+    assert Rendition.parse("aac-128k").mime_type.startswith("audio/mp4")
+    with pytest.raises(ValueError):
+        Rendition.parse("wav-64k")
+    with pytest.raises(ValueError):
+        Rendition.parse("opus")
+
+
+def test_set_sources(tmpdir, capsys):
+    out_dir = tmpdir.mkdir("public")
+    config = Config(
+        music_dir=str(tmpdir), out_dir=str(out_dir), renditions=["aac-128k", "opus-64k"]
+    )
+    songs = make_songs(tmpdir, ["a.ogg", "b.amr", "c.mp3", "d.amr"])
+    write_manifest(
+        str(out_dir.join(MANIFEST_FILE)),
+        {
+            "music/a.ogg": {
+                "source": songs[0].path,
+                "renditions": {"opus-64k": "", "aac-128k": ""},
+            },
+            # The aac rendition of b.amr failed
+            "music/b.amr": {"source": songs[1].path, "renditions": {"opus-64k": ""}},
+        },
+    )
+    song, amr, mp3 = set_sources(config, songs)
+    assert song.sources == (
+        {"src": "music/renditions/opus-64k/a.ogg.opus", "type": "audio/ogg; codecs=opus"},
+        {"src": "music/renditions/aac-128k/a.ogg.m4a", "type": "audio/mp4; codecs=mp4a.40.2"},
+        {"src": "music/a.ogg", "type": "audio/ogg"},
+    )
+    assert song.to_json()["sources"] == list(song.sources)
+    # Songs in unsupported formats are only played from their renditions
+    assert [source["src"] for source in amr.sources] == ["music/renditions/opus-64k/b.amr.opus"]
+    # Songs that were not transcoded yet are only played from their original file
+    assert mp3.sources == ({"src": "music/c.mp3", "type": "audio/mpeg"},)
+    # Songs in unsupported formats without any rendition are dropped
+    assert "unsupported formats:\n    " + songs[3].path in capsys.readouterr().out
+    assert "sources" not in make_songs(tmpdir, ["a.ogg"])[0].to_json()
+
+
+def fake_ffmpeg(commands):
+    def run(command, **kwargs):
+        commands.append(command)
+        if "missing" in command[5]:
+            raise subprocess.CalledProcessError(1, command, stderr=b"Invalid data")
+        shutil.copy(command[5], command[-1])
+
+    return run
+
+
+def test_transcode_media_cached(tmpdir, capsys, monkeypatch):
+    music_dir = tmpdir.mkdir("music")
+    out_dir = tmpdir.join("public")
+    for name in ("a.mp3", "b.amr", "missing.mp3"):
+        music_dir.join(name).write(name)
+    config = Config(
+        music_dir=str(music_dir), out_dir=str(out_dir), renditions=["opus-64k"], _jobs=2
+    )
+    commands: list = []
+    monkeypatch.setattr(subprocess, "run", fake_ffmpeg(commands))
+
+    written = transcode_media(config, make_songs(music_dir, ["a.mp3", "b.amr", "missing.mp3"]))
+    assert written["music/b.amr"] == ["opus-64k"] and written["music/missing.mp3"] == []
+    output = capsys.readouterr().out
+    assert "2 transcoded, 1 failed" in output and "Invalid data" in output
+    assert out_dir.join("music", "renditions", "opus-64k", "b.amr.opus").read() == "b.amr"
+    assert len(commands) == 3
+
+    # Unchanged files are not transcoded again, even if they were touched
+    music_dir.join("a.mp3").setmtime(0)
+    transcode_media(config, make_songs(music_dir, ["a.mp3", "b.amr"]))
+    assert "0 transcoded, 0 failed, 2 unchanged, 0 removed" in capsys.readouterr().out
+    assert len(commands) == 3
+
+    # Changed files and settings are
+    music_dir.join("a.mp3").write("changed")
+    config.renditions = ["opus-64k", "aac-96k"]
+    transcode_media(config, make_songs(music_dir, ["a.mp3"]))
+    assert "2 transcoded, 0 failed, 0 unchanged, 1 removed" in capsys.readouterr().out
+    manifest = read_manifest(str(out_dir.join(MANIFEST_FILE)))
+    assert set(manifest["music/a.mp3"]["renditions"]) == {"opus-64k", "aac-96k"}
@@ -0,0 +1,90 @@
+import io
+import subprocess
+from array import array
+
+import pytest
+
+from earworm import waveform
+from earworm.metadata import Config
+from earworm.waveform import (
+    BLOCK_SIZE,
+    MANIFEST_FILE,
+    block_peaks,
+    create_waveforms,
+    merge_peaks,
+    set_waveforms,
+)
+
+from .helpers import make_songs
+
+np = pytest.importorskip("numpy")
+
+
+class SmallReads(io.BytesIO):
+    """A pipe, that returns less than asked for."""
+
+    def read(self, size=-1):
+        return super().read(min(size, 999))
+
+
+def test_peaks():
+    samples = array("h", [0] * BLOCK_SIZE * 3)
+    samples[10], samples[BLOCK_SIZE + 5] = -32768, 32767
+    samples.extend([256, -512])
+    mins, maxs = block_peaks(SmallReads(samples.tobytes() + b"\x00"))
+    assert list(mins) == [-32768, 0, 0, -512]
+    assert list(maxs) == [0, 32767, 0, 256]
+    assert list(merge_peaks(mins, maxs)) == [128, 0, 0, 127, 0, 0, 254, 1]
+    # Peaks are merged into at most n buckets
+    assert merge_peaks(mins, maxs, n=2) == bytes([128, 127, 254, 1])
+    assert merge_peaks(*block_peaks(io.BytesIO())) == b""
+
+
+def fake_ffmpeg(commands):
+    # The test files contain raw samples, that are "decoded" as is
+    class Popen:
+        def __init__(self, command, stdout, stderr):
+            commands.append(command)
+            self.stdout = open(command[4], "rb")
+            self.returncode = 1 if "missing" in command[4] else 0
+            stderr.write(b"Invalid data" if self.returncode else b"")
+
+        def wait(self):
+            return self.returncode
+
+    return Popen
+
+
+def test_create_waveforms_cached(tmpdir, capsys, monkeypatch):
+    music_dir = tmpdir.mkdir("music")
+    out_dir = tmpdir.join("public")
+    for name in ("a.mp3", "b.ogg", "missing.mp3"):
+        music_dir.join(name).write_binary(array("h", range(-2000, 2000)).tobytes())
+    config = Config(music_dir=str(music_dir), out_dir=str(out_dir), waveforms=True)
+    commands: list = []
+    monkeypatch.setattr(subprocess, "Popen", fake_ffmpeg(commands))
+
+    songs = make_songs(music_dir, ["a.mp3", "b.ogg", "missing.mp3"])
+    assert create_waveforms(config, songs) == ["music/a.mp3", "music/b.ogg"]
+    output = capsys.readouterr().out
+    assert "2 computed, 1 failed, 0 unchanged" in output
+    assert "missing.mp3 (Invalid data)" in output
+    assert len(out_dir.join("waveforms", "a.mp3.peaks").read_binary()) == 10
+    assert not out_dir.join("waveforms", "missing.mp3.peaks").exists()
+    # Only songs with a waveform get its URL
+    a, _, missing = set_waveforms(config, songs)
+    assert a.to_json()["waveform"] == "waveforms/a.mp3.peaks"
+    assert "waveform" not in missing.to_json()
+
+    # Only new, changed or failed songs are decoded again
+    commands.clear()
+    music_dir.join("b.ogg").write_binary(b"\x00\x01" * 10)
+    create_waveforms(config, songs[1:])
+    assert "1 computed, 1 failed, 0 unchanged, 1 removed" in capsys.readouterr().out
+    assert [command[4] for command in commands] == [songs[1].path, songs[2].path]
+    assert out_dir.join("waveforms", "b.ogg.peaks").read_binary() == b"\x01\x01"
+    assert not out_dir.join("waveforms", "a.mp3.peaks").exists()
+    assert "missing.mp3" not in waveform.read_manifest(str(out_dir.join(MANIFEST_FILE)))
+
+    create_waveforms(config, songs[1:2])
+    assert "0 computed, 0 failed, 1 unchanged" in capsys.readouterr().out